@@ -5,20 +5,46 @@
 スマホ・タブレット完全対応版
 """
 
-from flask import Flask, render_template_string, jsonify, request, send_file
+from flask import Flask, jsonify, request, send_file
+from werkzeug.wsgi import ClosingIterator
+from werkzeug.datastructures import MultiDict
 import sqlite3
 import os
 from pathlib import Path
 import webbrowser
 from threading import Thread, Lock
+from collections import OrderedDict
 import time
 import random
 import logging
 import json
+import gzip
+import zlib
+import io
+import csv
+import sys
+import itertools
+import bisect
+import heapq
+import re
+import hashlib
+import secrets
+import math
+import struct
+import shutil
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
+try:
+    import brotli  # 任意。あれば brotli 圧縮版も用意する
+except ImportError:
+    brotli = None
+
 # --- 設定 ---
-DB_DIR = Path.home() / '.video_manager'
+# VIDEO_MANAGER_HOME でデータの置き場所を変えられる (ベンチマークや複数ライブラリの切り替え用)
+DB_DIR = Path(os.environ.get('VIDEO_MANAGER_HOME') or Path.home() / '.video_manager')
 DB_PATH = DB_DIR / 'videos.db'
 DB_DIR.mkdir(parents=True, exist_ok=True)
 LOG_PATH = DB_DIR / 'scan.log'
@@ -27,6 +53,127 @@ EXPORT_DIR.mkdir(parents=True, exist_ok=True)
 VIDEO_EXTENSIONS = {'.mp4', '.mkv', '.avi', '.mov', '.wmv', '.flv', '.webm', '.m4v', '.mpg', '.mpeg', '.ts', '.m2ts'}
 BATCH_SIZE = 500
 
+# ショート動画のサンプリング
+SHORTS_PAGE_SIZE = 50
+SHORTS_SAMPLE_ATTEMPTS = 4  # 1件あたりの試行回数 (既読/同一フォルダのときに引き直す)
+SHORTS_MAX_SESSIONS = 200
+SHORTS_SEEN_LIMIT = 20000
+
+# シークプレビュー (スプライトシート + WebVTT)
+PREVIEW_DIR = DB_DIR / 'previews'
+PREVIEW_DIR.mkdir(parents=True, exist_ok=True)
+PREVIEW_INTERVAL = 10  # 秒。長い動画はタイル数上限に合わせて間隔を広げる
+PREVIEW_MAX_TILES = 100
+PREVIEW_COLS = 10
+PREVIEW_TILE_W = 160
+PREVIEW_TILE_H = 90
+
+# faststart (moov 先頭) リマックスキャッシュ
+FASTSTART_DIR = DB_DIR / 'faststart'
+FASTSTART_DIR.mkdir(parents=True, exist_ok=True)
+FASTSTART_CACHE_BYTES = 20 * 1024 ** 3
+FASTSTART_EXTENSIONS = {'.mp4', '.m4v', '.mov'}
+
+# 低ビットレートのプロキシ (480p/720p)。ffmpeg がある場合のみ定期生成する
+PROXY_ENABLED = True
+PROXY_DIR = DB_DIR / 'proxies'
+PROXY_DIR.mkdir(parents=True, exist_ok=True)
+PROXY_QUOTA_BYTES = 50 * 1024 ** 3
+PROXY_INTERVAL = 30 * 60  # 秒
+PROXY_BATCH = 20  # 1回の実行で処理する動画数
+PROXY_RENDITIONS = {480: ('1000k', '96k'), 720: ('2500k', '128k')}  # 高さ: (映像, 音声) ビットレート
+
+# ストリーミング制御 (クライアントごとの同時ストリーム数と帯域)
+STREAM_MAX_PER_CLIENT = 3
+STREAM_CLIENT_RATE = 100 * 1000 * 1000 // 8  # バイト/秒 (100 Mbps)。0 で無制限
+STREAM_TOTAL_RATE = 0  # サーバー全体の上限。0 で無制限
+STREAM_BURST_SECONDS = 2
+STREAM_PRELOAD_SHARE = 0.2  # 再生中ストリームがあるとき、先読みに回す帯域の上限 (割合)
+STREAM_PRELOAD_POLL = 0.05  # 秒。再生中の先読みが共有バケットの空きを待つ間隔
+
+# メディア情報プローブ
+PROBE_WORKERS = max(1, min(8, (os.cpu_count() or 2) - 1))
+# ブラウザで直接再生できるコンテナ/コーデックの組み合わせ
+PLAYABLE_CONTAINERS = {'mp4', 'webm'}
+PLAYABLE_VCODECS = {'h264', 'vp8', 'vp9', 'av1'}
+PLAYABLE_ACODECS = {'aac', 'mp3', 'opus', 'vorbis', 'flac', None}
+
+# ヘッダー解析で扱う形式 (それ以外は ffprobe にフォールバック)
+HEADER_PARSE_EXTENSIONS = {'.mp4', '.mov', '.m4v', '.mkv', '.webm'}
+MOOV_MAX_BYTES = 64 * 1024 * 1024
+MP4_EPOCH_OFFSET = 2082844800  # 1904-01-01 → 1970-01-01
+MKV_EPOCH_OFFSET = 978307200   # 2001-01-01 → 1970-01-01
+MP4_CODECS = {
+    'avc1': 'h264', 'avc3': 'h264', 'hvc1': 'hevc', 'hev1': 'hevc', 'av01': 'av1', 'vp09': 'vp9', 'vp08': 'vp8',
+    'mp4v': 'mpeg4', 'mp4a': 'aac', '.mp3': 'mp3', 'Opus': 'opus', 'fLaC': 'flac', 'ac-3': 'ac3', 'ec-3': 'eac3',
+}
+MKV_CODECS = {
+    'V_MPEG4/ISO/AVC': 'h264', 'V_MPEGH/ISO/HEVC': 'hevc', 'V_VP8': 'vp8', 'V_VP9': 'vp9', 'V_AV1': 'av1',
+    'A_AAC': 'aac', 'A_OPUS': 'opus', 'A_VORBIS': 'vorbis', 'A_MPEG/L3': 'mp3', 'A_FLAC': 'flac',
+    'A_AC3': 'ac3', 'A_EAC3': 'eac3',
+}
+
+# 外部ツール (見つからない場合は関連機能を無効化)
+FFMPEG_BIN = shutil.which('ffmpeg')
+FFPROBE_BIN = shutil.which('ffprobe')
+
+# UI アセット (起動時に一度だけ組み立てて圧縮しておく)
+ASSET_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+SHELL_CACHE_CONTROL = 'no-cache'
+# Service Worker のキャッシュ上限
+SW_API_PATHS = ['/api/batch', '/api/stats', '/api/folders']
+SW_MAX_API_ENTRIES = 20
+SW_MAX_THUMB_ENTRIES = 400
+SW_MAX_ENTRY_BYTES = 2 * 1024 * 1024
+SW_THUMB_MAX_AGE = 24 * 3600
+
+# JSON API の圧縮と条件付きリクエスト
+JSON_COMPRESS_MIN_BYTES = 1024
+JSON_COMPRESS_LEVEL = 6
+# 読み取り系クエリの結果キャッシュ (キーに世代番号を含めるので書き込みで正確に無効化される)
+QUERY_CACHE_MAX_ENTRIES = 512
+QUERY_CACHE_MAX_BYTES = 64 * 1024 * 1024
+BATCH_MAX_REQUESTS = 16
+EVENTS_MAX_BATCH = 500
+EVENTS_MAX_AGE = 7 * 24 * 3600  # 秒。これより古いクライアント時刻は丸める
+# 検索サジェスト
+SUGGEST_PREFIX_LEN = 3  # この長さまでのプレフィックスは上位候補を事前計算する
+SUGGEST_DEFAULT_K = 8
+SUGGEST_MAX_K = 20
+# 長いプレフィックスで走査するキー数の上限。一致するキーがこれより多いと、キー順で先頭のこの件数の中から
+# 上位を選ぶので真の上位 k 件にならない (4 文字以上一致してなお 5000 件を超えることはまれ)
+SUGGEST_SCAN_LIMIT = 5000
+SUGGEST_REBUILD_INTERVAL = 30  # 秒。スキャン中などに連続で作り直さないよう間隔をあける
+SUGGEST_SPLIT_RE = re.compile(r'[\s_\-.,()\[\]【】「」・/]+')
+# ファセット (サイズ帯は下限 <= size < 上限)
+SIZE_BUCKETS = OrderedDict([
+    ('small', ('100MB 未満', 0, 100 * 1024 ** 2)),
+    ('medium', ('100MB - 1GB', 100 * 1024 ** 2, 1024 ** 3)),
+    ('large', ('1GB - 4GB', 1024 ** 3, 4 * 1024 ** 3)),
+    ('huge', ('4GB 以上', 4 * 1024 ** 3, None)),
+])
+FACET_TOP_TAGS = 30
+FACET_TOP_FOLDERS = 20
+EXPORT_CHUNK_ROWS = 1000
+EXPORT_FIELDS = ['path', 'size', 'modified', 'play_count', 'favorite', 'tags', 'last_played']
+IMPORT_BATCH_ROWS = 5000
+IMPORT_READ_BYTES = 1024 * 1024
+EXPORT_FORMATS = {
+    'json': ('application/json', 'json'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+}
+# 変更フィード (change_log は新しい方から CHANGE_LOG_MAX_ROWS 件だけ残す)
+CHANGE_LOG_MAX_ROWS = 200000
+CHANGES_DEFAULT_LIMIT = 500
+CHANGES_MAX_LIMIT = 5000
+CHANGES_POLL_INTERVAL = 1.0  # 秒。SSE で change_log を確認する間隔
+CHANGES_HEARTBEAT = 15  # 秒。変更がなくても接続を維持するためのコメント送信間隔
+CHANGES_STREAM_MAX_AGE = 300  # 秒。これを過ぎたら切断し、EventSource の再接続 (Last-Event-ID) に任せる
+SHARED_GENERATION_POLL = 1.0  # 秒。別プロセス (--import) が DB に残した世代番号を確認する間隔
+BULK_ACTIONS = {'add_favorite', 'remove_favorite', 'add_tags', 'remove_tags', 'clear_tags'}
+ETAG_ENDPOINTS = {'get_videos', 'get_facets', 'get_folders', 'get_stats', 'export_data', 'playlists'}
+
 # ログ設定
 logging.basicConfig(filename=str(LOG_PATH), level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 console = logging.StreamHandler()
@@ -35,47 +182,411 @@ logging.getLogger('').addHandler(console)
 
 app = Flask(__name__)
 
+# ライブラリの世代番号 (再起動で ETag が衝突しないよう起動ごとの ID と組み合わせる)
+# names_generation は動画名/フォルダ/タグが変わりうる書き込みでだけ進める (サジェストの作り直しに使う)。
+# shared_* は DB の shared_generation 表を介した別プロセスとのやりとり用 (publish は --import のときだけ True)
+library_state = {'generation': 0, 'names_generation': 0, 'boot_id': secrets.token_hex(4),
+                 'publish': False, 'shared_seen': None, 'shared_checked': 0}
+library_lock = Lock()
+
+# 検索サジェストのインデックス
+suggest_state = {'index': None, 'names_generation': -1, 'building': False, 'built_at': 0}
+suggest_lock = Lock()
+
+# クエリ結果キャッシュ
+query_cache = OrderedDict()
+query_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'bytes': 0}
+query_cache_lock = Lock()
+
 # スキャンステータス
-scan_status = {'is_scanning': False, 'total': 0, 'processed': 0, 'current_path': ''}
+scan_status = {'is_scanning': False, 'total': 0, 'processed': 0, 'current_path': '', 'phases': {}, 'elapsed': 0}
 scan_lock = Lock()
 
+# プレビュー生成ステータス
+preview_status = {'is_running': False, 'total': 0, 'processed': 0, 'failed': 0, 'current_path': ''}
+preview_lock = Lock()
+
+# メタデータインポートステータス
+import_status = {'is_running': False, 'processed': 0, 'matched': 0, 'skipped': 0, 'read_bytes': 0, 'total_bytes': 0, 'error': None, 'file': ''}
+import_lock = Lock()
+
+# faststart リマックスステータス
+faststart_status = {'is_running': False, 'total': 0, 'processed': 0, 'remuxed': 0, 'failed': 0, 'current_path': ''}
+faststart_lock = Lock()
+
+# ショートフィードのセッションごとの既読セット
+shorts_sessions = OrderedDict()
+shorts_lock = Lock()
+
+# プロキシ生成ステータス
+proxy_status = {'is_running': False, 'last_run': None, 'total': 0, 'processed': 0, 'generated': 0, 'failed': 0, 'current_path': ''}
+proxy_lock = Lock()
+
+# ストリーミング制御の状態 (クライアント IP → 実行中ストリームとトークンバケット)
+stream_clients = {}
+stream_lock = Lock()
+stream_seq = 0
+
+# プローブステータス
+probe_status = {'is_running': False, 'total': 0, 'processed': 0, 'failed': 0}
+probe_lock = Lock()
+
 # --- DB ヘルパー ---
 
+def bump_generation(names=False):
+    # ライブラリ (動画/メタデータ/プレイリスト) が変わるたびに進める。ETag やキャッシュの無効化に使う。
+    # 動画の追加/削除やタグの変更では names=True にする
+    with library_lock:
+        library_state['generation'] += 1
+        if names:
+            library_state['names_generation'] += 1
+        generation = library_state['generation']
+    if library_state['publish']:
+        publish_generation(names)
+    return generation
+
+
+def publish_generation(names):
+    # 世代番号はプロセスごとのメモリにあるので、別プロセスからの書き込みは DB に印を残して実行中のサーバーに知らせる
+    conn = get_db()
+    try:
+        conn.execute("UPDATE shared_generation SET generation = generation + 1, names_generation = names_generation + ?",
+                     (int(names),))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def sync_shared_generation():
+    # 毎回ではなく SHARED_GENERATION_POLL 秒に 1 回だけ DB を見て、別プロセスが進めていたらこちらも進める
+    now = time.monotonic()
+    with library_lock:
+        if now - library_state['shared_checked'] < SHARED_GENERATION_POLL:
+            return
+        library_state['shared_checked'] = now
+    conn = get_db()
+    try:
+        row = conn.execute("SELECT generation, names_generation FROM shared_generation").fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return
+    seen = (row['generation'], row['names_generation'])
+    with library_lock:
+        previous = library_state['shared_seen']
+        library_state['shared_seen'] = seen
+    if previous is not None and seen != previous:
+        bump_generation(names=seen[1] != previous[1])
+
+
+def current_generation():
+    sync_shared_generation()
+    with library_lock:
+        return library_state['generation']
+
+
+def current_names_generation():
+    sync_shared_generation()
+    with library_lock:
+        return library_state['names_generation']
+
+
 def get_db():
     conn = sqlite3.connect(str(DB_PATH))
     conn.row_factory = sqlite3.Row
     return conn
 
 
+def file_ext(path):
+    return os.path.splitext(path)[1].lstrip('.').lower()
+
+
+def ensure_column(conn, table, column, decl):
+    cols = {r['name'] for r in conn.execute(f"PRAGMA table_info({table})")}
+    if column not in cols:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
 def init_db():
     conn = get_db()
     conn.execute("PRAGMA journal_mode=WAL;")
     conn.execute("CREATE TABLE IF NOT EXISTS videos (id INTEGER PRIMARY KEY, path TEXT UNIQUE, size INTEGER, modified INTEGER)")
     conn.execute("CREATE INDEX IF NOT EXISTS idx_videos_path ON videos(path)")
+    ensure_column(conn, 'videos', 'folder', 'TEXT')
+    conn.create_function('dirname', 1, os.path.dirname, deterministic=True)
+    conn.execute("UPDATE videos SET folder = dirname(path) WHERE folder IS NULL")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_videos_folder ON videos(folder, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_videos_size ON videos(size)")
+    ensure_column(conn, 'videos', 'filename', 'TEXT')
+    ensure_column(conn, 'videos', 'ext', 'TEXT')
+    conn.create_function('basename', 1, os.path.basename, deterministic=True)
+    conn.create_function('file_ext', 1, file_ext, deterministic=True)
+    conn.execute("UPDATE videos SET filename = basename(path), ext = file_ext(path) WHERE filename IS NULL")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_videos_filename ON videos(filename)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_videos_ext ON videos(ext)")
+    conn.execute("CREATE TABLE IF NOT EXISTS folders (id INTEGER PRIMARY KEY, path TEXT UNIQUE, video_count INTEGER)")
     conn.execute("CREATE TABLE IF NOT EXISTS video_meta (video_id INTEGER PRIMARY KEY, play_count INTEGER DEFAULT 0, favorite INTEGER DEFAULT 0, tags TEXT DEFAULT '', last_played INTEGER)")
+    ensure_column(conn, 'video_meta', 'last_position', 'REAL')
+    ensure_column(conn, 'video_meta', 'skip_count', 'INTEGER DEFAULT 0')
     conn.execute("CREATE TABLE IF NOT EXISTS playlists (id INTEGER PRIMARY KEY, name TEXT, created INTEGER, video_ids TEXT)")
     conn.execute("CREATE TABLE IF NOT EXISTS watch_history (id INTEGER PRIMARY KEY, video_id INTEGER, watched_at INTEGER)")
     conn.execute("CREATE INDEX IF NOT EXISTS idx_history_video ON watch_history(video_id)")
     conn.execute("CREATE INDEX IF NOT EXISTS idx_history_time ON watch_history(watched_at)")
+    conn.execute("CREATE TABLE IF NOT EXISTS previews (video_id INTEGER PRIMARY KEY, interval REAL, tiles INTEGER, created INTEGER)")
+    conn.execute("CREATE TABLE IF NOT EXISTS media_info (video_id INTEGER PRIMARY KEY, duration REAL, width INTEGER, height INTEGER, container TEXT, vcodec TEXT, acodec TEXT, bitrate INTEGER, playable INTEGER DEFAULT 0, probed_mtime INTEGER)")
+    ensure_column(conn, 'media_info', 'created', 'INTEGER')
+    ensure_column(conn, 'media_info', 'faststart', 'INTEGER')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_media_duration ON media_info(duration)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_media_height ON media_info(height)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_media_bitrate ON media_info(bitrate)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_media_playable ON media_info(playable)")
+    if not conn.execute("SELECT 1 FROM folders LIMIT 1").fetchone():
+        rebuild_folders(conn)
+    conn.execute("CREATE TABLE IF NOT EXISTS shared_generation (id INTEGER PRIMARY KEY CHECK (id = 1), generation INTEGER NOT NULL DEFAULT 0, names_generation INTEGER NOT NULL DEFAULT 0)")
+    conn.execute("INSERT OR IGNORE INTO shared_generation (id) VALUES (1)")
+    # 起動時点の値を基準にする (それより前の別プロセスの書き込みは読み直すまでもない)
+    row = conn.execute("SELECT generation, names_generation FROM shared_generation").fetchone()
+    library_state['shared_seen'] = (row['generation'], row['names_generation'])
+    init_change_log(conn)
+    prune_change_log(conn)
     conn.commit()
     conn.close()
 
 
+def init_change_log(conn):
+    # videos / video_meta への変更をトリガーで記録する。version は AUTOINCREMENT なので削除後も再利用されない
+    conn.execute("CREATE TABLE IF NOT EXISTS change_log (version INTEGER PRIMARY KEY AUTOINCREMENT, entity TEXT, video_id INTEGER, op TEXT, ts INTEGER)")
+    # スキャン中は行ごとの記録を止める。止める行は書き込みトランザクションの中でだけ存在し、コミット前に消すので他の接続からは見えない
+    conn.execute("CREATE TABLE IF NOT EXISTS change_log_mute (id INTEGER PRIMARY KEY)")
+    log = "INSERT INTO change_log (entity, video_id, op, ts) VALUES ('{entity}', {row}.{col}, '{op}', CAST(strftime('%s', 'now') AS INTEGER))"
+    active = 'NOT EXISTS (SELECT 1 FROM change_log_mute)'
+    triggers = [
+        ('videos', 'video', 'id', 'insert', 'INSERT', ''),
+        ('videos', 'video', 'id', 'delete', 'DELETE', ''),
+        # folder/filename の補完では記録しない
+        ('videos', 'video', 'id', 'update', 'UPDATE',
+         'OLD.path IS NOT NEW.path OR OLD.size IS NOT NEW.size OR OLD.modified IS NOT NEW.modified'),
+        ('video_meta', 'meta', 'video_id', 'insert', 'INSERT', ''),
+        ('video_meta', 'meta', 'video_id', 'delete', 'DELETE', ''),
+        ('video_meta', 'meta', 'video_id', 'update', 'UPDATE',
+         ' OR '.join(f'OLD.{c} IS NOT NEW.{c}' for c in ('play_count', 'favorite', 'tags', 'last_played', 'last_position', 'skip_count'))),
+    ]
+    for table, entity, col, op, event, when in triggers:
+        row = 'OLD' if event == 'DELETE' else 'NEW'
+        when = f"WHEN {active} AND ({when})" if when else f"WHEN {active}"
+        # 条件を変えたときに古い定義が残らないよう作り直す
+        conn.execute(f"DROP TRIGGER IF EXISTS trg_{table}_{op}_log")
+        conn.execute(f"CREATE TRIGGER trg_{table}_{op}_log AFTER {event} ON {table} {when} "
+                     f"BEGIN {log.format(entity=entity, row=row, col=col, op=op)}; END")
+
+
+def mute_change_log(conn):
+    # 書き込みトランザクションを始める。同じトランザクションの中で unmute_change_log してからコミットすること
+    conn.execute("INSERT OR IGNORE INTO change_log_mute (id) VALUES (1)")
+
+
+def unmute_change_log(conn):
+    conn.execute("DELETE FROM change_log_mute")
+
+
+def log_library_reset(conn):
+    # 行ごとに記録しなかった一括変更の代わりに 1 行だけ残す。購読側は一覧を取り直す
+    conn.execute("INSERT INTO change_log (entity, video_id, op, ts) VALUES ('library', NULL, 'reset', CAST(strftime('%s', 'now') AS INTEGER))")
+
+
+def prune_change_log(conn):
+    conn.execute("DELETE FROM change_log WHERE version <= (SELECT MAX(version) FROM change_log) - ?", (CHANGE_LOG_MAX_ROWS,))
+
+
+def rebuild_folders(conn):
+    # ショートのサンプリング用。id を 1..N の連番にしてランダムな rowid で引けるようにする
+    conn.execute("DELETE FROM folders")
+    conn.execute("INSERT INTO folders (path, video_count) SELECT folder, COUNT(*) FROM videos GROUP BY folder ORDER BY folder")
+
+
 init_db()
 
+# --- クエリ結果キャッシュ ---
+
+def cached_query(name, key_args, compute, generation=None):
+    # 世代番号は計算前に読む。計算中に書き込みがあっても古い世代のキーに入るだけで、新しい世代では使われない
+    if generation is None:
+        generation = current_generation()
+    key = (generation, name, key_args)
+    with query_cache_lock:
+        entry = query_cache.get(key)
+        if entry is not None:
+            query_cache.move_to_end(key)
+            query_cache_stats['hits'] += 1
+            return entry[0]
+        query_cache_stats['misses'] += 1
+
+    payload = compute()
+    size = len(json.dumps(payload, ensure_ascii=False))
+    if size > QUERY_CACHE_MAX_BYTES // 4:
+        return payload
+
+    with query_cache_lock:
+        # 古い世代のエントリは二度と当たらないので先に捨てる
+        for old in [k for k in query_cache if k[0] < generation]:
+            query_cache_stats['bytes'] -= query_cache.pop(old)[1]
+        if key not in query_cache:
+            query_cache[key] = (payload, size)
+            query_cache_stats['bytes'] += size
+        while len(query_cache) > QUERY_CACHE_MAX_ENTRIES or query_cache_stats['bytes'] > QUERY_CACHE_MAX_BYTES:
+            _, (_, old_size) = query_cache.popitem(last=False)
+            query_cache_stats['bytes'] -= old_size
+            query_cache_stats['evictions'] += 1
+    return payload
+
+
+# --- 検索サジェスト (前方一致インデックス) ---
+
+def suggest_keys(label):
+    # ラベル全体と、区切り文字で分けた各単語を前方一致のキーにする
+    lower = label.lower()
+    keys = {lower}
+    keys.update(t for t in SUGGEST_SPLIT_RE.split(lower) if t)
+    return keys
+
+
+def build_suggest_index(conn):
+    entries = []  # (kind, label, value, score)
+    folder_score = {}
+    tag_score = {}
+    for r in conn.execute("SELECT v.id, v.filename, v.folder, COALESCE(m.play_count, 0) AS plays, m.tags FROM videos v LEFT JOIN video_meta m ON m.video_id = v.id"):
+        entries.append(('video', r['filename'] or '', r['id'], r['plays']))
+        folder_score[r['folder']] = folder_score.get(r['folder'], 0) + r['plays'] + 1
+        if r['tags']:
+            for tag in r['tags'].split(','):
+                tag = tag.strip()
+                if tag:
+                    tag_score[tag] = tag_score.get(tag, 0) + r['plays'] + 1
+    entries.extend(('folder', os.path.basename(f) or f, f, s) for f, s in folder_score.items() if f)
+    entries.extend(('tag', t, t, s) for t, s in tag_score.items())
+
+    pairs = sorted((key, i) for i, e in enumerate(entries) for key in suggest_keys(e[1]))
+    keys = [p[0] for p in pairs]
+    ids = [p[1] for p in pairs]
+
+    # 短いプレフィックスは候補が多すぎて実行時に並べ替えられないので、上位 k 件を先に求めておく。
+    # SUGGEST_PREFIX_LEN 文字のプレフィックスごとに求め、短いものは 1 文字長い側の結果を併合して作る
+    score = lambda i: entries[i][3]
+    top = {}
+    for prefix, group in itertools.groupby(pairs, key=lambda p: p[0][:SUGGEST_PREFIX_LEN]):
+        top[prefix] = heapq.nlargest(SUGGEST_MAX_K, {i for _, i in group}, key=score)
+    for n in range(SUGGEST_PREFIX_LEN - 1, 0, -1):
+        merged = {}
+        for prefix, found in top.items():
+            if len(prefix) == n + 1:
+                merged.setdefault(prefix[:n], set()).update(found)
+        for prefix, candidates in merged.items():
+            candidates.update(top.get(prefix, []))
+            top[prefix] = heapq.nlargest(SUGGEST_MAX_K, candidates, key=score)
+    return {'entries': entries, 'keys': keys, 'ids': ids, 'top': top}
+
+
+def lookup_suggestions(index, q, k):
+    entries = index['entries']
+    if len(q) <= SUGGEST_PREFIX_LEN:
+        found = index['top'].get(q, [])[:k]
+    else:
+        keys = index['keys']
+        lo = bisect.bisect_left(keys, q)
+        # 一致範囲が SUGGEST_SCAN_LIMIT を超える分は見ない (上の定数のコメントを参照)
+        hi = min(bisect.bisect_left(keys, q + '￿'), lo + SUGGEST_SCAN_LIMIT)
+        found = heapq.nlargest(k, set(index['ids'][lo:hi]), key=lambda i: entries[i][3])
+    return [{'kind': entries[i][0], 'label': entries[i][1], 'value': entries[i][2], 'score': entries[i][3]} for i in found]
+
+
+def rebuild_suggest_index():
+    generation = current_names_generation()
+    conn = get_db()
+    try:
+        index = build_suggest_index(conn)
+    except Exception as e:
+        logging.error(f"Suggest index error: {e}")
+        index = None
+    finally:
+        conn.close()
+    with suggest_lock:
+        if index is not None:
+            suggest_state.update({'index': index, 'names_generation': generation})
+        suggest_state['building'] = False
+        suggest_state['built_at'] = time.time()
+
+
+def current_suggest_index():
+    # 名前/タグの世代が変わっていたら裏で作り直し、それまでは古いインデックスで答える (初回だけは同期で作る)。
+    # 再生やお気に入りでは作り直さないので、スコア (再生回数) は次に作り直すまで古いまま
+    with suggest_lock:
+        stale = suggest_state['names_generation'] != current_names_generation()
+        start = (stale and not suggest_state['building'] and suggest_state['index'] is not None
+                 and time.time() - suggest_state['built_at'] >= SUGGEST_REBUILD_INTERVAL)
+        if start:
+            suggest_state['building'] = True
+        index = suggest_state['index']
+    if index is None:
+        rebuild_suggest_index()
+        with suggest_lock:
+            return suggest_state['index']
+    if start:
+        Thread(target=rebuild_suggest_index, daemon=True).start()
+    return index
+
+
 # --- スキャンワーカー ---
 
+def flush_scan_batch(conn, batch):
+    # 戻り値は追加した行数。変更フィードには行ごとに記録せず、scan_worker が最後にまとめて 1 行残す
+    cur = conn.cursor()
+    mute_change_log(conn)
+    cur.executemany("INSERT OR IGNORE INTO videos (path, size, modified, folder, filename, ext) VALUES (?, ?, ?, ?, ?, ?)",
+                    [(p, size, mtime, folder, os.path.basename(p), file_ext(p)) for p, size, mtime, folder in batch])
+    inserted = cur.rowcount
+    unmute_change_log(conn)
+    # ファイルを読む間に書き込みロックを持たないよう、ヘッダー解析の前にコミットしておく
+    conn.commit()
+    # MP4/MKV はヘッダーだけ読んでその場でメディア情報を記録する (未対応形式は後段の probe_worker へ)
+    rows = cur.execute(f"""
+        SELECT v.id, v.path, v.modified FROM videos v LEFT JOIN media_info mi ON mi.video_id = v.id
+        WHERE v.path IN ({','.join('?' * len(batch))}) AND (mi.video_id IS NULL OR mi.probed_mtime != v.modified)
+    """, [b[0] for b in batch]).fetchall()
+    parsed = []
+    for r in rows:
+        info = parse_media_header(r['path'])
+        if info:
+            parsed.append((r['id'], r['modified'], info))
+    if parsed:
+        save_media_info(cur, parsed)
+        conn.commit()
+    return inserted
+
+
+def remove_scan_batch(conn, removals):
+    mute_change_log(conn)
+    conn.executemany("DELETE FROM videos WHERE id=?", removals)
+    unmute_change_log(conn)
+    conn.commit()
+
+
 def scan_worker(target_dir):
     target_dir = str(Path(target_dir).expanduser())
     with scan_lock:
-        scan_status.update({'is_scanning': True, 'total': 0, 'processed': 0, 'current_path': target_dir})
+        scan_status.update({'is_scanning': True, 'total': 0, 'processed': 0, 'current_path': target_dir, 'phases': {}, 'elapsed': 0})
 
     conn = get_db()
+    # 変更フィードのトリガーがあると INSERT OR IGNORE が 1 行ごとにステートメントジャーナルを開く。一時ファイルに書かずメモリに置く
+    conn.execute("PRAGMA temp_store=MEMORY")
     cur = conn.cursor()
 
     processed = 0
     total_guess = 0
+    changed = 0
     batch = []
+    # フェーズごとの所要時間 (秒)。prune には folders の再構築も含む
+    phases = {'walk': 0.0, 'stat': 0.0, 'insert': 0.0, 'prune': 0.0, 'vacuum': 0.0}
+    started = time.perf_counter()
 
     try:
         for root, dirs, files in os.walk(target_dir):
@@ -90,15 +601,19 @@ def scan_worker(target_dir):
                 try:
                     if Path(file).suffix.lower() not in VIDEO_EXTENSIONS:
                         continue
+                    t = time.perf_counter()
                     p = Path(root) / file
                     stat = p.stat()
                     norm_path = str(p.resolve().as_posix())
-                    batch.append((norm_path, stat.st_size, int(stat.st_mtime)))
+                    batch.append((norm_path, stat.st_size, int(stat.st_mtime), os.path.dirname(norm_path)))
+                    phases['stat'] += time.perf_counter() - t
 
                     if len(batch) >= BATCH_SIZE:
-                        cur.executemany("INSERT OR IGNORE INTO videos (path, size, modified) VALUES (?, ?, ?)", batch)
-                        conn.commit()
+                        t = time.perf_counter()
+                        changed += flush_scan_batch(conn, batch)
+                        bump_generation()
                         batch = []
+                        phases['insert'] += time.perf_counter() - t
                     processed += 1
                     if processed % 50 == 0:
                         with scan_lock:
@@ -110,11 +625,16 @@ def scan_worker(target_dir):
                     continue
                 except Exception as e:
                     logging.exception(f"Unexpected error scanning {root}/{file}: {e}")
+        # 件数の事前走査と、走査ループのうち stat/insert 以外 (os.walk 自体と拡張子の判定) を walk に数える
+        phases['walk'] = time.perf_counter() - started - phases['stat'] - phases['insert']
 
         if batch:
-            cur.executemany("INSERT OR IGNORE INTO videos (path, size, modified) VALUES (?, ?, ?)", batch)
-            conn.commit()
+            t = time.perf_counter()
+            changed += flush_scan_batch(conn, batch)
+            bump_generation()
+            phases['insert'] += time.perf_counter() - t
 
+        t = time.perf_counter()
         cur.execute("SELECT id, path FROM videos")
         rows = cur.fetchall()
         removals = []
@@ -122,17 +642,29 @@ def scan_worker(target_dir):
             if not Path(r['path']).exists():
                 removals.append((r['id'],))
                 if len(removals) >= BATCH_SIZE:
-                    cur.executemany("DELETE FROM videos WHERE id=?", removals)
-                    conn.commit()
+                    remove_scan_batch(conn, removals)
+                    changed += len(removals)
                     removals = []
         if removals:
-            cur.executemany("DELETE FROM videos WHERE id=?", removals)
-            conn.commit()
+            remove_scan_batch(conn, removals)
+            changed += len(removals)
+            bump_generation()
+
+        rebuild_folders(conn)
+        if changed:
+            log_library_reset(conn)
+        prune_change_log(conn)
+        conn.commit()
+        # サジェストはスキャンの途中では作り直さず、最後に一度だけ
+        bump_generation(names=changed > 0)
+        phases['prune'] = time.perf_counter() - t
 
+        t = time.perf_counter()
         try:
             cur.execute("VACUUM")
         except Exception as e:
             logging.warning(f"VACUUM failed: {e}")
+        phases['vacuum'] = time.perf_counter() - t
 
     finally:
         conn.close()
@@ -140,13 +672,949 @@ def scan_worker(target_dir):
             scan_status['is_scanning'] = False
             scan_status['processed'] = processed
             scan_status['current_path'] = ''
+            scan_status['phases'] = {k: round(v, 4) for k, v in phases.items()}
+            scan_status['elapsed'] = round(time.perf_counter() - started, 4)
+
+    # スキャンのスレッドでは待たず、それぞれ別スレッドで走らせる (実行中なら起動しない)
+    if FFPROBE_BIN:
+        start_worker(probe_status, probe_lock, probe_worker)
+    if FFMPEG_BIN:
+        start_worker(faststart_status, faststart_lock, faststart_worker)
+
+
+def start_worker(status, lock, target):
+    # is_running の確認と設定を同じロックの中で行い、スキャンの後始末と手動起動などで二重に走らないようにする
+    with lock:
+        if status['is_running']:
+            return False
+        status['is_running'] = True
+    Thread(target=target, daemon=True).start()
+    return True
+
+
+# --- メディア情報プローブ ---
+
+def is_browser_playable(container, vcodec, acodec):
+    return container in PLAYABLE_CONTAINERS and vcodec in PLAYABLE_VCODECS and acodec in PLAYABLE_ACODECS
+
+
+# --- ヘッダー解析 (MP4/MOV/M4V, MKV/WebM) ---
+# moov / EBML の必要な部分だけを数回の小さな read で読み、ffprobe の起動を避ける
+
+def _iter_boxes(buf, start=0, end=None):
+    end = len(buf) if end is None else end
+    pos = start
+    while pos + 8 <= end:
+        size, kind = struct.unpack_from('>I4s', buf, pos)
+        header = 8
+        if size == 1:
+            if pos + 16 > end:
+                return
+            size = struct.unpack_from('>Q', buf, pos + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            return
+        yield kind, pos + header, pos + size
+        pos += size
+
+
+def _parse_trak(buf, start, end):
+    track = {}
+    for kind, s, e in _iter_boxes(buf, start, end):
+        if kind == b'tkhd':
+            version = buf[s]
+            off = s + (4 + 32 if version == 1 else 4 + 20) + 8 + 2 + 2 + 2 + 2 + 36
+            if off + 8 <= e:
+                w, h = struct.unpack_from('>II', buf, off)
+                track['width'], track['height'] = w >> 16, h >> 16
+        elif kind == b'mdia':
+            for k2, s2, e2 in _iter_boxes(buf, s, e):
+                if k2 == b'hdlr' and s2 + 12 <= e2:
+                    track['handler'] = buf[s2 + 8:s2 + 12]
+                elif k2 == b'minf':
+                    for k3, s3, e3 in _iter_boxes(buf, s2, e2):
+                        if k3 != b'stbl':
+                            continue
+                        for k4, s4, e4 in _iter_boxes(buf, s3, e3):
+                            if k4 == b'stsd' and s4 + 16 <= e4:
+                                track['fourcc'] = buf[s4 + 12:s4 + 16].decode('latin-1')
+    return track
+
+
+def parse_mp4_header(f, file_size):
+    pos = 0
+    moov = None
+    seen_mdat = False
+    while pos + 8 <= file_size:
+        f.seek(pos)
+        head = f.read(16)
+        if len(head) < 8:
+            break
+        size, kind = struct.unpack_from('>I4s', head)
+        header = 8
+        if size == 1 and len(head) == 16:
+            size = struct.unpack_from('>Q', head, 8)[0]
+            header = 16
+        elif size == 0:
+            size = file_size - pos
+        if size < header:
+            break
+        if kind == b'moov':
+            if size > MOOV_MAX_BYTES:
+                return None
+            f.seek(pos + header)
+            moov = f.read(size - header)
+            break
+        if kind == b'mdat':
+            seen_mdat = True
+        pos += size
+    if not moov:
+        return None
+
+    # moov が mdat より前にあればブラウザは先頭から読むだけで再生を始められる
+    info = {'container': 'mp4', 'faststart': 0 if seen_mdat else 1}
+    for kind, s, e in _iter_boxes(moov):
+        if kind == b'mvhd':
+            version = moov[s]
+            if version == 1:
+                created, _, timescale, duration = struct.unpack_from('>QQIQ', moov, s + 4)
+            else:
+                created, _, timescale, duration = struct.unpack_from('>IIII', moov, s + 4)
+            if timescale:
+                info['duration'] = duration / timescale
+            if created > MP4_EPOCH_OFFSET:
+                info['created'] = created - MP4_EPOCH_OFFSET
+        elif kind == b'trak':
+            track = _parse_trak(moov, s, e)
+            codec = MP4_CODECS.get(track.get('fourcc'), track.get('fourcc'))
+            if track.get('handler') == b'vide' and 'vcodec' not in info:
+                info.update({'vcodec': codec, 'width': track.get('width'), 'height': track.get('height')})
+            elif track.get('handler') == b'soun' and 'acodec' not in info:
+                info['acodec'] = codec
+    return info
+
+
+def _read_vint(f, keep_marker=False):
+    first = f.read(1)
+    if not first:
+        raise EOFError
+    b = first[0]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not (b & mask):
+        mask >>= 1
+        length += 1
+    if length > 8:
+        raise ValueError('invalid EBML vint')
+    value = b if keep_marker else b & (mask - 1)
+    rest = f.read(length - 1)
+    if len(rest) != length - 1:
+        raise EOFError
+    unknown = not keep_marker and value == mask - 1 and all(x == 0xFF for x in rest)
+    for x in rest:
+        value = (value << 8) | x
+    return value, (None if unknown else value)
+
+
+def _iter_ebml(f, end):
+    while f.tell() < end:
+        eid, _ = _read_vint(f, keep_marker=True)
+        _, size = _read_vint(f)
+        start = f.tell()
+        yield eid, start, (end if size is None else start + size)
+
+
+def _ebml_uint(data):
+    return int.from_bytes(data, 'big') if data else 0
+
+
+def parse_mkv_header(f, file_size):
+    f.seek(0)
+    eid, _ = _read_vint(f, keep_marker=True)
+    if eid != 0x1A45DFA3:
+        return None
+    _, size = _read_vint(f)
+    doctype = 'matroska'
+    header_end = f.tell() + size
+    for cid, s, e in _iter_ebml(f, header_end):
+        if cid == 0x4282:
+            doctype = f.read(e - s).decode('ascii', 'ignore')
+        f.seek(e)
+    f.seek(header_end)
+    eid, _ = _read_vint(f, keep_marker=True)
+    if eid != 0x18538067:
+        return None
+    _, size = _read_vint(f)
+    segment_end = file_size if size is None else min(file_size, f.tell() + size)
+
+    info = {'container': 'webm' if doctype == 'webm' else 'mkv'}
+    scale = 1000000
+    raw_duration = None
+    seen_info = seen_tracks = False
+    for cid, s, e in _iter_ebml(f, segment_end):
+        if cid == 0x1549A966:
+            seen_info = True
+            for iid, s2, e2 in _iter_ebml(f, e):
+                data = f.read(e2 - s2)
+                if iid == 0x2AD7B1:
+                    scale = _ebml_uint(data) or scale
+                elif iid == 0x4489 and len(data) in (4, 8):
+                    raw_duration = struct.unpack('>f' if len(data) == 4 else '>d', data)[0]
+                elif iid == 0x4461 and len(data) == 8:
+                    info['created'] = int(struct.unpack('>q', data)[0] / 1e9) + MKV_EPOCH_OFFSET
+        elif cid == 0x1654AE6B:
+            seen_tracks = True
+            for tid, s2, e2 in _iter_ebml(f, e):
+                if tid != 0xAE:
+                    f.seek(e2)
+                    continue
+                track = {}
+                for kid, s3, e3 in _iter_ebml(f, e2):
+                    if kid == 0xE0:
+                        for vid_, s4, e4 in _iter_ebml(f, e3):
+                            data = f.read(e4 - s4)
+                            if vid_ == 0xB0:
+                                track['width'] = _ebml_uint(data)
+                            elif vid_ == 0xBA:
+                                track['height'] = _ebml_uint(data)
+                    else:
+                        data = f.read(e3 - s3)
+                        if kid == 0x83:
+                            track['type'] = _ebml_uint(data)
+                        elif kid == 0x86:
+                            track['codec'] = data.decode('ascii', 'ignore').rstrip('\x00')
+                    f.seek(e3)
+                codec = MKV_CODECS.get(track.get('codec'), track.get('codec'))
+                if track.get('type') == 1 and 'vcodec' not in info:
+                    info.update({'vcodec': codec, 'width': track.get('width'), 'height': track.get('height')})
+                elif track.get('type') == 2 and 'acodec' not in info:
+                    info['acodec'] = codec
+        elif cid == 0x1F43B675:
+            # クラスタ以降はフレームデータなので読まない
+            break
+        f.seek(e)
+        if seen_info and seen_tracks:
+            break
+    if raw_duration is not None:
+        info['duration'] = raw_duration * scale / 1e9
+    return info
+
+
+def parse_media_header(path):
+    ext = Path(path).suffix.lower()
+    if ext not in HEADER_PARSE_EXTENSIONS:
+        return None
+    try:
+        file_size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            if ext in ('.mkv', '.webm'):
+                info = parse_mkv_header(f, file_size)
+            else:
+                info = parse_mp4_header(f, file_size)
+    except (OSError, EOFError, ValueError, struct.error, IndexError):
+        return None
+    if not info or not info.get('duration'):
+        return None
+    info['bitrate'] = int(file_size * 8 / info['duration'])
+    return info
+
+
+def probe_media(path):
+    # ProcessPoolExecutor から呼ばれるため、モジュールレベルに置く
+    info = parse_media_header(path)
+    if info or not FFPROBE_BIN:
+        return info
+    try:
+        out = subprocess.run(
+            [FFPROBE_BIN, '-v', 'error', '-show_entries',
+             'format=format_name,duration,bit_rate:format_tags=creation_time:stream=codec_type,codec_name,width,height',
+             '-of', 'json', path],
+            capture_output=True, text=True, timeout=60
+        ).stdout
+        data = json.loads(out or '{}')
+    except (subprocess.SubprocessError, OSError, ValueError):
+        return None
+    fmt = data.get('format') or {}
+    streams = data.get('streams') or []
+    video = next((s for s in streams if s.get('codec_type') == 'video'), {})
+    audio = next((s for s in streams if s.get('codec_type') == 'audio'), {})
+    if not fmt and not video:
+        return None
+    # ffprobe は "mov,mp4,m4a,3gp,3g2,mj2" のように返すので拡張子で絞り込む
+    names = (fmt.get('format_name') or '').split(',')
+    ext = Path(path).suffix.lower().lstrip('.')
+    if 'mp4' in names:
+        container = 'mp4'
+    elif 'matroska' in names:
+        container = 'webm' if ext == 'webm' else 'mkv'
+    else:
+        container = names[0] or None
+    try:
+        duration = float(fmt['duration']) if fmt.get('duration') else None
+    except ValueError:
+        duration = None
+    try:
+        bitrate = int(fmt['bit_rate']) if fmt.get('bit_rate') else None
+    except ValueError:
+        bitrate = None
+    try:
+        created_str = (fmt.get('tags') or {}).get('creation_time')
+        created = int(datetime.fromisoformat(created_str.replace('Z', '+00:00')).timestamp()) if created_str else None
+    except ValueError:
+        created = None
+    return {
+        'duration': duration,
+        'width': video.get('width'),
+        'height': video.get('height'),
+        'container': container,
+        'vcodec': video.get('codec_name'),
+        'acodec': audio.get('codec_name'),
+        'bitrate': bitrate,
+        'created': created,
+    }
+
+
+def save_media_info(cur, rows):
+    # rows: (video_id, modified, info or None) のリスト。失敗した動画も再プローブしないよう記録する
+    params = []
+    for vid, modified, info in rows:
+        info = info or {}
+        playable = 1 if is_browser_playable(info.get('container'), info.get('vcodec'), info.get('acodec')) else 0
+        params.append((vid, info.get('duration'), info.get('width'), info.get('height'), info.get('container'),
+                       info.get('vcodec'), info.get('acodec'), info.get('bitrate'), playable, modified, info.get('created'), info.get('faststart')))
+    cur.executemany("""
+        INSERT OR REPLACE INTO media_info (video_id, duration, width, height, container, vcodec, acodec, bitrate, playable, probed_mtime, created, faststart)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, params)
+
+
+def probe_worker():
+    with probe_lock:
+        probe_status.update({'is_running': True, 'total': 0, 'processed': 0, 'failed': 0})
+
+    conn = get_db()
+    cur = conn.cursor()
+    pending = """
+        FROM videos v LEFT JOIN media_info mi ON mi.video_id = v.id
+        WHERE (mi.video_id IS NULL OR mi.probed_mtime != v.modified)
+    """
+    try:
+        conn.execute("DELETE FROM media_info WHERE video_id NOT IN (SELECT id FROM videos)")
+        conn.commit()
+        total = cur.execute(f"SELECT COUNT(*) AS cnt {pending}").fetchone()['cnt']
+        with probe_lock:
+            probe_status['total'] = total
+        if not total:
+            return
+
+        # spawn: スレッドを持つプロセスからの fork を避ける
+        ctx = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=PROBE_WORKERS, mp_context=ctx) as pool:
+            last_id = 0
+            while True:
+                rows = cur.execute(f"SELECT v.id, v.path, v.modified {pending} AND v.id > ? ORDER BY v.id LIMIT ?",
+                                   (last_id, BATCH_SIZE)).fetchall()
+                if not rows:
+                    break
+                last_id = rows[-1]['id']
+                infos = list(pool.map(probe_media, [r['path'] for r in rows], chunksize=8))
+                save_media_info(cur, [(r['id'], r['modified'], info) for r, info in zip(rows, infos)])
+                conn.commit()
+                bump_generation()
+                with probe_lock:
+                    probe_status['processed'] += len(rows)
+                    probe_status['failed'] += sum(1 for info in infos if info is None)
+    except Exception as e:
+        logging.exception(f"Probe worker error: {e}")
+    finally:
+        conn.close()
+        with probe_lock:
+            probe_status['is_running'] = False
+
+
+# --- シークプレビュー生成 ---
+
+def probe_duration(path):
+    if not FFPROBE_BIN:
+        return None
+    try:
+        out = subprocess.run(
+            [FFPROBE_BIN, '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=nw=1:nk=1', path],
+            capture_output=True, text=True, timeout=30
+        ).stdout.strip()
+        return float(out) if out else None
+    except (subprocess.SubprocessError, ValueError) as e:
+        logging.warning(f"ffprobe failed: {path} — {e}")
+        return None
+
+
+def preview_path(vid):
+    return PREVIEW_DIR / f"{vid}.jpg"
+
+
+def generate_preview(vid, path):
+    duration = probe_duration(path)
+    if not duration or duration <= 0:
+        return None
+    interval = max(PREVIEW_INTERVAL, duration / PREVIEW_MAX_TILES)
+    tiles = max(1, min(PREVIEW_MAX_TILES, math.ceil(duration / interval)))
+    rows = math.ceil(tiles / PREVIEW_COLS)
+    w, h = PREVIEW_TILE_W, PREVIEW_TILE_H
+    vf = (f"fps=1/{interval:.3f},"
+          f"scale={w}:{h}:force_original_aspect_ratio=decrease,"
+          f"pad={w}:{h}:(ow-iw)/2:(oh-ih)/2,"
+          f"tile={PREVIEW_COLS}x{rows}")
+    out = preview_path(vid)
+    tmp = out.with_suffix('.tmp.jpg')
+    # キーフレームのみデコードして全フレームのデコードを避ける
+    cmd = [FFMPEG_BIN, '-v', 'error', '-y', '-skip_frame', 'nokey', '-i', path,
+           '-vf', vf, '-frames:v', '1', '-q:v', '5', str(tmp)]
+    try:
+        subprocess.run(cmd, capture_output=True, timeout=600, check=True)
+        os.replace(tmp, out)
+    except (subprocess.SubprocessError, OSError) as e:
+        logging.warning(f"Preview generation failed: {path} — {e}")
+        tmp.unlink(missing_ok=True)
+        return None
+    return interval, tiles
+
+
+def preview_worker(video_ids=None):
+    with preview_lock:
+        preview_status.update({'is_running': True, 'total': 0, 'processed': 0, 'failed': 0, 'current_path': ''})
+
+    conn = get_db()
+    try:
+        # 削除済み動画のプレビューを掃除
+        orphans = conn.execute("SELECT p.video_id FROM previews p LEFT JOIN videos v ON v.id = p.video_id WHERE v.id IS NULL").fetchall()
+        for r in orphans:
+            preview_path(r['video_id']).unlink(missing_ok=True)
+        conn.execute("DELETE FROM previews WHERE video_id NOT IN (SELECT id FROM videos)")
+        conn.commit()
+
+        query = """
+            SELECT v.id, v.path FROM videos v
+            LEFT JOIN previews p ON p.video_id = v.id
+            LEFT JOIN video_meta m ON m.video_id = v.id
+            WHERE (p.video_id IS NULL OR p.created < v.modified)
+        """
+        params = []
+        if video_ids:
+            query += f" AND v.id IN ({','.join('?' * len(video_ids))})"
+            params.extend(video_ids)
+        query += " ORDER BY COALESCE(m.favorite, 0) DESC, COALESCE(m.play_count, 0) DESC, v.modified DESC"
+        rows = conn.execute(query, params).fetchall()
+        with preview_lock:
+            preview_status['total'] = len(rows)
+
+        for i, r in enumerate(rows, 1):
+            with preview_lock:
+                preview_status['current_path'] = r['path']
+            result = generate_preview(r['id'], r['path']) if Path(r['path']).exists() else None
+            if result:
+                interval, tiles = result
+                conn.execute("INSERT OR REPLACE INTO previews (video_id, interval, tiles, created) VALUES (?, ?, ?, ?)",
+                             (r['id'], interval, tiles, int(time.time())))
+                conn.commit()
+                bump_generation()
+            with preview_lock:
+                preview_status['processed'] = i
+                if not result:
+                    preview_status['failed'] += 1
+    except Exception as e:
+        logging.exception(f"Preview worker error: {e}")
+    finally:
+        conn.close()
+        with preview_lock:
+            preview_status['is_running'] = False
+            preview_status['current_path'] = ''
+
+
+# --- faststart リマックスキャッシュ ---
+
+def faststart_path(vid, modified):
+    # 元ファイルの更新日時を名前に含め、更新されたら古いコピーを使わない
+    return FASTSTART_DIR / f"{vid}_{modified}.mp4"
+
+
+def touch_cache_entry(p):
+    # mtime を最終アクセス時刻として使い、LRU 削除の順序を決める
+    try:
+        os.utime(p)
+    except OSError:
+        pass
+
+
+def cache_usage(directory):
+    used = 0
+    for p in directory.glob('*.mp4'):
+        try:
+            used += p.stat().st_size
+        except FileNotFoundError:
+            pass
+    return used
+
+
+def enforce_cache_quota(directory, max_bytes, incoming=0, protect=()):
+    entries = []
+    for p in directory.glob('*.mp4'):
+        try:
+            st = p.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((st.st_mtime, st.st_size, p))
+    used = sum(e[1] for e in entries)
+    for _, size, p in sorted(entries):
+        if used + incoming <= max_bytes:
+            break
+        if p in protect:
+            continue
+        p.unlink(missing_ok=True)
+        used -= size
+    return used + incoming <= max_bytes
+
+
+def remux_faststart(src, dst):
+    tmp = dst.with_suffix('.tmp')
+    cmd = [FFMPEG_BIN, '-v', 'error', '-y', '-i', src, '-map', '0', '-c', 'copy',
+           '-movflags', '+faststart', '-f', 'mp4', str(tmp)]
+    try:
+        subprocess.run(cmd, capture_output=True, timeout=3600, check=True)
+        os.replace(tmp, dst)
+        return True
+    except (subprocess.SubprocessError, OSError) as e:
+        logging.warning(f"Faststart remux failed: {src} — {e}")
+        tmp.unlink(missing_ok=True)
+        return False
+
+
+def faststart_worker():
+    with faststart_lock:
+        faststart_status.update({'is_running': True, 'total': 0, 'processed': 0, 'remuxed': 0, 'failed': 0, 'current_path': ''})
+
+    conn = get_db()
+    try:
+        # 削除/更新された動画のキャッシュを掃除
+        valid = {faststart_path(r['id'], r['modified']).name
+                 for r in conn.execute("SELECT v.id, v.modified FROM videos v JOIN media_info mi ON mi.video_id = v.id WHERE mi.faststart = 0")}
+        for p in FASTSTART_DIR.glob('*.mp4'):
+            if p.name not in valid:
+                p.unlink(missing_ok=True)
+
+        # faststart 不明 (ffprobe で記録された/旧バージョンの) MP4 も候補にし、ヘッダーで確認する
+        rows = conn.execute("""
+            SELECT v.id, v.path, v.size, v.modified, mi.faststart FROM videos v
+            JOIN media_info mi ON mi.video_id = v.id
+            LEFT JOIN video_meta m ON m.video_id = v.id
+            WHERE mi.container = 'mp4' AND (mi.faststart = 0 OR mi.faststart IS NULL)
+            ORDER BY COALESCE(m.favorite, 0) DESC, COALESCE(m.play_count, 0) DESC, v.modified DESC
+        """).fetchall()
+        with faststart_lock:
+            faststart_status['total'] = len(rows)
+
+        made = set()
+        for i, r in enumerate(rows, 1):
+            with faststart_lock:
+                faststart_status['processed'] = i - 1
+                faststart_status['current_path'] = r['path']
+            if Path(r['path']).suffix.lower() not in FASTSTART_EXTENSIONS or not Path(r['path']).exists():
+                continue
+            if r['faststart'] is None:
+                info = parse_media_header(r['path'])
+                if not info or info.get('faststart') is None:
+                    continue
+                conn.execute("UPDATE media_info SET faststart=? WHERE video_id=?", (info['faststart'], r['id']))
+                conn.commit()
+                if info['faststart']:
+                    continue
+            dst = faststart_path(r['id'], r['modified'])
+            if dst.exists():
+                made.add(dst)
+                continue
+            # 今回作成したコピーは優先度が高いので、それを消さないと入らない場合は終了する
+            if not enforce_cache_quota(FASTSTART_DIR, FASTSTART_CACHE_BYTES, incoming=r['size'] or 0, protect=made):
+                break
+            if remux_faststart(r['path'], dst):
+                made.add(dst)
+                with faststart_lock:
+                    faststart_status['remuxed'] += 1
+            else:
+                with faststart_lock:
+                    faststart_status['failed'] += 1
+        with faststart_lock:
+            faststart_status['processed'] = len(rows)
+    except Exception as e:
+        logging.exception(f"Faststart worker error: {e}")
+    finally:
+        conn.close()
+        with faststart_lock:
+            faststart_status['is_running'] = False
+            faststart_status['current_path'] = ''
+
+
+# --- プロキシ (低ビットレート) 生成 ---
+
+def proxy_path(vid, modified, height):
+    return PROXY_DIR / f"{vid}_{modified}_{height}p.mp4"
+
+
+def transcode_proxy(src, dst, height):
+    vbitrate, abitrate = PROXY_RENDITIONS[height]
+    tmp = dst.with_suffix('.tmp')
+    cmd = [FFMPEG_BIN, '-v', 'error', '-y', '-i', src, '-vf', f"scale=-2:{height}",
+           '-c:v', 'libx264', '-preset', 'veryfast', '-b:v', vbitrate, '-maxrate', vbitrate, '-bufsize', vbitrate,
+           '-c:a', 'aac', '-b:a', abitrate, '-ac', '2', '-movflags', '+faststart', '-f', 'mp4', str(tmp)]
+    try:
+        subprocess.run(cmd, capture_output=True, timeout=6 * 3600, check=True)
+        os.replace(tmp, dst)
+        return True
+    except (subprocess.SubprocessError, OSError) as e:
+        logging.warning(f"Proxy transcode failed: {src} ({height}p) — {e}")
+        tmp.unlink(missing_ok=True)
+        return False
+
+
+def proxy_worker(limit=PROXY_BATCH):
+    with proxy_lock:
+        proxy_status.update({'is_running': True, 'total': 0, 'processed': 0, 'generated': 0, 'failed': 0, 'current_path': ''})
+
+    conn = get_db()
+    try:
+        valid = set()
+        for r in conn.execute("SELECT id, modified FROM videos v JOIN video_meta m ON m.video_id = v.id WHERE m.favorite = 1 OR m.play_count > 0"):
+            valid.update(proxy_path(r['id'], r['modified'], h).name for h in PROXY_RENDITIONS)
+        for p in PROXY_DIR.glob('*.mp4'):
+            if p.name not in valid:
+                p.unlink(missing_ok=True)
+
+        # お気に入り → 再生回数の多い順に、まだ揃っていない動画から処理する
+        rows = conn.execute("""
+            SELECT v.id, v.path, v.size, v.modified, mi.height, mi.duration FROM videos v
+            JOIN video_meta m ON m.video_id = v.id
+            LEFT JOIN media_info mi ON mi.video_id = v.id
+            WHERE m.favorite = 1 OR m.play_count > 0
+            ORDER BY m.favorite DESC, m.play_count DESC, m.last_played DESC
+        """).fetchall()
+        jobs = []
+        for r in rows:
+            for h in sorted(PROXY_RENDITIONS):
+                if r['height'] and r['height'] <= h:
+                    continue
+                if not proxy_path(r['id'], r['modified'], h).exists():
+                    jobs.append((r, h))
+            if len({j[0]['id'] for j in jobs}) >= limit:
+                break
+        with proxy_lock:
+            proxy_status['total'] = len(jobs)
+
+        made = set()
+        for i, (r, h) in enumerate(jobs, 1):
+            with proxy_lock:
+                proxy_status['current_path'] = r['path']
+            if not Path(r['path']).exists():
+                continue
+            vbitrate, abitrate = PROXY_RENDITIONS[h]
+            kbps = int(vbitrate.rstrip('k')) + int(abitrate.rstrip('k'))
+            estimate = int(r['duration'] * kbps * 1000 / 8) if r['duration'] else (r['size'] or 0) // 4
+            if not enforce_cache_quota(PROXY_DIR, PROXY_QUOTA_BYTES, incoming=estimate, protect=made):
+                break
+            dst = proxy_path(r['id'], r['modified'], h)
+            ok = transcode_proxy(r['path'], dst, h)
+            if ok:
+                made.add(dst)
+            with proxy_lock:
+                proxy_status['processed'] = i
+                proxy_status['generated' if ok else 'failed'] += 1
+    except Exception as e:
+        logging.exception(f"Proxy worker error: {e}")
+    finally:
+        conn.close()
+        with proxy_lock:
+            proxy_status['is_running'] = False
+            proxy_status['current_path'] = ''
+            proxy_status['last_run'] = int(time.time())
+
+
+def proxy_scheduler():
+    while True:
+        time.sleep(PROXY_INTERVAL)
+        with proxy_lock:
+            busy = proxy_status['is_running']
+        with scan_lock:
+            busy = busy or scan_status['is_scanning']
+        if not busy:
+            proxy_worker()
+
+
+def select_rendition(vid, modified, source_height):
+    # ?q=480|720|orig を優先し、無ければ Save-Data / Downlink / ECT のクライアントヒントから決める
+    q = request.args.get('q', 'auto')
+    if q == 'orig':
+        return None
+    if q.isdigit():
+        target = int(q)
+    else:
+        target = None
+        downlink = request.headers.get('Downlink', type=float)
+        ect = request.headers.get('ECT', '')
+        if request.headers.get('Save-Data', '').lower() == 'on' or ect in ('slow-2g', '2g', '3g') or (downlink is not None and downlink < 3):
+            target = 480
+        elif downlink is not None and downlink < 8:
+            target = 720
+    if not target or (source_height and source_height <= target):
+        return None
+    for h in sorted(PROXY_RENDITIONS, reverse=True):
+        if h <= target:
+            p = proxy_path(vid, modified, h)
+            if p.exists():
+                return p
+    return None
+
+
+# --- ストリーミング制御 ---
+
+class TokenBucket:
+    def __init__(self, rate, burst_seconds=STREAM_BURST_SECONDS):
+        self.rate = rate
+        self.capacity = rate * burst_seconds
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = Lock()
+
+    def consume(self, n):
+        # 不足分は負債として先に差し引き、ロックの外で待つ (待ち順が公平になる)
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= n
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+    def try_consume(self, n):
+        # 足りなければ何も差し引かずに False を返す (負債を作らない)
+        if not self.rate:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < n:
+                return False
+            self.tokens -= n
+            return True
+
+
+stream_total_bucket = TokenBucket(STREAM_TOTAL_RATE)
+
+
+def stream_priority():
+    if request.args.get('prio') == 'low' or request.headers.get('X-Stream-Priority') == 'low':
+        return 'preload'
+    if 'prefetch' in (request.headers.get('Sec-Purpose', '') + request.headers.get('Purpose', '')):
+        return 'preload'
+    return 'play'
+
+
+def new_client_state():
+    return {
+        'streams': {},
+        'bucket': TokenBucket(STREAM_CLIENT_RATE),
+        'preload_bucket': TokenBucket(STREAM_CLIENT_RATE * STREAM_PRELOAD_SHARE),
+    }
+
+
+def admit_stream(client, vid, priority):
+    global stream_seq
+    with stream_lock:
+        state = stream_clients.setdefault(client, new_client_state())
+        streams = state['streams']
+        if len(streams) >= STREAM_MAX_PER_CLIENT:
+            if priority == 'preload':
+                return None
+            # 再生要求は先読み → 古い再生 (シークで置き換えられた Range 要求) の順に打ち切る
+            victims = sorted(streams.values(), key=lambda s: (s['priority'] != 'preload', s['started']))
+            for victim in victims[:len(streams) - STREAM_MAX_PER_CLIENT + 1]:
+                victim['cancelled'] = True
+                streams.pop(victim['id'], None)
+        stream_seq += 1
+        info = {'id': stream_seq, 'video_id': vid, 'priority': priority, 'started': time.time(), 'bytes': 0, 'cancelled': False}
+        streams[info['id']] = info
+        return info
+
+
+def release_stream(client, info):
+    with stream_lock:
+        state = stream_clients.get(client)
+        if not state:
+            return
+        state['streams'].pop(info['id'], None)
+        if not state['streams']:
+            stream_clients.pop(client, None)
+
+
+def client_playing(client):
+    with stream_lock:
+        return any(s['priority'] == 'play' for s in stream_clients.get(client, {}).get('streams', {}).values())
+
+
+def governed_body(body, client, info, state):
+    bucket = state['bucket']
+    for chunk in body:
+        if info['cancelled']:
+            return
+        n = len(chunk)
+        if info['priority'] == 'preload' and client_playing(client):
+            # 再生中は先読み用の小さいバケットで上限をかけ、共有バケットは空きがあるときだけ使う。
+            # 共有バケットに負債を作ると再生ストリームまで待たされる
+            state['preload_bucket'].consume(n)
+            while not bucket.try_consume(n):
+                if info['cancelled']:
+                    return
+                time.sleep(STREAM_PRELOAD_POLL)
+        else:
+            bucket.consume(n)
+        stream_total_bucket.consume(n)
+        info['bytes'] += n
+        yield chunk
+
+
+def govern_response(resp, client, info):
+    body = resp.response
+    with stream_lock:
+        state = stream_clients.get(client) or new_client_state()
+
+    def on_close():
+        release_stream(client, info)
+        if hasattr(body, 'close'):
+            body.close()
+
+    # send_file は direct_passthrough なので call_on_close は呼ばれない。イテレータ側で後始末する
+    iterable = governed_body(body, client, info, state) if resp.status_code in (200, 206) else body
+    resp.response = ClosingIterator(iterable, on_close)
+    return resp
 
 
 # --- API ---
 
+# --- UI (シェル HTML + ハッシュ付き静的アセット) ---
+
+ui_shell = {}
+ui_assets = {}
+ui_service_worker = {}
+
+
+def encode_variants(data):
+    variants = {'identity': data, 'gzip': gzip.compress(data, 9)}
+    if brotli:
+        variants['br'] = brotli.compress(data, quality=11)
+    return variants
+
+
+def compile_ui():
+    # テンプレートの解析と圧縮はリクエストごとではなく起動時に一度だけ行う
+    urls = {}
+    for key, body, mimetype in (('css_url', APP_CSS, 'text/css'), ('js_url', APP_JS, 'application/javascript')):
+        data = body.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        name = f"app.{digest}.{'css' if mimetype == 'text/css' else 'js'}"
+        ui_assets[name] = {'mimetype': mimetype, 'etag': digest, 'variants': encode_variants(data)}
+        urls[key] = f"/assets/{name}"
+    html = app.jinja_env.from_string(HTML_TEMPLATE).render(**urls).encode('utf-8')
+    ui_shell.update({'mimetype': 'text/html', 'etag': hashlib.sha256(html).hexdigest()[:12], 'variants': encode_variants(html)})
+    # シェルのハッシュを Service Worker のバージョンにする (CSS/JS が変わればキャッシュも入れ替わる)
+    config = {
+        'version': ui_shell['etag'],
+        'shell': ['/', urls['css_url'], urls['js_url']],
+        'api': SW_API_PATHS,
+        'maxApiEntries': SW_MAX_API_ENTRIES,
+        'maxThumbEntries': SW_MAX_THUMB_ENTRIES,
+        'maxEntryBytes': SW_MAX_ENTRY_BYTES,
+        'thumbMaxAgeMs': SW_THUMB_MAX_AGE * 1000,
+    }
+    sw = SW_JS.replace('__SW_CONFIG__', json.dumps(config)).encode('utf-8')
+    ui_service_worker.update({'mimetype': 'application/javascript', 'etag': hashlib.sha256(sw).hexdigest()[:12], 'variants': encode_variants(sw)})
+
+
+def send_precompressed(entry, cache_control):
+    accept = request.accept_encodings
+    encoding = next((e for e in ('br', 'gzip') if e in entry['variants'] and accept[e]), 'identity')
+    resp = app.response_class(entry['variants'][encoding], mimetype=entry['mimetype'])
+    if encoding != 'identity':
+        resp.headers['Content-Encoding'] = encoding
+    resp.headers['Cache-Control'] = cache_control
+    resp.vary.add('Accept-Encoding')
+    resp.set_etag(f"{entry['etag']}-{encoding}")
+    return resp.make_conditional(request)
+
+
+# --- JSON API の ETag / 圧縮 ---
+
+def library_etag():
+    return f"{library_state['boot_id']}-{current_generation()}"
+
+
+@app.before_request
+def check_library_etag():
+    if request.method != 'GET' or request.endpoint not in ETAG_ENDPOINTS:
+        return None
+    # 世代番号はクエリの前に読む。途中で書き込みがあっても古い ETag になるだけで、誤って 304 にはならない
+    request.library_etag = library_etag()
+    if request.if_none_match.contains_weak(request.library_etag):
+        resp = app.response_class(status=304)
+        resp.set_etag(request.library_etag, weak=True)
+        resp.headers['Cache-Control'] = 'no-cache'
+        return resp
+    return None
+
+
+@app.after_request
+def finalize_json_response(resp):
+    etag = getattr(request, 'library_etag', None)
+    if etag and resp.status_code == 200:
+        resp.set_etag(etag, weak=True)
+        resp.headers['Cache-Control'] = 'no-cache'
+    if (resp.mimetype == 'application/json' and resp.status_code == 200 and not resp.direct_passthrough
+            and 'Content-Encoding' not in resp.headers and not resp.is_streamed):
+        accept = request.accept_encodings
+        data = resp.get_data()
+        if len(data) >= JSON_COMPRESS_MIN_BYTES:
+            if brotli and accept['br']:
+                resp.set_data(brotli.compress(data, quality=5))
+                resp.headers['Content-Encoding'] = 'br'
+            elif accept['gzip']:
+                resp.set_data(gzip.compress(data, JSON_COMPRESS_LEVEL))
+                resp.headers['Content-Encoding'] = 'gzip'
+        resp.vary.add('Accept-Encoding')
+    return resp
+
+
 @app.route('/')
 def index():
-    return render_template_string(HTML_TEMPLATE)
+    resp = send_precompressed(ui_shell, SHELL_CACHE_CONTROL)
+    # /video のレンディション自動選択に使うクライアントヒントを要求する
+    resp.headers['Accept-CH'] = 'Save-Data, Downlink, ECT'
+    return resp
+
+
+@app.route('/assets/<name>')
+def ui_asset(name):
+    entry = ui_assets.get(name)
+    if not entry:
+        return "Not Found", 404
+    return send_precompressed(entry, ASSET_CACHE_CONTROL)
+
+
+@app.route('/sw.js')
+def service_worker():
+    resp = send_precompressed(ui_service_worker, SHELL_CACHE_CONTROL)
+    resp.headers['Service-Worker-Allowed'] = '/'
+    return resp
 
 
 @app.route('/api/scan', methods=['POST'])
@@ -158,54 +1626,89 @@ def start_scan():
     return jsonify({'success': True})
 
 
+@app.route('/api/cache/stats')
+def get_cache_stats():
+    with query_cache_lock:
+        lookups = query_cache_stats['hits'] + query_cache_stats['misses']
+        return jsonify(dict(
+            query_cache_stats,
+            entries=len(query_cache),
+            hit_rate=round(query_cache_stats['hits'] / lookups, 3) if lookups else 0,
+            generation=current_generation(),
+            max_entries=QUERY_CACHE_MAX_ENTRIES,
+            max_bytes=QUERY_CACHE_MAX_BYTES,
+        ))
+
+
 @app.route('/api/scan/status')
 def get_status():
     with scan_lock:
         return jsonify(scan_status)
 
 
+@app.route('/api/probe', methods=['POST'])
+def start_probe():
+    if not FFPROBE_BIN:
+        return jsonify({'error': 'ffprobe not found'}), 503
+    if not start_worker(probe_status, probe_lock, probe_worker):
+        return jsonify({'error': 'already running'}), 409
+    return jsonify({'success': True})
+
+
+@app.route('/api/probe/status')
+def get_probe_status():
+    with probe_lock:
+        return jsonify(probe_status)
+
+
+def stats_payload(conn):
+    total = conn.execute("SELECT COUNT(*) as cnt FROM videos").fetchone()['cnt']
+    favorites = conn.execute("SELECT COUNT(*) as cnt FROM video_meta WHERE favorite = 1").fetchone()['cnt']
+    total_size = conn.execute("SELECT SUM(size) as total FROM videos").fetchone()['total'] or 0
+    
+    tags_raw = conn.execute("SELECT tags FROM video_meta WHERE tags != '' AND tags IS NOT NULL").fetchall()
+    tag_count = {}
+    for row in tags_raw:
+        if row['tags']:
+            for tag in row['tags'].split(','):
+                tag = tag.strip()
+                if tag:
+                    tag_count[tag] = tag_count.get(tag, 0) + 1
+    
+    recent_watched = conn.execute("""
+        SELECT v.id, v.path, h.watched_at
+        FROM watch_history h
+        JOIN videos v ON h.video_id = v.id
+        ORDER BY h.watched_at DESC
+        LIMIT 10
+    """).fetchall()
+    
+    def format_size(bytes):
+        for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
+            if bytes < 1024:
+                return f"{bytes:.1f} {unit}"
+            bytes /= 1024
+        return f"{bytes:.1f} PB"
+    
+    return {
+        'total': total,
+        'favorites': favorites,
+        'total_size': format_size(total_size),
+        'total_size_bytes': total_size,
+        'tags': [{'name': k, 'count': v} for k, v in sorted(tag_count.items(), key=lambda x: -x[1])][:20],
+        'recent_watched': [{'id': r['id'], 'path': r['path'], 'filename': os.path.basename(r['path']), 'watched_at': r['watched_at']} for r in recent_watched]
+    }
+
+
 @app.route('/api/stats')
 def get_stats():
     try:
         conn = get_db()
-        total = conn.execute("SELECT COUNT(*) as cnt FROM videos").fetchone()['cnt']
-        favorites = conn.execute("SELECT COUNT(*) as cnt FROM video_meta WHERE favorite = 1").fetchone()['cnt']
-        total_size = conn.execute("SELECT SUM(size) as total FROM videos").fetchone()['total'] or 0
-        
-        tags_raw = conn.execute("SELECT tags FROM video_meta WHERE tags != '' AND tags IS NOT NULL").fetchall()
-        tag_count = {}
-        for row in tags_raw:
-            if row['tags']:
-                for tag in row['tags'].split(','):
-                    tag = tag.strip()
-                    if tag:
-                        tag_count[tag] = tag_count.get(tag, 0) + 1
-        
-        recent_watched = conn.execute("""
-            SELECT v.id, v.path, h.watched_at
-            FROM watch_history h
-            JOIN videos v ON h.video_id = v.id
-            ORDER BY h.watched_at DESC
-            LIMIT 10
-        """).fetchall()
-        
-        conn.close()
-        
-        def format_size(bytes):
-            for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
-                if bytes < 1024:
-                    return f"{bytes:.1f} {unit}"
-                bytes /= 1024
-            return f"{bytes:.1f} PB"
-        
-        return jsonify({
-            'total': total,
-            'favorites': favorites,
-            'total_size': format_size(total_size),
-            'total_size_bytes': total_size,
-            'tags': [{'name': k, 'count': v} for k, v in sorted(tag_count.items(), key=lambda x: -x[1])][:20],
-            'recent_watched': [{'id': r['id'], 'path': r['path'], 'filename': os.path.basename(r['path']), 'watched_at': r['watched_at']} for r in recent_watched]
-        })
+        try:
+            payload = cached_query('stats', (), lambda: stats_payload(conn))
+        finally:
+            conn.close()
+        return jsonify(payload)
     except Exception as e:
         logging.error(f"Stats error: {e}")
         return jsonify({
@@ -218,43 +1721,49 @@ def get_stats():
         })
 
 
+def folders_payload(conn):
+    rows = conn.execute("SELECT folder, COUNT(*) AS cnt FROM videos GROUP BY folder ORDER BY cnt DESC, folder").fetchall()
+    folders = [{'path': r['folder'], 'count': r['cnt'], 'name': os.path.basename(r['folder']) or r['folder']} for r in rows]
+    return {'folders': folders}
+
+
 @app.route('/api/folders')
 def get_folders():
     conn = get_db()
-    rows = conn.execute("SELECT path FROM videos").fetchall()
+    payload = cached_query('folders', (), lambda: folders_payload(conn))
     conn.close()
-    folder_map = {}
-    for row in rows:
-        folder = os.path.dirname(row['path'])
-        folder_map[folder] = folder_map.get(folder, 0) + 1
-    folders = [{'path': k, 'count': v, 'name': os.path.basename(k) or k} for k, v in folder_map.items()]
-    folders.sort(key=lambda x: (-x['count'], x['path']))
-    return jsonify({'folders': folders})
+    return jsonify(payload)
+
+
+VIDEO_ORDER_MAP = {
+    'modified_desc': 'v.modified DESC',
+    'modified_asc': 'v.modified ASC',
+    'name_asc': 'v.filename ASC',
+    'name_desc': 'v.filename DESC',
+    'play_count_desc': 'COALESCE(m.play_count, 0) DESC',
+    'size_desc': 'v.size DESC',
+    'size_asc': 'v.size ASC',
+    # メディア情報での並び替えは未プローブ (media_info なし) の動画を末尾に回す
+    'duration_desc': 'mi.duration IS NULL, mi.duration DESC',
+    'duration_asc': 'mi.duration IS NULL, mi.duration ASC',
+    'resolution_desc': 'mi.height IS NULL, mi.height DESC',
+    'bitrate_desc': 'mi.bitrate IS NULL, mi.bitrate DESC',
+}
 
 
-@app.route('/api/videos')
-def get_videos():
-    folder = request.args.get('folder')
-    limit = int(request.args.get('limit') or 50)
-    offset = int(request.args.get('offset') or 0)
-    favorites_only = request.args.get('favorites_only') == 'true'
-    search = request.args.get('search', '').strip()
-    sort_by = request.args.get('sort', 'modified_desc')
-    tag_filter = request.args.get('tag', '').strip()
-    
-    conn = get_db()
-    videos = []
-    
-    order_map = {
-        'modified_desc': 'v.modified DESC',
-        'modified_asc': 'v.modified ASC',
-        'name_asc': 'v.path ASC',
-        'name_desc': 'v.path DESC',
-        'play_count_desc': 'COALESCE(m.play_count, 0) DESC',
-        'size_desc': 'v.size DESC',
-        'size_asc': 'v.size ASC',
-    }
-    order_clause = order_map.get(sort_by, 'v.modified DESC')
+def build_video_filter(args):
+    # /api/videos の絞り込み条件を FROM/WHERE 句に変換する
+    folder = args.get('folder')
+    favorites_only = args.get('favorites_only') == 'true'
+    search = args.get('search', '').strip()
+    tag_filter = args.get('tag', '').strip()
+    min_duration = args.get('min_duration', type=float)
+    max_duration = args.get('max_duration', type=float)
+    min_height = args.get('min_height', type=int)
+    playable_only = args.get('playable') == 'true'
+    exts = [e.strip().lstrip('.').lower() for e in args.get('ext', '').split(',') if e.strip()]
+    size_bucket = SIZE_BUCKETS.get(args.get('size_bucket', ''))
+    order_clause = VIDEO_ORDER_MAP.get(args.get('sort', 'modified_desc'), 'v.modified DESC')
 
     where_parts = []
     params = []
@@ -276,47 +1785,177 @@ def get_videos():
         where_parts.append("COALESCE(m.tags, '') LIKE ?")
         params.append(f"%{tag_filter}%")
     
+    if min_duration is not None:
+        where_parts.append("mi.duration >= ?")
+        params.append(min_duration)
+    
+    if max_duration is not None:
+        where_parts.append("mi.duration <= ?")
+        params.append(max_duration)
+    
+    if min_height is not None:
+        where_parts.append("mi.height >= ?")
+        params.append(min_height)
+    
+    if playable_only:
+        where_parts.append("mi.playable = 1")
+    
+    if exts:
+        where_parts.append(f"v.ext IN ({','.join('?' * len(exts))})")
+        params.extend(exts)
+    
+    if size_bucket:
+        lo, hi = size_bucket[1], size_bucket[2]
+        where_parts.append("v.size >= ?")
+        params.append(lo)
+        if hi is not None:
+            where_parts.append("v.size < ?")
+            params.append(hi)
+    
     join_type = "INNER JOIN" if (favorites_only or tag_filter) else "LEFT JOIN"
+    # メディア情報で絞り込む場合は media_info 側のインデックスから走査できるよう INNER JOIN にする。
+    # 並び替えだけのときは件数が変わらないよう LEFT JOIN のまま
+    media_filtered = any(x is not None for x in (min_duration, max_duration, min_height)) or playable_only
+    media_join = "INNER JOIN" if media_filtered else "LEFT JOIN"
     where_clause = "WHERE " + " AND ".join(where_parts) if where_parts else ""
-    
+    from_clause = f"""
+        FROM videos v
+        {join_type} video_meta m ON v.id = m.video_id
+        {media_join} media_info mi ON v.id = mi.video_id
+    """
+    return from_clause, where_clause, params, order_clause
+
+
+VIDEO_ROW_COLUMNS = """
+    v.id, v.path, v.size, v.modified, m.play_count, m.favorite, m.tags, p.tiles AS preview_tiles,
+    mi.duration, mi.width, mi.height, mi.vcodec, mi.acodec, mi.playable, mi.created, m.last_position
+"""
+
+
+def video_row_dict(r):
+    return {'id': r['id'], 'path': r['path'], 'filename': os.path.basename(r['path']), 'play_count': r['play_count'] or 0, 'favorite': bool(r['favorite']), 'tags': (r['tags'] or '').split(',') if r['tags'] else [], 'size': r['size'] or 0, 'size_str': format_size_helper(r['size']), 'has_preview': bool(r['preview_tiles']), 'duration': r['duration'], 'width': r['width'], 'height': r['height'], 'vcodec': r['vcodec'], 'acodec': r['acodec'], 'playable': bool(r['playable']), 'created': r['created'], 'last_position': r['last_position']}
+
+
+def videos_payload(conn, args):
+    limit = int(args.get('limit') or 50)
+    offset = int(args.get('offset') or 0)
+    from_clause, where_clause, params, order_clause = build_video_filter(args)
+
     query = f"""
-        SELECT v.id, v.path, v.size, v.modified, m.play_count, m.favorite, m.tags 
-        FROM videos v 
-        {join_type} video_meta m ON v.id = m.video_id 
+        SELECT {VIDEO_ROW_COLUMNS}
+        {from_clause}
+        LEFT JOIN previews p ON v.id = p.video_id
         {where_clause}
         ORDER BY {order_clause} 
         LIMIT ? OFFSET ?
     """
-    params.extend([limit, offset])
+    rows = conn.execute(query, params + [limit, offset]).fetchall()
+    videos = [video_row_dict(r) for r in rows]
     
-    rows = conn.execute(query, params).fetchall()
+    total = conn.execute(f"SELECT COUNT(*) as total {from_clause} {where_clause}", params).fetchone()['total']
+    return {'videos': videos, 'total': total}
+
+
+def facets_payload(conn, args):
+    from_clause, where_clause, params, _ = build_video_filter(args)
+    # サイズ不明 (NULL) はどのサイズ帯にも数えない (ELSE の最上位の帯に落ちないよう先に外す)
+    bucket_case = "CASE WHEN v.size IS NULL THEN NULL " + " ".join(
+        f"WHEN v.size < {hi} THEN '{key}'" for key, (_, _, hi) in SIZE_BUCKETS.items() if hi is not None
+    ) + f" ELSE '{next(reversed(SIZE_BUCKETS))}' END"
+    # 拡張子・サイズ帯・フォルダを 1 回の走査でまとめて集計する
+    rows = conn.execute(f"""
+        SELECT v.ext, {bucket_case} AS bucket, v.folder, COUNT(*) AS cnt, SUM(COALESCE(m.favorite, 0)) AS fav
+        {from_clause} {where_clause}
+        GROUP BY v.ext, bucket, v.folder
+    """, params).fetchall()
+    exts, buckets, folders = {}, {}, {}
+    total = favorites = 0
+    for r in rows:
+        exts[r['ext'] or ''] = exts.get(r['ext'] or '', 0) + r['cnt']
+        if r['bucket']:
+            buckets[r['bucket']] = buckets.get(r['bucket'], 0) + r['cnt']
+        folders[r['folder']] = folders.get(r['folder'], 0) + r['cnt']
+        total += r['cnt']
+        favorites += r['fav']
+
+    # タグはカンマ区切り文字列なので、同じ組み合わせをまとめてから展開する
+    tag_count = {}
+    for r in conn.execute(f"SELECT m.tags, COUNT(*) AS cnt {from_clause} {where_clause} {'AND' if where_clause else 'WHERE'} m.tags != '' GROUP BY m.tags", params):
+        for tag in r['tags'].split(','):
+            tag = tag.strip()
+            if tag:
+                tag_count[tag] = tag_count.get(tag, 0) + r['cnt']
+
+    return {
+        'total': total,
+        'favorites': favorites,
+        'ext': [{'value': k, 'count': v} for k, v in sorted(exts.items(), key=lambda x: -x[1])],
+        'size_bucket': [{'value': k, 'label': label, 'count': buckets[k]} for k, (label, _, _) in SIZE_BUCKETS.items() if k in buckets],
+        'tags': [{'value': k, 'count': v} for k, v in sorted(tag_count.items(), key=lambda x: -x[1])[:FACET_TOP_TAGS]],
+        'folders': [{'path': k, 'name': os.path.basename(k) or k, 'count': v} for k, v in sorted(folders.items(), key=lambda x: -x[1])[:FACET_TOP_FOLDERS]],
+    }
 
-    if not rows and folder and not favorites_only and not search and not tag_filter:
-        p = Path(folder)
-        if p.exists() and p.is_dir():
-            for entry in p.iterdir():
-                try:
-                    if entry.is_file() and entry.suffix.lower() in VIDEO_EXTENSIONS:
-                        stat = entry.stat()
-                        norm_path = str(entry.resolve().as_posix())
-                        conn.execute("INSERT OR IGNORE INTO videos (path, size, modified) VALUES (?, ?, ?)", (norm_path, stat.st_size, int(stat.st_mtime)))
-                except:
-                    pass
-            conn.commit()
-            rows = conn.execute(query, params).fetchall()
-
-    videos = [{'id': r['id'], 'path': r['path'], 'filename': os.path.basename(r['path']), 'play_count': r['play_count'] or 0, 'favorite': bool(r['favorite']), 'tags': (r['tags'] or '').split(',') if r['tags'] else [], 'size': r['size'] or 0, 'size_str': format_size_helper(r['size'])} for r in rows]
-    
-    count_query = f"""
-        SELECT COUNT(*) as total
-        FROM videos v
-        {join_type} video_meta m ON v.id = m.video_id
-        {where_clause}
-    """
-    total = conn.execute(count_query, params[:-2]).fetchone()['total']
+
+@app.route('/api/facets')
+def get_facets():
+    key = tuple(sorted((k, v) for k, v in request.args.items(multi=True) if k not in ('limit', 'offset', 'sort')))
+    conn = get_db()
+    payload = cached_query('facets', key, lambda: facets_payload(conn, request.args))
+    conn.close()
+    return jsonify(payload)
+
+
+@app.route('/api/suggest')
+def suggest():
+    q = request.args.get('q', '').strip().lower()
+    k = min(max(request.args.get('limit', SUGGEST_DEFAULT_K, type=int), 1), SUGGEST_MAX_K)
+    if not q:
+        return jsonify({'suggestions': []})
+    started = time.perf_counter()
+    index = current_suggest_index()
+    suggestions = lookup_suggestions(index, q, k) if index else []
+    return jsonify({'suggestions': suggestions, 'took_ms': round((time.perf_counter() - started) * 1000, 2)})
+
+
+def import_folder_files(conn, folder):
+    # 未スキャンのフォルダを開いたときに直下の動画だけ取り込む
+    p = Path(folder)
+    if not p.exists() or not p.is_dir():
+        return False
+    changes = conn.total_changes
+    for entry in p.iterdir():
+        try:
+            if entry.is_file() and entry.suffix.lower() in VIDEO_EXTENSIONS:
+                stat = entry.stat()
+                norm_path = str(entry.resolve().as_posix())
+                conn.execute("INSERT OR IGNORE INTO videos (path, size, modified, folder, filename, ext) VALUES (?, ?, ?, ?, ?, ?)",
+                             (norm_path, stat.st_size, int(stat.st_mtime), os.path.dirname(norm_path), entry.name, file_ext(norm_path)))
+        except:
+            pass
+    # 何も取り込まなければ folders もキャッシュ/ETag もそのまま (空フォルダを開くたびに無効化しない)
+    if conn.total_changes == changes:
+        return False
+    rebuild_folders(conn)
+    conn.commit()
+    bump_generation(names=True)
+    return True
+
+
+@app.route('/api/videos')
+def get_videos():
+    args = request.args
+    key = tuple(sorted(args.items(multi=True)))
+    conn = get_db()
+    payload = cached_query('videos', key, lambda: videos_payload(conn, args))
+
+    folder = args.get('folder')
+    # フォルダ以外の絞り込みで空になったときはディスクを見に行かない (条件は build_video_filter の結果で比べる)
+    unfiltered = folder and build_video_filter(args)[1] == build_video_filter(MultiDict({'folder': folder}))[1]
+    if not payload['videos'] and unfiltered and import_folder_files(conn, folder):
+        payload = cached_query('videos', key, lambda: videos_payload(conn, args))
 
     conn.close()
-    return jsonify({'videos': videos, 'total': total})
+    return jsonify(payload)
 
 
 def format_size_helper(bytes):
@@ -329,46 +1968,223 @@ def format_size_helper(bytes):
     return f"{bytes:.1f}GB"
 
 
+def shorts_seen_set(token):
+    with shorts_lock:
+        if token in shorts_sessions:
+            shorts_sessions.move_to_end(token)
+        else:
+            shorts_sessions[token] = set()
+            while len(shorts_sessions) > SHORTS_MAX_SESSIONS:
+                shorts_sessions.popitem(last=False)
+        seen = shorts_sessions[token]
+        if len(seen) > SHORTS_SEEN_LIMIT:
+            seen.clear()
+        return seen
+
+
+def sample_shorts(conn, limit, seen):
+    # フォルダを一様に選び、フォルダ内の (folder, id) インデックス範囲から1件引く。全件を読まない
+    folder_max = conn.execute("SELECT MAX(id) AS m FROM folders").fetchone()['m']
+    if not folder_max:
+        return []
+    shorts = []
+    used_folders = set()
+    max_attempts = limit * SHORTS_SAMPLE_ATTEMPTS
+    for attempt in range(max_attempts):
+        if len(shorts) >= limit:
+            break
+        f = conn.execute("SELECT id, path FROM folders WHERE id >= ? ORDER BY id LIMIT 1",
+                         (random.randint(1, folder_max),)).fetchone()
+        # 前半は同じフォルダを避け、それでも埋まらなければ許可する
+        if not f or (f['id'] in used_folders and attempt < max_attempts // 2):
+            continue
+        b = conn.execute("SELECT MIN(id) AS lo, MAX(id) AS hi FROM videos WHERE folder=?", (f['path'],)).fetchone()
+        if b['lo'] is None:
+            continue
+        candidates = conn.execute("SELECT id, path FROM videos WHERE folder=? AND id >= ? ORDER BY id LIMIT 4",
+                                  (f['path'], random.randint(b['lo'], b['hi']))).fetchall()
+        video = next((c for c in candidates if c['id'] not in seen), None)
+        if not video:
+            continue
+        seen.add(video['id'])
+        used_folders.add(f['id'])
+        folder = f['path']
+        shorts.append({'id': video['id'], 'path': video['path'], 'filename': os.path.basename(video['path']), 'folder_path': folder, 'folder_name': os.path.basename(folder) or folder})
+    return shorts
+
+
 @app.route('/api/shorts')
 def get_shorts():
+    limit = min(int(request.args.get('limit') or SHORTS_PAGE_SIZE), 200)
+    token = request.args.get('session') or secrets.token_hex(8)
+    seen = shorts_seen_set(token)
+
     conn = get_db()
-    rows = conn.execute("SELECT id, path FROM videos").fetchall()
+    shorts = sample_shorts(conn, limit, seen)
+    if len(shorts) < limit and seen:
+        # ライブラリを一周したら既読をリセットして続ける
+        seen.clear()
+        seen.update(s['id'] for s in shorts)
+        if not shorts:
+            shorts = sample_shorts(conn, limit, seen)
     conn.close()
-
-    folder_groups = {}
-    for r in rows:
-        parent = os.path.dirname(r['path'])
-        folder_groups.setdefault(parent, []).append(r)
-
-    shorts = []
-    keys = list(folder_groups.keys())
-    random.shuffle(keys)
-    for k in keys:
-        if not folder_groups[k]: continue
-        video = random.choice(folder_groups[k])
-        shorts.append({'id': video['id'], 'path': video['path'], 'filename': os.path.basename(video['path']), 'folder_path': k, 'folder_name': os.path.basename(k) or k})
-        if len(shorts) >= 50:
-            break
-    return jsonify({'shorts': shorts})
+    return jsonify({'shorts': shorts, 'session': token})
 
 
 @app.route('/video/<int:vid>')
 def stream(vid):
     conn = get_db()
-    row = conn.execute("SELECT path FROM videos WHERE id=?", (vid,)).fetchone()
+    row = conn.execute("SELECT v.path, v.modified, mi.height FROM videos v LEFT JOIN media_info mi ON mi.video_id = v.id WHERE v.id=?", (vid,)).fetchone()
     conn.close()
-    if row and Path(row['path']).exists():
-        return send_file(row['path'])
+    if not row or not Path(row['path']).exists():
+        return "Not Found", 404
+
+    client = request.remote_addr
+    info = admit_stream(client, vid, stream_priority())
+    if not info:
+        return "Too Many Streams", 503, {'Retry-After': '2'}
+    try:
+        proxy = select_rendition(vid, row['modified'], row['height'])
+        cached = faststart_path(vid, row['modified'])
+        if proxy:
+            touch_cache_entry(proxy)
+            resp = send_file(proxy, mimetype='video/mp4')
+            resp.headers['X-Rendition'] = proxy.stem.rsplit('_', 1)[-1]
+            resp.vary.update(['Save-Data', 'Downlink', 'ECT'])
+        elif cached.exists():
+            touch_cache_entry(cached)
+            resp = send_file(cached, mimetype='video/mp4')
+        else:
+            resp = send_file(row['path'])
+    except Exception:
+        release_stream(client, info)
+        raise
+    return govern_response(resp, client, info)
+
+
+@app.route('/api/admin/streams')
+def get_stream_state():
+    now = time.time()
+    with stream_lock:
+        clients = [{
+            'client': client,
+            'streams': [{
+                'id': s['id'], 'video_id': s['video_id'], 'priority': s['priority'], 'bytes': s['bytes'],
+                'seconds': round(now - s['started'], 1),
+                'avg_rate': int(s['bytes'] / max(now - s['started'], 0.001)),
+            } for s in state['streams'].values()],
+        } for client, state in stream_clients.items()]
+    return jsonify({
+        'clients': clients,
+        'active_streams': sum(len(c['streams']) for c in clients),
+        'limits': {
+            'max_per_client': STREAM_MAX_PER_CLIENT,
+            'client_rate': STREAM_CLIENT_RATE,
+            'total_rate': STREAM_TOTAL_RATE,
+            'preload_share': STREAM_PRELOAD_SHARE,
+        },
+    })
+
+
+def format_vtt_time(seconds):
+    h = int(seconds // 3600)
+    m = int(seconds % 3600 // 60)
+    s = seconds % 60
+    return f"{h:02d}:{m:02d}:{s:06.3f}"
+
+
+@app.route('/preview/<int:vid>.jpg')
+def preview_sprite(vid):
+    p = preview_path(vid)
+    if p.exists():
+        return send_file(p, mimetype='image/jpeg', max_age=86400)
     return "Not Found", 404
 
 
+@app.route('/preview/<int:vid>.vtt')
+def preview_vtt(vid):
+    conn = get_db()
+    r = conn.execute("SELECT interval, tiles FROM previews WHERE video_id=?", (vid,)).fetchone()
+    conn.close()
+    if not r or not preview_path(vid).exists():
+        return "Not Found", 404
+    lines = ['WEBVTT', '']
+    for i in range(r['tiles']):
+        x = (i % PREVIEW_COLS) * PREVIEW_TILE_W
+        y = (i // PREVIEW_COLS) * PREVIEW_TILE_H
+        lines.append(f"{format_vtt_time(i * r['interval'])} --> {format_vtt_time((i + 1) * r['interval'])}")
+        lines.append(f"/preview/{vid}.jpg#xywh={x},{y},{PREVIEW_TILE_W},{PREVIEW_TILE_H}")
+        lines.append('')
+    return app.response_class('\n'.join(lines), mimetype='text/vtt')
+
+
+@app.route('/api/previews', methods=['POST'])
+def start_previews():
+    if not FFMPEG_BIN or not FFPROBE_BIN:
+        return jsonify({'error': 'ffmpeg not found'}), 503
+    with preview_lock:
+        if preview_status['is_running']:
+            return jsonify({'error': 'already running'}), 409
+        preview_status['is_running'] = True
+    video_ids = (request.json or {}).get('video_ids') if request.is_json else None
+    Thread(target=preview_worker, args=(video_ids,), daemon=True).start()
+    return jsonify({'success': True})
+
+
+@app.route('/api/previews/status')
+def get_preview_status():
+    with preview_lock:
+        return jsonify(dict(preview_status, available=bool(FFMPEG_BIN and FFPROBE_BIN)))
+
+
+@app.route('/api/faststart', methods=['POST'])
+def start_faststart():
+    if not FFMPEG_BIN:
+        return jsonify({'error': 'ffmpeg not found'}), 503
+    if not start_worker(faststart_status, faststart_lock, faststart_worker):
+        return jsonify({'error': 'already running'}), 409
+    return jsonify({'success': True})
+
+
+@app.route('/api/faststart/status')
+def get_faststart_status():
+    used = cache_usage(FASTSTART_DIR)
+    with faststart_lock:
+        return jsonify(dict(faststart_status, cache_bytes=used, cache_limit=FASTSTART_CACHE_BYTES))
+
+
+@app.route('/api/proxies', methods=['POST'])
+def start_proxies():
+    if not FFMPEG_BIN:
+        return jsonify({'error': 'ffmpeg not found'}), 503
+    with proxy_lock:
+        if proxy_status['is_running']:
+            return jsonify({'error': 'already running'}), 409
+        proxy_status['is_running'] = True
+    limit = int((request.json or {}).get('limit') or PROXY_BATCH) if request.is_json else PROXY_BATCH
+    Thread(target=proxy_worker, args=(limit,), daemon=True).start()
+    return jsonify({'success': True})
+
+
+@app.route('/api/proxies/status')
+def get_proxy_status():
+    used = cache_usage(PROXY_DIR)
+    with proxy_lock:
+        return jsonify(dict(proxy_status, enabled=bool(PROXY_ENABLED and FFMPEG_BIN), cache_bytes=used, cache_limit=PROXY_QUOTA_BYTES))
+
+
+def playlists_payload(conn):
+    rows = conn.execute("SELECT * FROM playlists ORDER BY created DESC").fetchall()
+    return {'playlists': [{'id': r['id'], 'name': r['name'], 'created': r['created'], 'video_ids': r['video_ids'].split(',') if r['video_ids'] else []} for r in rows]}
+
+
 @app.route('/api/playlists', methods=['GET', 'POST', 'DELETE'])
 def playlists():
     conn = get_db()
     if request.method == 'GET':
-        rows = conn.execute("SELECT * FROM playlists ORDER BY created DESC").fetchall()
+        payload = cached_query('playlists', (), lambda: playlists_payload(conn))
         conn.close()
-        return jsonify({'playlists': [{'id': r['id'], 'name': r['name'], 'created': r['created'], 'video_ids': r['video_ids'].split(',') if r['video_ids'] else []} for r in rows]})
+        return jsonify(payload)
     elif request.method == 'POST':
         data = request.json
         name = data.get('name', '新しいプレイリスト')
@@ -376,6 +2192,7 @@ def playlists():
         created = int(time.time())
         conn.execute("INSERT INTO playlists (name, created, video_ids) VALUES (?, ?, ?)", (name, created, video_ids))
         conn.commit()
+        bump_generation()
         playlist_id = conn.execute("SELECT last_insert_rowid() as id").fetchone()['id']
         conn.close()
         return jsonify({'id': playlist_id, 'name': name})
@@ -383,61 +2200,420 @@ def playlists():
         playlist_id = request.json.get('id')
         conn.execute("DELETE FROM playlists WHERE id = ?", (playlist_id,))
         conn.commit()
+        bump_generation()
         conn.close()
         return jsonify({'ok': True})
 
 
+BATCH_HANDLERS = {
+    'stats': lambda conn, args: stats_payload(conn),
+    'folders': lambda conn, args: folders_payload(conn),
+    'videos': videos_payload,
+    'facets': facets_payload,
+    'playlists': lambda conn, args: playlists_payload(conn),
+}
+
+
+def batch_args(params):
+    # JSON の true/数値をクエリ文字列と同じ表現にそろえる (キャッシュキーも単体 API と共有される)
+    return MultiDict({k: ('true' if v is True else 'false' if v is False else str(v))
+                      for k, v in (params or {}).items() if v is not None})
+
+
+@app.route('/api/batch', methods=['POST'])
+def batch():
+    items = (request.json or {}).get('requests') or []
+    if not isinstance(items, list) or len(items) > BATCH_MAX_REQUESTS:
+        return jsonify({'error': f'requests must be a list of at most {BATCH_MAX_REQUESTS} items'}), 400
+
+    conn = get_db()
+    generation = current_generation()
+    results = {}
+    try:
+        # 1 本の読み取りトランザクション内で全サブリクエストを処理し、同じスナップショットを返す
+        conn.execute("BEGIN")
+        for i, item in enumerate(items):
+            name = item.get('endpoint') if isinstance(item, dict) else item
+            key = str(item.get('id', name)) if isinstance(item, dict) else str(name)
+            handler = BATCH_HANDLERS.get(name)
+            if not handler:
+                results[key] = {'error': f'unknown endpoint: {name}'}
+                continue
+            args = batch_args(item.get('params') if isinstance(item, dict) else None)
+            key_args = tuple(sorted(args.items(multi=True))) if name in ('videos', 'facets') else ()
+            results[key] = cached_query(name, key_args, lambda: handler(conn, args), generation)
+        conn.rollback()
+    finally:
+        conn.close()
+    # 個別 API と同じ ETag を返し、クライアントがページキャッシュに登録できるようにする
+    return jsonify({'generation': generation, 'etag': f"{library_state['boot_id']}-{generation}", 'results': results})
+
+
+def export_rows(args):
+    # サーバー側カーソルから EXPORT_CHUNK_ROWS 件ずつ取り出す (ライブラリ全体をメモリに載せない)
+    from_clause, where_clause, params, _ = build_video_filter(args)
+    conn = get_db()
+    try:
+        cur = conn.execute(f"""
+            SELECT v.path, v.size, v.modified, m.play_count, m.favorite, m.tags, m.last_played
+            {from_clause} {where_clause}
+            ORDER BY v.id
+        """, params)
+        while True:
+            rows = cur.fetchmany(EXPORT_CHUNK_ROWS)
+            if not rows:
+                break
+            yield [{
+                'path': r['path'],
+                'size': r['size'],
+                'modified': r['modified'],
+                'play_count': r['play_count'] or 0,
+                'favorite': bool(r['favorite']),
+                'tags': r['tags'] or '',
+                'last_played': r['last_played'],
+            } for r in rows]
+    finally:
+        conn.close()
+
+
+def export_chunks(fmt, args):
+    if fmt == 'ndjson':
+        for rows in export_rows(args):
+            yield ''.join(json.dumps(r, ensure_ascii=False) + '\n' for r in rows)
+    elif fmt == 'csv':
+        buf = io.StringIO()
+        writer = csv.DictWriter(buf, fieldnames=EXPORT_FIELDS, lineterminator='\n')
+        writer.writeheader()
+        for rows in export_rows(args):
+            writer.writerows(rows)
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+        if buf.tell():
+            yield buf.getvalue()
+    else:
+        # 従来の {"exported_at": ..., "videos": [...]} 形式を逐次書き出す
+        yield '{"exported_at": ' + json.dumps(datetime.now().isoformat()) + ', "videos": ['
+        first = True
+        for rows in export_rows(args):
+            body = ',\n'.join(json.dumps(r, ensure_ascii=False) for r in rows)
+            yield ('\n' if first else ',\n') + body
+            first = False
+        yield '\n]}\n'
+
+
+def gzip_stream(chunks):
+    comp = zlib.compressobj(JSON_COMPRESS_LEVEL, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        # チャンクごとに同期フラッシュして、クライアントがすぐに受信を始められるようにする
+        data = comp.compress(chunk.encode('utf-8')) + comp.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield comp.flush()
+
+
 @app.route('/api/export')
 def export_data():
+    fmt = request.args.get('format', 'json')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f'unknown format: {fmt}'}), 400
+    use_gzip = request.args.get('gzip') in ('1', 'true')
+    mimetype, ext = EXPORT_FORMATS[fmt]
+
+    args = request.args.copy()
+    chunks = export_chunks(fmt, args)
+    filename = f"video_manager_export_{int(time.time())}.{ext}"
+    if use_gzip:
+        body = gzip_stream(chunks)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+    else:
+        body = (c.encode('utf-8') for c in chunks)
+    resp = app.response_class(body, mimetype=mimetype)
+    resp.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    resp.headers['X-Accel-Buffering'] = 'no'
+    return resp
+
+
+# --- メタデータのインポート ---
+
+def iter_legacy_json(text, buf=''):
+    # {"exported_at": ..., "videos": [...]} の配列要素を 1 件ずつデコードする (ファイル全体は読み込まない)
+    decoder = json.JSONDecoder()
+    while True:
+        start = buf.find('"videos"')
+        bracket = buf.find('[', start) if start >= 0 else -1
+        if bracket >= 0:
+            pos = bracket + 1
+            break
+        chunk = text.read(IMPORT_READ_BYTES)
+        if not chunk:
+            return
+        buf += chunk
+
+    while True:
+        while pos < len(buf) and buf[pos] in ' \t\r\n,':
+            pos += 1
+        if pos < len(buf) and buf[pos] == ']':
+            return
+        try:
+            if pos >= len(buf):
+                raise json.JSONDecodeError('need more data', buf, pos)
+            obj, pos = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            chunk = text.read(IMPORT_READ_BYTES)
+            if not chunk:
+                if pos >= len(buf):
+                    return
+                raise
+            buf = buf[pos:] + chunk
+            pos = 0
+            continue
+        yield obj
+
+
+def iter_import_records(text):
+    # 先頭行で NDJSON / CSV / 従来の JSON を判別する
+    first = text.readline()
+    stripped = first.strip()
+    if stripped.startswith('{'):
+        try:
+            obj = json.loads(stripped)
+        except ValueError:
+            obj = None
+        if isinstance(obj, dict) and 'path' in obj:
+            yield obj
+            for line in text:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from iter_legacy_json(text, first)
+    elif stripped.startswith('path'):
+        yield from csv.DictReader(itertools.chain([first], text))
+    else:
+        raise ValueError('unknown import format')
+
+
+def normalize_import_record(r):
+    path = r.get('path')
+    if not path:
+        return None
+    tags = r.get('tags') or ''
+    if isinstance(tags, list):
+        tags = ','.join(tags)
+    tags = ','.join(t.strip() for t in str(tags).split(',') if t.strip())
+    try:
+        size = int(r['size']) if r.get('size') not in (None, '') else None
+        last_played = int(r['last_played']) if r.get('last_played') not in (None, '') else None
+        play_count = int(r.get('play_count') or 0)
+    except (TypeError, ValueError):
+        return None
+    favorite = 1 if r.get('favorite') in (True, 1, '1', 'true', 'True') else 0
+    return (str(path), os.path.basename(str(path)), size, play_count, favorite, tags, last_played)
+
+
+def merge_tags(existing, incoming):
+    if not existing:
+        return incoming or ''
+    if not incoming:
+        return existing
+    merged = existing.split(',')
+    merged += [t for t in incoming.split(',') if t not in merged]
+    return ','.join(merged)
+
+
+def apply_import_batch(cur, rows):
+    # videos を読んでから video_meta に書くので、最初から書き込みトランザクションにしておく
+    # (読み取りで始めると、他の接続のコミット後に昇格できず database is locked になる)
+    cur.execute("BEGIN IMMEDIATE")
+    cur.execute("DELETE FROM import_batch")
+    cur.executemany("INSERT INTO import_batch (path, name, size, play_count, favorite, tags, last_played) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    # まずパスで一致させ、残りは「ファイル名 + サイズ」が一意に決まるものだけ拾う (別マシンでパスが変わった場合)
+    cur.execute("UPDATE import_batch SET video_id = (SELECT id FROM videos v WHERE v.path = import_batch.path)")
+    cur.execute("""
+        UPDATE import_batch SET video_id = (
+            SELECT CASE WHEN COUNT(*) = 1 THEN MIN(v.id) END
+            FROM videos v WHERE v.filename = import_batch.name AND v.size = import_batch.size
+        )
+        WHERE video_id IS NULL AND size IS NOT NULL
+    """)
+    cur.execute("""
+        INSERT INTO video_meta (video_id, play_count, favorite, tags, last_played)
+        SELECT video_id, play_count, favorite, tags, last_played FROM import_batch WHERE video_id IS NOT NULL
+        ON CONFLICT(video_id) DO UPDATE SET
+            play_count = MAX(COALESCE(play_count, 0), excluded.play_count),
+            favorite = MAX(COALESCE(favorite, 0), excluded.favorite),
+            tags = merge_tags(tags, excluded.tags),
+            last_played = CASE WHEN excluded.last_played > COALESCE(last_played, 0) THEN excluded.last_played ELSE last_played END
+    """)
+    return cur.execute("SELECT COUNT(*) AS cnt FROM import_batch WHERE video_id IS NOT NULL").fetchone()['cnt']
+
+
+def import_worker(path, remove_after=False, progress=None):
+    # progress はバッチごとに import_status の写しを受け取る (CLI の進捗表示用)
+    path = Path(path)
+    with import_lock:
+        import_status.update({'is_running': True, 'processed': 0, 'matched': 0, 'skipped': 0, 'read_bytes': 0,
+                              'total_bytes': 0, 'error': None, 'file': path.name})
+
     conn = get_db()
-    videos = conn.execute("SELECT v.*, m.play_count, m.favorite, m.tags FROM videos v LEFT JOIN video_meta m ON v.id = m.video_id").fetchall()
-    conn.close()
-    
-    data = {
-        'exported_at': datetime.now().isoformat(),
-        'videos': [{
-            'path': r['path'],
-            'size': r['size'],
-            'modified': r['modified'],
-            'play_count': r['play_count'] or 0,
-            'favorite': bool(r['favorite']),
-            'tags': r['tags'] or ''
-        } for r in videos]
-    }
-    
-    filename = f"video_manager_export_{int(time.time())}.json"
-    filepath = EXPORT_DIR / filename
-    with open(filepath, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-    return send_file(filepath, as_attachment=True, download_name=filename)
+    conn.create_function('merge_tags', 2, merge_tags, deterministic=True)
+    cur = conn.cursor()
+    cur.execute("CREATE TEMP TABLE IF NOT EXISTS import_batch (path TEXT, name TEXT, size INTEGER, play_count INTEGER, favorite INTEGER, tags TEXT, last_played INTEGER, video_id INTEGER)")
+    try:
+        total_bytes = path.stat().st_size
+        with import_lock:
+            import_status['total_bytes'] = total_bytes
+        with open(path, 'rb') as raw:
+            compressed = raw.read(2) == b'\x1f\x8b'
+            raw.seek(0)
+            stream = gzip.GzipFile(fileobj=raw) if compressed else raw
+            text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+
+            batch = []
+            skipped = 0
+
+            def flush():
+                matched = apply_import_batch(cur, batch)
+                conn.commit()
+                bump_generation(names=matched > 0)
+                with import_lock:
+                    import_status['processed'] += len(batch)
+                    import_status['matched'] += matched
+                    import_status['skipped'] = skipped
+                    import_status['read_bytes'] = raw.tell()
+                    snapshot = dict(import_status)
+                batch.clear()
+                if progress:
+                    progress(snapshot)
+
+            for record in iter_import_records(text):
+                row = normalize_import_record(record) if isinstance(record, dict) else None
+                if row is None:
+                    skipped += 1
+                    continue
+                batch.append(row)
+                if len(batch) >= IMPORT_BATCH_ROWS:
+                    flush()
+            flush()
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Import error: {e}")
+        with import_lock:
+            import_status['error'] = str(e)
+    finally:
+        conn.close()
+        if remove_after:
+            path.unlink(missing_ok=True)
+        with import_lock:
+            import_status['is_running'] = False
+    with import_lock:
+        return dict(import_status)
+
+
+@app.route('/api/import', methods=['POST'])
+def start_import():
+    with import_lock:
+        if import_status['is_running']:
+            return jsonify({'error': 'already running'}), 409
+        import_status.update({'is_running': True, 'error': None})
+
+    # アップロードはディスクへ逐次書き出し、解析はバックグラウンドで行う
+    upload = request.files.get('file')
+    stream = upload.stream if upload else request.stream
+    dest = EXPORT_DIR / f"import_{int(time.time())}_{secrets.token_hex(4)}.upload"
+    try:
+        with open(dest, 'wb') as out:
+            shutil.copyfileobj(stream, out, IMPORT_READ_BYTES)
+    except Exception as e:
+        dest.unlink(missing_ok=True)
+        with import_lock:
+            import_status['is_running'] = False
+        return jsonify({'error': str(e)}), 400
+    if dest.stat().st_size == 0:
+        dest.unlink(missing_ok=True)
+        with import_lock:
+            import_status['is_running'] = False
+        return jsonify({'error': 'empty upload'}), 400
+
+    Thread(target=import_worker, args=(dest, True), daemon=True).start()
+    return jsonify({'success': True})
+
+
+@app.route('/api/import/status')
+def get_import_status():
+    with import_lock:
+        return jsonify(import_status)
 
 
 @app.route('/api/bulk_action', methods=['POST'])
 def bulk_action():
-    data = request.json
+    data = request.json or {}
     action = data.get('action')
-    video_ids = data.get('video_ids', [])
+    if action not in BULK_ACTIONS:
+        return jsonify({'error': f'unknown action: {action}'}), 400
+    tags = [t.strip() for t in (data.get('tags') or '').split(',') if t.strip()]
+    if action in ('add_tags', 'remove_tags') and not tags:
+        return jsonify({'error': 'no tags'}), 400
+    if 'filter' in data:
+        # filter: null などを空の条件 (= ライブラリ全体) として扱わないようにする
+        if not isinstance(data['filter'], dict):
+            return jsonify({'error': 'filter must be an object'}), 400
+    else:
+        try:
+            ids = [int(v) for v in data.get('video_ids') or []]
+        except (TypeError, ValueError):
+            return jsonify({'error': 'video_ids must be a list of integers'}), 400
+
     conn = get_db()
-    cur = conn.cursor()
-    if action == 'add_favorite':
-        for vid in video_ids:
-            cur.execute("INSERT INTO video_meta(video_id, favorite) VALUES (?, 1) ON CONFLICT(video_id) DO UPDATE SET favorite=1", (vid,))
-    elif action == 'remove_favorite':
-        for vid in video_ids:
-            cur.execute("UPDATE video_meta SET favorite=0 WHERE video_id=?", (vid,))
-    elif action == 'add_tags':
-        tags_to_add = data.get('tags', '')
-        for vid in video_ids:
-            cur.execute("SELECT tags FROM video_meta WHERE video_id=?", (vid,))
-            r = cur.fetchone()
-            existing = r['tags'] if r and r['tags'] else ''
-            existing_set = set(existing.split(',')) if existing else set()
-            new_set = existing_set | set(tags_to_add.split(','))
-            new_tags = ','.join(filter(None, new_set))
-            cur.execute("INSERT INTO video_meta(video_id, tags) VALUES (?, ?) ON CONFLICT(video_id) DO UPDATE SET tags=?", (vid, new_tags, new_tags))
-    conn.commit()
-    conn.close()
-    return jsonify({'ok': True})
+    try:
+        cur = conn.cursor()
+        cur.execute("CREATE TEMP TABLE IF NOT EXISTS bulk_targets (video_id INTEGER PRIMARY KEY)")
+        # 対象の読み取りから書き込み完了まで 1 つの書き込みトランザクションで行う。
+        # 読み取りで始めると、途中で他の接続がコミットしたときに書き込みへ昇格できず即 database is locked になる
+        cur.execute("BEGIN IMMEDIATE")
+        # 対象 ID を一時テーブルに集めて、以降は集合演算の UPDATE 数本で済ませる
+        cur.execute("DELETE FROM bulk_targets")
+        if 'filter' in data:
+            # /api/videos と同じ条件で、表示中の絞り込み結果すべてを対象にする
+            from_clause, where_clause, params, _ = build_video_filter(batch_args(data['filter']))
+            cur.execute(f"INSERT OR IGNORE INTO bulk_targets SELECT v.id {from_clause} {where_clause}", params)
+        else:
+            cur.execute("INSERT OR IGNORE INTO bulk_targets SELECT value FROM json_each(?) WHERE value IN (SELECT id FROM videos)", (json.dumps(ids),))
+        affected = cur.execute("SELECT COUNT(*) AS cnt FROM bulk_targets").fetchone()['cnt']
+
+        targets = "video_id IN (SELECT video_id FROM bulk_targets)"
+        if action in ('add_favorite', 'add_tags'):
+            cur.execute("INSERT OR IGNORE INTO video_meta(video_id) SELECT video_id FROM bulk_targets")
+        if action == 'add_favorite':
+            cur.execute(f"UPDATE video_meta SET favorite=1 WHERE {targets}")
+        elif action == 'remove_favorite':
+            cur.execute(f"UPDATE video_meta SET favorite=0 WHERE {targets}")
+        elif action == 'clear_tags':
+            cur.execute(f"UPDATE video_meta SET tags='' WHERE {targets}")
+        elif action == 'add_tags':
+            for tag in tags:
+                cur.execute(f"""
+                    UPDATE video_meta
+                    SET tags = CASE WHEN COALESCE(tags, '') = '' THEN ?1 ELSE tags || ',' || ?1 END
+                    WHERE {targets} AND instr(',' || COALESCE(tags, '') || ',', ',' || ?1 || ',') = 0
+                """, (tag,))
+        elif action == 'remove_tags':
+            for tag in tags:
+                cur.execute(f"""
+                    UPDATE video_meta
+                    SET tags = trim(replace(',' || tags || ',', ',' || ?1 || ',', ','), ',')
+                    WHERE {targets} AND instr(',' || tags || ',', ',' || ?1 || ',') > 0
+                """, (tag,))
+        conn.commit()
+        bump_generation(names=action in ('clear_tags', 'add_tags', 'remove_tags'))
+    except Exception:
+        # 書き込みロックを持ったまま接続が残らないよう、失敗したら明示的に戻す
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return jsonify({'ok': True, 'affected': affected})
 
 
 @app.route('/api/meta', methods=['POST', 'GET'])
@@ -453,43 +2629,478 @@ def meta():
             return jsonify({'play_count': r['play_count'], 'favorite': bool(r['favorite']), 'tags': (r['tags'] or '').split(',') if r['tags'] else []})
         return jsonify({'play_count': 0, 'favorite': False, 'tags': []})
 
-    data = request.json
-    vid = data.get('video_id')
-    action = data.get('action')
-    conn = get_db()
-    cur = conn.cursor()
-    if action == 'play':
-        now = int(time.time())
-        cur.execute("INSERT INTO video_meta(video_id, play_count, last_played) VALUES (?, 1, ?) ON CONFLICT(video_id) DO UPDATE SET play_count = play_count + 1, last_played = ?", (vid, now, now))
-        cur.execute("INSERT INTO watch_history (video_id, watched_at) VALUES (?, ?)", (vid, now))
-    elif action == 'toggle_favorite':
-        cur.execute("SELECT favorite FROM video_meta WHERE video_id=?", (vid,))
-        r = cur.fetchone()
-        if r:
-            new = 0 if r['favorite'] else 1
-            cur.execute("UPDATE video_meta SET favorite=? WHERE video_id=?", (new, vid))
-        else:
-            cur.execute("INSERT INTO video_meta(video_id, favorite) VALUES (?, 1)", (vid,))
-    elif action == 'set_tags':
-        tags = data.get('tags', '')
-        cur.execute("INSERT INTO video_meta(video_id, tags) VALUES (?, ?) ON CONFLICT(video_id) DO UPDATE SET tags=?", (vid, tags or '', tags or ''))
-    conn.commit()
-    conn.close()
-    return jsonify({'ok': True})
+    data = request.json
+    vid = data.get('video_id')
+    action = data.get('action')
+    conn = get_db()
+    cur = conn.cursor()
+    if action == 'play':
+        now = int(time.time())
+        cur.execute("INSERT INTO video_meta(video_id, play_count, last_played) VALUES (?, 1, ?) ON CONFLICT(video_id) DO UPDATE SET play_count = play_count + 1, last_played = ?", (vid, now, now))
+        cur.execute("INSERT INTO watch_history (video_id, watched_at) VALUES (?, ?)", (vid, now))
+    elif action == 'toggle_favorite':
+        cur.execute("SELECT favorite FROM video_meta WHERE video_id=?", (vid,))
+        r = cur.fetchone()
+        if r:
+            new = 0 if r['favorite'] else 1
+            cur.execute("UPDATE video_meta SET favorite=? WHERE video_id=?", (new, vid))
+        else:
+            cur.execute("INSERT INTO video_meta(video_id, favorite) VALUES (?, 1)", (vid,))
+    elif action == 'set_tags':
+        tags = data.get('tags', '')
+        cur.execute("INSERT INTO video_meta(video_id, tags) VALUES (?, ?) ON CONFLICT(video_id) DO UPDATE SET tags=?", (vid, tags or '', tags or ''))
+    conn.commit()
+    bump_generation(names=action == 'set_tags')
+    conn.close()
+    return jsonify({'ok': True})
+
+
+@app.route('/api/events', methods=['POST'])
+def ingest_events():
+    # sendBeacon からのまとめ送信。Content-Type に関係なく JSON として読む
+    data = request.get_json(force=True, silent=True) or {}
+    events = data.get('events')
+    if not isinstance(events, list) or len(events) > EVENTS_MAX_BATCH:
+        return jsonify({'error': f'events must be a list of at most {EVENTS_MAX_BATCH} items'}), 400
+
+    now = int(time.time())
+    plays = {}      # video_id -> [視聴時刻, ...]
+    positions = {}  # video_id -> 最後の再生位置
+    skips = {}      # video_id -> 回数
+    for ev in events:
+        if not isinstance(ev, dict):
+            continue
+        try:
+            vid = int(ev.get('video_id'))
+            ts = min(now, max(now - EVENTS_MAX_AGE, int(ev.get('ts') or now)))
+        except (TypeError, ValueError):
+            continue
+        kind = ev.get('type')
+        if kind == 'play':
+            plays.setdefault(vid, []).append(ts)
+        elif kind == 'position' and isinstance(ev.get('position'), (int, float)):
+            positions[vid] = max(0.0, float(ev['position']))
+        elif kind == 'skip':
+            skips[vid] = skips.get(vid, 0) + 1
+
+    ids = set(plays) | set(positions) | set(skips)
+    if not ids:
+        return jsonify({'ok': True, 'applied': 0})
+
+    conn = get_db()
+    cur = conn.cursor()
+    known = {r['id'] for r in cur.execute("SELECT id FROM videos WHERE id IN (SELECT value FROM json_each(?))", (json.dumps(sorted(ids)),))}
+    # 1 トランザクションで まとめて反映する
+    cur.executemany("""
+        INSERT INTO video_meta (video_id, play_count, last_played) VALUES (?, ?, ?)
+        ON CONFLICT(video_id) DO UPDATE SET play_count = COALESCE(play_count, 0) + excluded.play_count,
+            last_played = MAX(COALESCE(last_played, 0), excluded.last_played)
+    """, [(vid, len(ts), max(ts)) for vid, ts in plays.items() if vid in known])
+    cur.executemany("INSERT INTO watch_history (video_id, watched_at) VALUES (?, ?)",
+                    [(vid, t) for vid, ts in plays.items() if vid in known for t in ts])
+    cur.executemany("""
+        INSERT INTO video_meta (video_id, last_position) VALUES (?, ?)
+        ON CONFLICT(video_id) DO UPDATE SET last_position = excluded.last_position
+    """, [(vid, pos) for vid, pos in positions.items() if vid in known])
+    cur.executemany("""
+        INSERT INTO video_meta (video_id, skip_count) VALUES (?, ?)
+        ON CONFLICT(video_id) DO UPDATE SET skip_count = COALESCE(skip_count, 0) + excluded.skip_count
+    """, [(vid, n) for vid, n in skips.items() if vid in known])
+    conn.commit()
+    bump_generation()
+    conn.close()
+    return jsonify({'ok': True, 'applied': len(ids & known)})
+
+
+# --- 変更フィード ---
+
+def latest_change_version(conn):
+    # 刈り込みで change_log が空になっても番号は戻らないので sqlite_sequence を見る
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'").fetchone()
+    return row['seq'] if row else 0
+
+
+def changes_payload(conn, since, limit):
+    latest = latest_change_version(conn)
+    oldest = conn.execute("SELECT MIN(version) FROM change_log").fetchone()[0]
+    # 必要な範囲が刈り込み済み、DB が作り直されていた、またはスキャンなどの一括変更を挟んだら差分では追いつけない
+    bulk = conn.execute("SELECT 1 FROM change_log WHERE version > ? AND op = 'reset' LIMIT 1", (since,)).fetchone()
+    if since > latest or (since < latest and (oldest is None or since + 1 < oldest)) or bulk:
+        return {'since': since, 'version': latest, 'latest': latest, 'reset': True, 'more': False,
+                'changes': 0, 'upserted': [], 'deleted': []}
+
+    rows = conn.execute("SELECT version, entity, video_id, op FROM change_log WHERE version > ? ORDER BY version LIMIT ?",
+                        (since, limit + 1)).fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+
+    # 同じ動画への変更はまとめ、最後の状態 (存在するか削除されたか) だけ返す
+    deleted = {}
+    for r in rows:
+        if r['entity'] == 'video':
+            deleted[r['video_id']] = r['op'] == 'delete'
+        else:
+            deleted.setdefault(r['video_id'], False)
+    alive = [vid for vid, gone in deleted.items() if not gone]
+    upserted = [video_row_dict(r) for r in conn.execute(f"""
+        SELECT {VIDEO_ROW_COLUMNS}
+        FROM videos v
+        LEFT JOIN video_meta m ON v.id = m.video_id
+        LEFT JOIN media_info mi ON v.id = mi.video_id
+        LEFT JOIN previews p ON v.id = p.video_id
+        WHERE v.id IN (SELECT value FROM json_each(?))
+    """, (json.dumps(alive),))]
+    found = {v['id'] for v in upserted}
+    return {
+        'since': since,
+        'version': rows[-1]['version'] if rows else since,
+        'latest': latest,
+        'reset': False,
+        'more': more,
+        'changes': len(rows),
+        'upserted': upserted,
+        # この範囲より後で削除された動画も削除として扱う
+        'deleted': sorted(vid for vid in deleted if vid not in found),
+    }
+
+
+@app.route('/api/changes')
+def get_changes():
+    since = request.args.get('since', type=int)
+    limit = max(1, min(CHANGES_MAX_LIMIT, request.args.get('limit', CHANGES_DEFAULT_LIMIT, type=int)))
+    conn = get_db()
+    try:
+        if since is None:
+            # 起点の取得だけ。以降は返した version を since に渡す
+            latest = latest_change_version(conn)
+            return jsonify({'since': latest, 'version': latest, 'latest': latest, 'reset': False, 'more': False,
+                            'changes': 0, 'upserted': [], 'deleted': []})
+        return jsonify(changes_payload(conn, since, limit))
+    finally:
+        conn.close()
+
+
+@app.route('/api/changes/stream')
+def stream_changes():
+    # Server-Sent Events。再接続時はブラウザが最後の id を Last-Event-ID で送ってくる
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('since', type=int)
+
+    def generate(since):
+        conn = get_db()
+        try:
+            if since is None:
+                since = latest_change_version(conn)
+            yield f"retry: 3000\nid: {since}\nevent: hello\ndata: {json.dumps({'version': since})}\n\n"
+            started = last_sent = time.time()
+            while time.time() - started < CHANGES_STREAM_MAX_AGE:
+                if latest_change_version(conn) != since:
+                    payload = changes_payload(conn, since, CHANGES_MAX_LIMIT)
+                    since = payload['version']
+                    event = 'reset' if payload['reset'] else 'changes'
+                    yield f"id: {since}\nevent: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+                    last_sent = time.time()
+                    if payload['more']:
+                        continue
+                elif time.time() - last_sent >= CHANGES_HEARTBEAT:
+                    yield ": ping\n\n"
+                    last_sent = time.time()
+                time.sleep(CHANGES_POLL_INTERVAL)
+        finally:
+            conn.close()
+
+    resp = app.response_class(generate(since), mimetype='text/event-stream')
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Accel-Buffering'] = 'no'
+    return resp
+
+
+# --- HTML テンプレート ---
+HTML_TEMPLATE = r"""
+<!DOCTYPE html>
+<html lang="ja">
+<head>
+<meta charset="UTF-8">
+<meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=1.0, user-scalable=no">
+<meta name="apple-mobile-web-app-capable" content="yes">
+<meta name="apple-mobile-web-app-status-bar-style" content="black-translucent">
+<link rel="icon" href="data:,"> 
+<title>Video Manager Pro</title>
+<link rel="stylesheet" href="{{ css_url }}">
+</head>
+<body>
+
+<div class="mobile-header">
+    <div class="header-content">
+        <div class="header-title">📱 Video Manager</div>
+        <button class="menu-btn" onclick="toggleMobileMenu()">☰ フィルター</button>
+    </div>
+</div>
+
+<div class="nav-rail">
+    <div class="nav-item active" id="btn-lib" onclick="switchTab('library')">
+        <div class="nav-icon">📚</div>
+        <div class="nav-label">ライブラリ</div>
+    </div>
+    <div class="nav-item" id="btn-shorts" onclick="switchTab('shorts')">
+        <div class="nav-icon">🔥</div>
+        <div class="nav-label">発見</div>
+    </div>
+    <div class="nav-item" id="btn-playlists" onclick="switchTab('playlists')">
+        <div class="nav-icon">📋</div>
+        <div class="nav-label">リスト</div>
+    </div>
+    <div class="nav-item" id="btn-history" onclick="switchTab('history')">
+        <div class="nav-icon">🕐</div>
+        <div class="nav-label">履歴</div>
+    </div>
+    <div class="nav-item" id="btn-tools" onclick="switchTab('tools')">
+        <div class="nav-icon">🛠️</div>
+        <div class="nav-label">ツール</div>
+    </div>
+</div>
+
+<div id="content-area">
+    
+    <div id="library-view">
+        <div id="sidebar">
+            <div class="scan-bar">
+                <input type="text" id="scanPath" placeholder="スキャンするフォルダパス..." value="">
+                <button onclick="startScan()">🔍 Scan</button>
+            </div>
+            <div id="scanMsg" style="font-size:10px; color:#666; padding:8px 12px;"></div>
+            
+            <div class="sidebar-header">
+                <div class="search-wrap">
+                    <input type="text" class="search-box" id="searchBox" placeholder="🔍 動画を検索..." autocomplete="off" onkeyup="handleSearch()" oninput="handleSuggest()" onblur="hideSuggestions()" onkeydown="if (event.key === 'Escape') hideSuggestions()">
+                    <div class="suggest-box" id="suggestBox"></div>
+                </div>
+                
+                <div class="filter-section">
+                    <div class="filter-title">フィルタ</div>
+                    <div class="filter-btn" id="favFilter" onclick="toggleFavoriteFilter()">
+                        <span>⭐ お気に入り</span>
+                        <span id="favCount">0</span>
+                    </div>
+                    <div class="filter-btn" id="playableFilter" onclick="togglePlayableFilter()">
+                        <span>▶️ ブラウザで再生可能</span>
+                    </div>
+                </div>
+                
+                <div class="filter-section">
+                    <div class="filter-title">並び替え</div>
+                    <select class="sort-select" id="sortSelect" onchange="handleSort()">
+                        <option value="modified_desc">📅 更新日時(新)</option>
+                        <option value="modified_asc">📅 更新日時(古)</option>
+                        <option value="name_asc">🔤 名前(A-Z)</option>
+                        <option value="name_desc">🔤 名前(Z-A)</option>
+                        <option value="play_count_desc">▶️ 再生回数順</option>
+                        <option value="size_desc">📦 サイズ(大→小)</option>
+                        <option value="size_asc">📦 サイズ(小→大)</option>
+                        <option value="duration_desc">⏱️ 長さ(長→短)</option>
+                        <option value="duration_asc">⏱️ 長さ(短→長)</option>
+                        <option value="resolution_desc">🖥️ 解像度(高→低)</option>
+                        <option value="bitrate_desc">📶 ビットレート(高→低)</option>
+                    </select>
+                </div>
+                
+                <div class="stats-panel" id="statsPanel">
+                    <div class="stat-item">
+                        <span class="stat-label">総動画数</span>
+                        <span class="stat-value" id="statTotal">0</span>
+                    </div>
+                    <div class="stat-item">
+                        <span class="stat-label">お気に入り</span>
+                        <span class="stat-value" id="statFav">0</span>
+                    </div>
+                    <div class="stat-item">
+                        <span class="stat-label">総サイズ</span>
+                        <span class="stat-value" id="statSize">0</span>
+                    </div>
+                </div>
+                
+                <div class="filter-section" id="facetSection" style="display:none;">
+                    <div class="filter-title">絞り込み</div>
+                    <div id="extFacets"></div>
+                    <div id="sizeFacets"></div>
+                </div>
+                
+                <div class="filter-section" id="tagFilterSection" style="display:none;">
+                    <div class="filter-title">人気タグ</div>
+                    <div id="popularTags"></div>
+                </div>
+            </div>
+            
+            <div class="filter-section" style="padding:8px 12px;">
+                <div class="filter-title">フォルダ</div>
+            </div>
+            
+            <div id="folderList"></div>
+        </div>
+        
+        <div id="main-lib">
+            <div class="lib-header">
+                <h3 class="lib-title" id="libTitle">すべての動画</h3>
+                <div class="lib-stats" id="libStats">読み込み中...</div>
+            </div>
+            <div class="pull-to-refresh" id="pullToRefresh">
+                <div class="loading"></div>
+                <span style="margin-left:8px;">更新中...</span>
+            </div>
+            <div id="videoGrid"></div>
+            <div class="pagination" id="pagination"></div>
+        </div>
+    </div>
+
+    <div id="shorts-view"></div>
+    
+    <div id="playlists-view" style="display:none; padding:16px; overflow-y:auto;">
+        <div class="lib-header" style="position:sticky; top:0; z-index:100;">
+            <h3 class="lib-title">📋 プレイリスト</h3>
+            <button class="ui-btn" onclick="createPlaylist()">➕ 新規作成</button>
+        </div>
+        <div id="playlistsContainer"></div>
+    </div>
+    
+    <div id="history-view" style="display:none; padding:16px; overflow-y:auto;">
+        <div class="lib-header" style="position:sticky; top:0; z-index:100;">
+            <h3 class="lib-title">🕐 視聴履歴</h3>
+        </div>
+        <div id="historyContainer"></div>
+    </div>
+    
+    <div id="tools-view" style="display:none; padding:16px; overflow-y:auto; background:#0a0a0a;">
+        <div class="lib-header" style="position:sticky; top:0; z-index:100;">
+            <h3 class="lib-title">🛠️ 管理ツール</h3>
+        </div>
+        <div style="max-width:800px; margin:0 auto;">
+            <div class="tool-card">
+                <h4>💾 データエクスポート</h4>
+                <p>お気に入りやタグなどのメタデータを JSON / NDJSON / CSV で保存</p>
+                <div style="display:flex; gap:8px; margin-top:12px; flex-wrap:wrap; align-items:center;">
+                    <select id="exportFormat" class="ui-btn">
+                        <option value="json">JSON</option>
+                        <option value="ndjson">NDJSON</option>
+                        <option value="csv">CSV</option>
+                    </select>
+                    <label style="color:#aaa; font-size:13px;"><input type="checkbox" id="exportGzip"> gzip 圧縮</label>
+                    <label style="color:#aaa; font-size:13px;"><input type="checkbox" id="exportFiltered"> 現在の絞り込み結果のみ</label>
+                    <button class="ui-btn" onclick="exportData()">エクスポート</button>
+                </div>
+            </div>
+            
+            <div class="tool-card">
+                <h4>📥 データインポート</h4>
+                <p>エクスポートしたファイル (JSON / NDJSON / CSV、gzip 可) からお気に入り・タグ・再生回数を復元</p>
+                <div style="display:flex; gap:8px; margin-top:12px; flex-wrap:wrap; align-items:center;">
+                    <input type="file" id="importFile" accept=".json,.ndjson,.csv,.gz" style="color:#aaa;">
+                    <button class="ui-btn" onclick="importData()">インポート</button>
+                </div>
+                <div id="importMsg" style="margin-top:8px; color:#666; font-size:12px;"></div>
+            </div>
+            
+            <div class="tool-card">
+                <h4>🖼️ シークプレビュー生成</h4>
+                <p>動画ごとにサムネイルのスプライトシートを作成し、シーク中にプレビューを表示 (ffmpeg が必要)</p>
+                <button class="ui-btn" onclick="startPreviews()">生成開始</button>
+                <div id="previewMsg" style="margin-top:8px; color:#666; font-size:12px;"></div>
+            </div>
+            
+            <div class="tool-card">
+                <h4>🏷️ 一括タグ編集</h4>
+                <p>選択した動画、または現在の絞り込み結果すべてにまとめてタグを追加・削除</p>
+                <div style="display:flex; gap:8px; margin-top:12px; flex-wrap:wrap;">
+                    <input type="text" id="bulkTagInput" placeholder="タグ (カンマ区切り)" style="flex:1; min-width:200px; padding:10px; background:#1a1a1a; border:1px solid #333; color:#fff; border-radius:8px;">
+                    <button class="ui-btn" onclick="bulkTags('add_tags', false)">選択中の動画に追加</button>
+                    <button class="ui-btn" onclick="bulkTags('remove_tags', false)">選択中の動画から削除</button>
+                    <button class="ui-btn" onclick="bulkTags('add_tags', true)">絞り込み結果すべてに追加</button>
+                </div>
+                <div style="margin-top:8px; color:#666; font-size:12px;">※ライブラリでCtrl+クリックで複数選択</div>
+            </div>
+            
+            <div class="tool-card">
+                <h4>⭐ 一括お気に入り追加</h4>
+                <p>選択した動画をまとめてお気に入りに追加</p>
+                <button class="ui-btn" onclick="bulkAddFavorites()">選択中の動画をお気に入りに</button>
+            </div>
+        </div>
+    </div>
+
+</div>
+
+<div id="playerModal">
+    <video id="playerVideo" autoplay playsinline></video>
+    
+    <div class="player-ui">
+        <div class="player-header">
+            <div class="player-title" id="playerTitle">Title</div>
+            <div class="player-controls">
+                <button class="ui-btn" id="qualityBtn" onclick="cycleQuality()" title="画質">AUTO</button>
+                <button class="ui-btn" id="playerFolderBtn" onclick="jumpToFolderFromPlayer()">📂</button>
+                <button class="ui-btn" id="playerTagBtn" onclick="openPlayerTagModal()">🏷️</button>
+                <button class="ui-btn" id="playerFavBtn" onclick="togglePlayerFavorite()">☆</button>
+                <button class="ui-btn" onclick="closePlayer()">✕</button>
+            </div>
+        </div>
+        <div class="player-playback-controls">
+                <div class="time-display"><span id="currentTime">0:00</span> / <span id="durationTime">0:00</span></div>
+                <div id="seekPreview"><div class="seek-preview-time" id="seekPreviewTime"></div></div>
+                <input type="range" id="playerSeek" value="0" min="0" max="100" step="0.1" oninput="seekVideo(this.value)">
+                <div class="playback-buttons">
+                    <button class="ui-btn" onclick="pVideo.currentTime = Math.max(0, pVideo.currentTime - 10)">⏪ 10s</button>
+                    <button class="ui-btn" id="playPauseBtn" onclick="togglePlayPause()">⏯ 再生</button>
+                    <button class="ui-btn" onclick="pVideo.currentTime = Math.min(pVideo.duration, pVideo.currentTime + 10)">10s ⏩</button>
+                    <button class="ui-btn" onclick="pVideo.muted = !pVideo.muted" id="muteBtn">🔊</button>
+                    <button class="ui-btn" onclick="toggleFullscreen()">⛶ 全画面</button>
+                </div>
+            </div>
+            <div class="player-footer">
+            <button class="ui-btn" onclick="playPrev()">⮜ 前へ</button>
+            <button class="ui-btn" onclick="togglePlayPause()">⏯ 再生</button>
+            <button class="ui-btn" onclick="toggleFullscreen()">⛶ 全画面</button>
+            <button class="ui-btn" onclick="playNext()">次へ ⮞</button>
+        </div>
+    </div>
+    
+    <div id="shortcutHelp" style="display:none;">
+        <h3 style="margin:0 0 20px 0; text-align:center;">⌨️ キーボードショートカット</h3>
+        <div style="display:grid; grid-template-columns:120px 1fr; gap:12px; font-size:14px;">
+            <div style="color:#00aaff; font-weight:600;">Space / K</div><div>再生/一時停止</div>
+            <div style="color:#00aaff; font-weight:600;">← / →</div><div>前/次の動画</div>
+            <div style="color:#00aaff; font-weight:600;">J / L</div><div>10秒戻る/進む</div>
+            <div style="color:#00aaff; font-weight:600;">↑ / ↓</div><div>音量アップ/ダウン</div>
+            <div style="color:#00aaff; font-weight:600;">F</div><div>全画面切り替え</div>
+            <div style="color:#00aaff; font-weight:600;">M</div><div>ミュート切り替え</div>
+            <div style="color:#00aaff; font-weight:600;">S</div><div>お気に入り登録</div>
+            <div style="color:#00aaff; font-weight:600;">Esc</div><div>プレイヤーを閉じる</div>
+        </div>
+        <div style="text-align:center; margin-top:20px;">
+            <button class="ui-btn" onclick="toggleShortcutHelp()">閉じる</button>
+        </div>
+    </div>
+</div>
+
+<div id="tagModal" class="tag-modal">
+    <div class="tag-modal-title">🏷️ タグ編集</div>
+    <div class="tag-input-row">
+        <input id="tagInput" placeholder="タグを入力してEnter" onkeypress="if(event.key==='Enter')addTagToCurrent()">
+        <button class="ui-btn" onclick="addTagToCurrent()">追加</button>
+    </div>
+    <div class="tag-list" id="tagList"></div>
+    <div class="modal-actions">
+        <button class="ui-btn" onclick="closeTagModal()" style="background:#333;">キャンセル</button>
+        <button class="ui-btn" onclick="saveTags()">💾 保存</button>
+    </div>
+</div>
 
+<script src="{{ js_url }}"></script>
+</body>
+</html>
+"""
 
-# --- HTML テンプレート ---
-HTML_TEMPLATE = r"""
-<!DOCTYPE html>
-<html lang="ja">
-<head>
-<meta charset="UTF-8">
-<meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=1.0, user-scalable=no">
-<meta name="apple-mobile-web-app-capable" content="yes">
-<meta name="apple-mobile-web-app-status-bar-style" content="black-translucent">
-<link rel="icon" href="data:,"> 
-<title>Video Manager Pro</title>
-<style>
+# --- スタイルシート ---
+APP_CSS = r"""
 * { box-sizing: border-box; -webkit-tap-highlight-color: transparent; margin: 0; padding: 0; }
 body { 
     margin: 0; 
@@ -621,6 +3232,29 @@ body {
     margin-bottom:10px;
 }
 .search-box:focus { outline:none; border-color:#00aaff; }
+.search-wrap { position:relative; }
+.suggest-box { 
+    display:none; 
+    position:absolute; 
+    top:42px; 
+    left:0; 
+    right:0; 
+    z-index:200; 
+    background:#1a1a1a; 
+    border:1px solid #333; 
+    border-radius:8px; 
+    overflow:hidden;
+    box-shadow:0 8px 24px rgba(0,0,0,0.5);
+}
+.suggest-item { 
+    padding:8px 12px; 
+    font-size:13px; 
+    cursor:pointer; 
+    white-space:nowrap; 
+    overflow:hidden; 
+    text-overflow:ellipsis;
+}
+.suggest-item:hover { background:#00aaff; color:#fff; }
 
 .filter-section { margin-top:12px; }
 .filter-title { 
@@ -974,6 +3608,28 @@ body {
     background: #00aaff;
     cursor: pointer;
 }
+#seekPreview {
+    display: none;
+    position: absolute;
+    bottom: 100%;
+    margin-bottom: 8px;
+    width: 160px;
+    height: 90px;
+    border: 2px solid #00aaff;
+    border-radius: 6px;
+    background-color: #000;
+    background-repeat: no-repeat;
+    transform: translateX(-50%);
+    pointer-events: none;
+}
+#seekPreview .seek-preview-time {
+    position: absolute;
+    bottom: 2px;
+    width: 100%;
+    text-align: center;
+    font-size: 11px;
+    text-shadow: 0 0 3px #000;
+}
 .playback-buttons {
     display: flex;
     gap: 8px;
@@ -1529,244 +4185,41 @@ button, .card, .folder-item, .filter-btn, .nav-item, .action-btn, .meta-btn {
     user-select:none;
 }
 
-/* セーフエリア対応 */
-@supports (padding: max(0px)) {
-    .mobile-header, .nav-rail {
-        padding-left: max(12px, env(safe-area-inset-left));
-        padding-right: max(12px, env(safe-area-inset-right));
-    }
-    .nav-rail {
-        padding-bottom: max(8px, env(safe-area-inset-bottom));
-    }
-}
-
-</style>
-</head>
-<body>
-
-<div class="mobile-header">
-    <div class="header-content">
-        <div class="header-title">📱 Video Manager</div>
-        <button class="menu-btn" onclick="toggleMobileMenu()">☰ フィルター</button>
-    </div>
-</div>
-
-<div class="nav-rail">
-    <div class="nav-item active" id="btn-lib" onclick="switchTab('library')">
-        <div class="nav-icon">📚</div>
-        <div class="nav-label">ライブラリ</div>
-    </div>
-    <div class="nav-item" id="btn-shorts" onclick="switchTab('shorts')">
-        <div class="nav-icon">🔥</div>
-        <div class="nav-label">発見</div>
-    </div>
-    <div class="nav-item" id="btn-playlists" onclick="switchTab('playlists')">
-        <div class="nav-icon">📋</div>
-        <div class="nav-label">リスト</div>
-    </div>
-    <div class="nav-item" id="btn-history" onclick="switchTab('history')">
-        <div class="nav-icon">🕐</div>
-        <div class="nav-label">履歴</div>
-    </div>
-    <div class="nav-item" id="btn-tools" onclick="switchTab('tools')">
-        <div class="nav-icon">🛠️</div>
-        <div class="nav-label">ツール</div>
-    </div>
-</div>
-
-<div id="content-area">
-    
-    <div id="library-view">
-        <div id="sidebar">
-            <div class="scan-bar">
-                <input type="text" id="scanPath" placeholder="スキャンするフォルダパス..." value="">
-                <button onclick="startScan()">🔍 Scan</button>
-            </div>
-            <div id="scanMsg" style="font-size:10px; color:#666; padding:8px 12px;"></div>
-            
-            <div class="sidebar-header">
-                <input type="text" class="search-box" id="searchBox" placeholder="🔍 動画を検索..." onkeyup="handleSearch()">
-                
-                <div class="filter-section">
-                    <div class="filter-title">フィルタ</div>
-                    <div class="filter-btn" id="favFilter" onclick="toggleFavoriteFilter()">
-                        <span>⭐ お気に入り</span>
-                        <span id="favCount">0</span>
-                    </div>
-                </div>
-                
-                <div class="filter-section">
-                    <div class="filter-title">並び替え</div>
-                    <select class="sort-select" id="sortSelect" onchange="handleSort()">
-                        <option value="modified_desc">📅 更新日時(新)</option>
-                        <option value="modified_asc">📅 更新日時(古)</option>
-                        <option value="name_asc">🔤 名前(A-Z)</option>
-                        <option value="name_desc">🔤 名前(Z-A)</option>
-                        <option value="play_count_desc">▶️ 再生回数順</option>
-                        <option value="size_desc">📦 サイズ(大→小)</option>
-                        <option value="size_asc">📦 サイズ(小→大)</option>
-                    </select>
-                </div>
-                
-                <div class="stats-panel" id="statsPanel">
-                    <div class="stat-item">
-                        <span class="stat-label">総動画数</span>
-                        <span class="stat-value" id="statTotal">0</span>
-                    </div>
-                    <div class="stat-item">
-                        <span class="stat-label">お気に入り</span>
-                        <span class="stat-value" id="statFav">0</span>
-                    </div>
-                    <div class="stat-item">
-                        <span class="stat-label">総サイズ</span>
-                        <span class="stat-value" id="statSize">0</span>
-                    </div>
-                </div>
-                
-                <div class="filter-section" id="tagFilterSection" style="display:none;">
-                    <div class="filter-title">人気タグ</div>
-                    <div id="popularTags"></div>
-                </div>
-            </div>
-            
-            <div class="filter-section" style="padding:8px 12px;">
-                <div class="filter-title">フォルダ</div>
-            </div>
-            
-            <div id="folderList"></div>
-        </div>
-        
-        <div id="main-lib">
-            <div class="lib-header">
-                <h3 class="lib-title" id="libTitle">すべての動画</h3>
-                <div class="lib-stats" id="libStats">読み込み中...</div>
-            </div>
-            <div class="pull-to-refresh" id="pullToRefresh">
-                <div class="loading"></div>
-                <span style="margin-left:8px;">更新中...</span>
-            </div>
-            <div id="videoGrid"></div>
-            <div class="pagination" id="pagination"></div>
-        </div>
-    </div>
-
-    <div id="shorts-view"></div>
-    
-    <div id="playlists-view" style="display:none; padding:16px; overflow-y:auto;">
-        <div class="lib-header" style="position:sticky; top:0; z-index:100;">
-            <h3 class="lib-title">📋 プレイリスト</h3>
-            <button class="ui-btn" onclick="createPlaylist()">➕ 新規作成</button>
-        </div>
-        <div id="playlistsContainer"></div>
-    </div>
-    
-    <div id="history-view" style="display:none; padding:16px; overflow-y:auto;">
-        <div class="lib-header" style="position:sticky; top:0; z-index:100;">
-            <h3 class="lib-title">🕐 視聴履歴</h3>
-        </div>
-        <div id="historyContainer"></div>
-    </div>
-    
-    <div id="tools-view" style="display:none; padding:16px; overflow-y:auto; background:#0a0a0a;">
-        <div class="lib-header" style="position:sticky; top:0; z-index:100;">
-            <h3 class="lib-title">🛠️ 管理ツール</h3>
-        </div>
-        <div style="max-width:800px; margin:0 auto;">
-            <div class="tool-card">
-                <h4>💾 データエクスポート</h4>
-                <p>お気に入りやタグなどのメタデータをJSONで保存</p>
-                <button class="ui-btn" onclick="exportData()">エクスポート</button>
-            </div>
-            
-            <div class="tool-card">
-                <h4>🏷️ 一括タグ編集</h4>
-                <p>選択した動画にまとめてタグを追加</p>
-                <div style="display:flex; gap:8px; margin-top:12px; flex-wrap:wrap;">
-                    <input type="text" id="bulkTagInput" placeholder="追加するタグ" style="flex:1; min-width:200px; padding:10px; background:#1a1a1a; border:1px solid #333; color:#fff; border-radius:8px;">
-                    <button class="ui-btn" onclick="bulkAddTags()">選択中の動画に追加</button>
-                </div>
-                <div style="margin-top:8px; color:#666; font-size:12px;">※ライブラリでCtrl+クリックで複数選択</div>
-            </div>
-            
-            <div class="tool-card">
-                <h4>⭐ 一括お気に入り追加</h4>
-                <p>選択した動画をまとめてお気に入りに追加</p>
-                <button class="ui-btn" onclick="bulkAddFavorites()">選択中の動画をお気に入りに</button>
-            </div>
-        </div>
-    </div>
-
-</div>
-
-<div id="playerModal">
-    <video id="playerVideo" autoplay playsinline></video>
-    
-    <div class="player-ui">
-        <div class="player-header">
-            <div class="player-title" id="playerTitle">Title</div>
-            <div class="player-controls">
-                <button class="ui-btn" id="playerFolderBtn" onclick="jumpToFolderFromPlayer()">📂</button>
-                <button class="ui-btn" id="playerTagBtn" onclick="openPlayerTagModal()">🏷️</button>
-                <button class="ui-btn" id="playerFavBtn" onclick="togglePlayerFavorite()">☆</button>
-                <button class="ui-btn" onclick="closePlayer()">✕</button>
-            </div>
-        </div>
-        <div class="player-playback-controls">
-                <div class="time-display"><span id="currentTime">0:00</span> / <span id="durationTime">0:00</span></div>
-                <input type="range" id="playerSeek" value="0" min="0" max="100" step="0.1" oninput="seekVideo(this.value)">
-                <div class="playback-buttons">
-                    <button class="ui-btn" onclick="pVideo.currentTime = Math.max(0, pVideo.currentTime - 10)">⏪ 10s</button>
-                    <button class="ui-btn" id="playPauseBtn" onclick="togglePlayPause()">⏯ 再生</button>
-                    <button class="ui-btn" onclick="pVideo.currentTime = Math.min(pVideo.duration, pVideo.currentTime + 10)">10s ⏩</button>
-                    <button class="ui-btn" onclick="pVideo.muted = !pVideo.muted" id="muteBtn">🔊</button>
-                    <button class="ui-btn" onclick="toggleFullscreen()">⛶ 全画面</button>
-                </div>
-            </div>
-            <div class="player-footer">
-            <button class="ui-btn" onclick="playPrev()">⮜ 前へ</button>
-            <button class="ui-btn" onclick="togglePlayPause()">⏯ 再生</button>
-            <button class="ui-btn" onclick="toggleFullscreen()">⛶ 全画面</button>
-            <button class="ui-btn" onclick="playNext()">次へ ⮞</button>
-        </div>
-    </div>
-    
-    <div id="shortcutHelp" style="display:none;">
-        <h3 style="margin:0 0 20px 0; text-align:center;">⌨️ キーボードショートカット</h3>
-        <div style="display:grid; grid-template-columns:120px 1fr; gap:12px; font-size:14px;">
-            <div style="color:#00aaff; font-weight:600;">Space / K</div><div>再生/一時停止</div>
-            <div style="color:#00aaff; font-weight:600;">← / →</div><div>前/次の動画</div>
-            <div style="color:#00aaff; font-weight:600;">J / L</div><div>10秒戻る/進む</div>
-            <div style="color:#00aaff; font-weight:600;">↑ / ↓</div><div>音量アップ/ダウン</div>
-            <div style="color:#00aaff; font-weight:600;">F</div><div>全画面切り替え</div>
-            <div style="color:#00aaff; font-weight:600;">M</div><div>ミュート切り替え</div>
-            <div style="color:#00aaff; font-weight:600;">S</div><div>お気に入り登録</div>
-            <div style="color:#00aaff; font-weight:600;">Esc</div><div>プレイヤーを閉じる</div>
-        </div>
-        <div style="text-align:center; margin-top:20px;">
-            <button class="ui-btn" onclick="toggleShortcutHelp()">閉じる</button>
-        </div>
-    </div>
-</div>
+/* セーフエリア対応 */
+@supports (padding: max(0px)) {
+    .mobile-header, .nav-rail {
+        padding-left: max(12px, env(safe-area-inset-left));
+        padding-right: max(12px, env(safe-area-inset-right));
+    }
+    .nav-rail {
+        padding-bottom: max(8px, env(safe-area-inset-bottom));
+    }
+}
 
-<div id="tagModal" class="tag-modal">
-    <div class="tag-modal-title">🏷️ タグ編集</div>
-    <div class="tag-input-row">
-        <input id="tagInput" placeholder="タグを入力してEnter" onkeypress="if(event.key==='Enter')addTagToCurrent()">
-        <button class="ui-btn" onclick="addTagToCurrent()">追加</button>
-    </div>
-    <div class="tag-list" id="tagList"></div>
-    <div class="modal-actions">
-        <button class="ui-btn" onclick="closeTagModal()" style="background:#333;">キャンセル</button>
-        <button class="ui-btn" onclick="saveTags()">💾 保存</button>
-    </div>
-</div>
+"""
 
-<script>
+# --- クライアントスクリプト ---
+APP_JS = r"""
 let currentLib = [];
+// etag は表示中の一覧を読んだときの世代 (/api/videos の ETag)。続きのページは同じ世代のものだけつなげる
+let libraryState = { seq: 0, loading: false, etag: null };
+let folderListData = [];
+const PREFETCH_TOP_FOLDERS = 3;
 let currentIndex = 0;
 let shortsData = [];
 let scanTimer = null;
 let shortObserver = null;
+let shortsSession = null;
+let shortsLoadingMore = false;
+const SHORTS_RING_SIZE = 3;  // 1 つ前・表示中・次 (先読み)
+let shortsRing = [];
+let shortsItems = [];
+let shortsActive = -1;
+let shortsPlayed = new Set();
+let shortsMuted = true;
+const SHORTS_PAGE_SIZE = 15;
+const SHORTS_KEEP_BEHIND = 30;  // 表示中より前に残す項目数 (戻るスワイプで遡れるのはここまで)
+let shortsTrimmed = 0;  // これより前の index は DOM もデータも破棄済み
 let tagModalState = { video_id: null, tags: [] };
 let searchTimeout = null;
 let selectedVideos = new Set();
@@ -1781,8 +4234,12 @@ let currentViewState = {
     page: 1,
     perPage: 50,
     total: 0,
-    tagFilter: ''
+    tagFilter: '',
+    playableOnly: false,
+    exts: [],
+    sizeBucket: ''
 };
+let lastFacetKey = null;
 
 // プルトゥリフレッシュ
 let pullStartY = 0;
@@ -1822,11 +4279,122 @@ videoGrid.addEventListener('touchend', () => {
 
 window.onload = () => {
     history.replaceState({tab: 'library'}, '', '#library');
-    loadStats();
-    loadFolders();
-    loadLibrary();
+    startChangeFeed();
+    loadInitial();
+    registerServiceWorker();
 };
 
+// 起動時の stats / folders / videos を 1 往復で取得する
+async function loadInitial() {
+    const firstUrl = `/api/videos?${libraryParams(0).toString()}`;
+    const body = JSON.stringify({ requests: [
+        'stats',
+        'folders',
+        { id: 'videos', endpoint: 'videos', params: Object.fromEntries(libraryParams()) },
+        { id: 'facets', endpoint: 'facets', params: facetFilter() }
+    ] });
+    const request = (extraHeaders = {}) => fetch('/api/batch', {
+        method: 'POST',
+        headers: Object.assign({'Content-Type': 'application/json'}, extraHeaders),
+        body
+    });
+    const renderBatch = (data) => {
+        renderStats(data.results.stats);
+        renderFolders(data.results.folders);
+        renderLibrary(data.results.videos, true);
+        lastFacetKey = new URLSearchParams(facetFilter()).toString();
+        renderFacets(data.results.facets);
+    };
+
+    // 前回の結果があれば先に表示しておき、サーバーの応答で差し替える。
+    // Service Worker が動いていれば前回のバッチ応答全体、なければ IndexedDB の先頭ページを使う
+    const network = request();
+    let painted = false;
+    if (navigator.serviceWorker && navigator.serviceWorker.controller) {
+        try {
+            const cachedRes = await request({'X-SW-Cache-Only': '1'});
+            if (cachedRes.ok) {
+                renderBatch(await cachedRes.json());
+                painted = true;
+            }
+        } catch (e) {}
+    }
+    if (!painted) {
+        const cached = await cachedPage(firstUrl);
+        if (cached) renderLibrary(cached.data);
+    }
+
+    try {
+        const res = await network;
+        if (!res.ok) throw new Error(`batch ${res.status}`);
+        const data = await res.json();
+        renderBatch(data);
+        rememberPage(firstUrl, `W/"${data.etag}"`, data.results.videos);
+        prefetchLikelyPages();
+    } catch (e) {
+        console.error('Batch load error:', e);
+        if (painted) return;
+        loadStats();
+        loadFolders();
+        loadLibrary();
+    }
+}
+
+function registerServiceWorker() {
+    if (!('serviceWorker' in navigator)) return;
+    navigator.serviceWorker.register('/sw.js').catch(e => console.error('Service worker registration failed:', e));
+}
+
+// --- 変更フィード ---
+// サーバーの change_log を SSE で受け取り、表示中のカードだけ差分で更新する。
+// 一覧の並びが変わる変更 (追加/削除) は件数表示に知らせ、読み直しは利用者に任せる
+let changeFeed = null;
+let changeStatsTimer = null;
+
+function startChangeFeed() {
+    if (!window.EventSource || changeFeed) return;
+    changeFeed = new EventSource('/api/changes/stream');
+    changeFeed.addEventListener('changes', e => applyChanges(JSON.parse(e.data)));
+    changeFeed.addEventListener('reset', () => {
+        markLibraryStale();
+        scheduleStatsRefresh();
+    });
+}
+
+function applyChanges(data) {
+    const indexById = new Map(currentLib.map((v, i) => [v.id, i]));
+    let added = false;
+    data.upserted.forEach(v => {
+        const i = indexById.get(v.id);
+        if (i === undefined) { added = true; return; }
+        Object.assign(currentLib[i], v);
+        patchCard(v.id);
+    });
+
+    const removed = new Set(data.deleted.filter(id => indexById.has(id)));
+    if (removed.size) {
+        currentLib = currentLib.filter(v => !removed.has(v.id));
+        currentViewState.total = Math.max(0, currentViewState.total - removed.size);
+        document.getElementById('libStats').innerText = `${currentViewState.total}件の動画`;
+        cardPool.forEach(node => { node._video = null; });
+        renderVisibleCards();
+        updateLibraryFooter();
+    }
+    if (added) markLibraryStale();
+    if (data.changes) scheduleStatsRefresh();
+}
+
+function markLibraryStale() {
+    const el = document.getElementById('libStats');
+    el.innerHTML = `${currentViewState.total}件の動画 · <span class="tag-filter-btn" onclick="loadLibrary()">更新があります</span>`;
+}
+
+function scheduleStatsRefresh() {
+    // スキャン中は連続して届くのでまとめて取り直す
+    clearTimeout(changeStatsTimer);
+    changeStatsTimer = setTimeout(loadStats, 2000);
+}
+
 function toggleMobileMenu() {
     const sidebar = document.getElementById('sidebar');
     sidebar.classList.toggle('open');
@@ -1851,25 +4419,28 @@ window.addEventListener('popstate', (event) => {
 async function loadStats() {
     try {
         const res = await fetch('/api/stats');
-        const data = await res.json();
-        document.getElementById('statTotal').innerText = data.total;
-        document.getElementById('statFav').innerText = data.favorites;
-        document.getElementById('statSize').innerText = data.total_size;
-        document.getElementById('favCount').innerText = data.favorites;
-        
-        if (data.tags && data.tags.length > 0) {
-            const tagSection = document.getElementById('tagFilterSection');
-            const tagContainer = document.getElementById('popularTags');
-            tagSection.style.display = 'block';
-            tagContainer.innerHTML = data.tags.slice(0, 10).map(t => 
-                `<span class="tag-filter-btn" onclick="filterByTag('${t.name}')">${t.name} (${t.count})</span>`
-            ).join('');
-        }
+        renderStats(await res.json());
     } catch (e) {
         console.error('Stats load error:', e);
     }
 }
 
+function renderStats(data) {
+    document.getElementById('statTotal').innerText = data.total;
+    document.getElementById('statFav').innerText = data.favorites;
+    document.getElementById('statSize').innerText = data.total_size;
+    document.getElementById('favCount').innerText = data.favorites;
+    
+    if (data.tags && data.tags.length > 0) {
+        const tagSection = document.getElementById('tagFilterSection');
+        const tagContainer = document.getElementById('popularTags');
+        tagSection.style.display = 'block';
+        tagContainer.innerHTML = data.tags.slice(0, 10).map(t => 
+            `<span class="tag-filter-btn" onclick="filterByTag('${t.name}')">${t.name} (${t.count})</span>`
+        ).join('');
+    }
+}
+
 function filterByTag(tag) {
     currentViewState.tagFilter = currentViewState.tagFilter === tag ? '' : tag;
     currentViewState.page = 1;
@@ -1892,6 +4463,7 @@ function switchTab(mode, pushHistory = true) {
         document.getElementById('btn-lib').classList.add('active');
         document.getElementById('library-view').style.display = 'flex';
         stopShorts();
+        scheduleGridRender();
     } else if (mode === 'shorts') {
         document.getElementById('btn-shorts').classList.add('active');
         document.getElementById('shorts-view').style.display = 'block';
@@ -1922,77 +4494,393 @@ function toggleFavoriteFilter() {
     loadLibrary();
 }
 
-function handleSearch() {
-    clearTimeout(searchTimeout);
-    searchTimeout = setTimeout(() => {
-        currentViewState.search = document.getElementById('searchBox').value;
-        currentViewState.page = 1;
-        loadLibrary();
-    }, 500);
+function togglePlayableFilter() {
+    currentViewState.playableOnly = !currentViewState.playableOnly;
+    currentViewState.page = 1;
+    document.getElementById('playableFilter').classList.toggle('active');
+    loadLibrary();
+}
+
+function handleSearch() {
+    clearTimeout(searchTimeout);
+    searchTimeout = setTimeout(() => {
+        currentViewState.search = document.getElementById('searchBox').value;
+        currentViewState.page = 1;
+        loadLibrary();
+    }, 500);
+}
+
+// 入力中は /api/suggest の候補だけを引く (古いリクエストは中断する)
+const SUGGEST_DEBOUNCE_MS = 150;
+const SUGGEST_ICONS = { video: '🎬', folder: '📁', tag: '#' };
+let suggestTimer = null;
+let suggestController = null;
+let currentSuggestions = [];
+
+function handleSuggest() {
+    clearTimeout(suggestTimer);
+    const q = document.getElementById('searchBox').value.trim();
+    if (!q) {
+        if (suggestController) suggestController.abort();
+        hideSuggestions();
+        return;
+    }
+    suggestTimer = setTimeout(() => fetchSuggestions(q), SUGGEST_DEBOUNCE_MS);
+}
+
+async function fetchSuggestions(q) {
+    if (suggestController) suggestController.abort();
+    const controller = suggestController = new AbortController();
+    try {
+        const res = await fetch(`/api/suggest?q=${encodeURIComponent(q)}&limit=8`, { signal: controller.signal });
+        const data = await res.json();
+        if (controller === suggestController) renderSuggestions(data.suggestions);
+    } catch (e) {
+        if (e.name !== 'AbortError') console.error('Suggest error:', e);
+    }
+}
+
+function renderSuggestions(items) {
+    currentSuggestions = items;
+    const box = document.getElementById('suggestBox');
+    box.innerHTML = items.map((s, i) =>
+        `<div class="suggest-item" onmousedown="event.preventDefault(); applySuggestion(${i})">${SUGGEST_ICONS[s.kind] || ''} ${s.label}</div>`
+    ).join('');
+    box.style.display = items.length ? 'block' : 'none';
+}
+
+function hideSuggestions() {
+    clearTimeout(suggestTimer);
+    document.getElementById('suggestBox').style.display = 'none';
+}
+
+function applySuggestion(i) {
+    const s = currentSuggestions[i];
+    if (!s) return;
+    hideSuggestions();
+    clearTimeout(searchTimeout);
+    const box = document.getElementById('searchBox');
+    if (s.kind === 'folder') {
+        box.value = '';
+        currentViewState.search = '';
+        jumpToFolder(s.value, s.label);
+    } else if (s.kind === 'tag') {
+        box.value = '';
+        currentViewState.search = '';
+        filterByTag(s.value);
+    } else {
+        box.value = s.label;
+        currentViewState.search = s.label;
+        loadLibrary();
+    }
+}
+
+function handleSort() {
+    currentViewState.sort = document.getElementById('sortSelect').value;
+    currentViewState.page = 1;
+    loadLibrary();
+}
+
+async function loadFolders() {
+    const res = await fetch('/api/folders');
+    renderFolders(await res.json());
+}
+
+function renderFolders(data) {
+    folderListData = data.folders;
+    const list = document.getElementById('folderList');
+    list.innerHTML = '';
+    
+    const allBtn = document.createElement('div');
+    allBtn.className = 'folder-item';
+    allBtn.innerHTML = '<span>📂 すべての動画</span><span class="folder-count">ALL</span>';
+    allBtn.onclick = () => {
+        currentViewState.folder = null;
+        currentViewState.title = 'すべての動画';
+        currentViewState.page = 1;
+        document.querySelectorAll('.folder-item').forEach(e => e.classList.remove('active'));
+        allBtn.classList.add('active');
+        loadLibrary();
+    };
+    list.appendChild(allBtn);
+
+    data.folders.forEach(f => {
+        const d = document.createElement('div');
+        d.className = 'folder-item';
+        d.title = f.path;
+        d.innerHTML = `<span>📁 ${f.name}</span><span class="folder-count">${f.count}</span>`;
+        d.onclick = () => {
+            currentViewState.folder = f.path;
+            currentViewState.title = f.name;
+            currentViewState.page = 1;
+            document.querySelectorAll('.folder-item').forEach(e => e.classList.remove('active'));
+            d.classList.add('active');
+            loadLibrary();
+        };
+        d.onpointerenter = () => prefetchPage(`/api/videos?${libraryParams(0, f.path).toString()}`);
+        list.appendChild(d);
+    });
+}
+
+function libraryParams(offset = 0, folder = currentViewState.folder) {
+    const params = new URLSearchParams({
+        limit: currentViewState.perPage,
+        offset: offset,
+        favorites_only: currentViewState.favoritesOnly,
+        search: currentViewState.search,
+        sort: currentViewState.sort,
+        tag: currentViewState.tagFilter
+    });
+    
+    if (currentViewState.playableOnly) {
+        params.append('playable', 'true');
+    }
+    
+    if (currentViewState.exts.length) {
+        params.append('ext', currentViewState.exts.join(','));
+    }
+    
+    if (currentViewState.sizeBucket) {
+        params.append('size_bucket', currentViewState.sizeBucket);
+    }
+    
+    if (folder) {
+        params.append('folder', folder);
+    }
+    return params;
+}
+
+// --- ページキャッシュ ---
+// /api/videos の応答を URL (= 絞り込み + 並び順 + offset) ごとにメモリと IndexedDB に保持し、
+// キャッシュがあれば即座に表示してから ETag で裏で再検証する (stale-while-revalidate)
+const PAGE_CACHE_LIMIT = 200;
+const PAGE_REVALIDATE_MS = 3000;
+const pageCache = new Map();
+const pageRequests = new Map();
+let pageDBPromise = null;
+
+function openPageDB() {
+    if (!('indexedDB' in window)) return Promise.resolve(null);
+    if (!pageDBPromise) {
+        pageDBPromise = new Promise(resolve => {
+            const req = indexedDB.open('video-manager', 1);
+            req.onupgradeneeded = () => req.result.createObjectStore('pages').createIndex('ts', 'ts');
+            req.onsuccess = () => resolve(req.result);
+            req.onerror = () => resolve(null);
+        });
+    }
+    return pageDBPromise;
+}
+
+async function idbGetPage(url) {
+    const db = await openPageDB();
+    if (!db) return null;
+    return new Promise(resolve => {
+        const req = db.transaction('pages').objectStore('pages').get(url);
+        req.onsuccess = () => resolve(req.result || null);
+        req.onerror = () => resolve(null);
+    });
+}
+
+async function idbPutPage(url, entry) {
+    const db = await openPageDB();
+    if (!db) return;
+    const store = db.transaction('pages', 'readwrite').objectStore('pages');
+    store.put({ etag: entry.etag, data: entry.data, ts: entry.ts }, url);
+    // 上限を超えたら古いものから削除する
+    const countReq = store.count();
+    countReq.onsuccess = () => {
+        let excess = countReq.result - PAGE_CACHE_LIMIT;
+        if (excess <= 0) return;
+        store.index('ts').openCursor().onsuccess = (e) => {
+            const cursor = e.target.result;
+            if (!cursor || excess-- <= 0) return;
+            cursor.delete();
+            cursor.continue();
+        };
+    };
+}
+
+function rememberPage(url, etag, data) {
+    const entry = { etag, data, ts: Date.now(), checked: Date.now() };
+    pageCache.delete(url);
+    pageCache.set(url, entry);
+    if (pageCache.size > PAGE_CACHE_LIMIT) pageCache.delete(pageCache.keys().next().value);
+    idbPutPage(url, entry);
+}
+
+function pageEtag(url) {
+    const entry = pageCache.get(url);
+    return entry ? entry.etag : null;
+}
+
+async function cachedPage(url) {
+    let entry = pageCache.get(url);
+    if (!entry) {
+        entry = await idbGetPage(url);
+        if (entry) pageCache.set(url, Object.assign(entry, { checked: 0 }));
+    }
+    return entry;
+}
+
+// ネットワークから取得する (304 のときは null)。同じ URL の同時リクエストはまとめる
+function networkPage(url, etag) {
+    if (pageRequests.has(url)) return pageRequests.get(url);
+    const p = (async () => {
+        const res = await fetch(url, { cache: 'no-store', headers: etag ? { 'If-None-Match': etag } : {} });
+        if (res.status === 304) {
+            const entry = pageCache.get(url);
+            if (entry) entry.checked = Date.now();
+            return null;
+        }
+        if (!res.ok) throw new Error(`${url} ${res.status}`);
+        const data = await res.json();
+        rememberPage(url, res.headers.get('ETag'), data);
+        return data;
+    })().finally(() => pageRequests.delete(url));
+    pageRequests.set(url, p);
+    return p;
+}
+
+async function fetchPage(url, onRevalidated) {
+    const entry = await cachedPage(url);
+    if (!entry) return networkPage(url);
+    if (Date.now() - entry.checked > PAGE_REVALIDATE_MS) {
+        networkPage(url, entry.etag).then(fresh => {
+            if (fresh && onRevalidated) onRevalidated(fresh);
+        }).catch(() => {});
+    }
+    return entry.data;
+}
+
+function prefetchPage(url) {
+    if (pageCache.has(url) || pageRequests.has(url)) return;
+    const run = () => networkPage(url).catch(() => {});
+    if ('requestIdleCallback' in window) requestIdleCallback(run, { timeout: 2000 });
+    else setTimeout(run, 200);
+}
+
+// 次のページと、次に開かれそうなフォルダ (現在のフォルダの前後・件数上位) の先頭ページを先読みする
+function prefetchLikelyPages() {
+    if (currentLib.length < currentViewState.total) {
+        prefetchPage(`/api/videos?${libraryParams(currentLib.length).toString()}`);
+    }
+    const idx = folderListData.findIndex(f => f.path === currentViewState.folder);
+    const candidates = [folderListData[idx - 1], folderListData[idx + 1]]
+        .concat(folderListData.slice(0, PREFETCH_TOP_FOLDERS));
+    candidates.forEach(f => {
+        if (f && f.path !== currentViewState.folder) prefetchPage(`/api/videos?${libraryParams(0, f.path).toString()}`);
+    });
+}
+
+async function loadLibrary() {
+    // フィルター/並び順が変わったら先頭から読み直す (以降はスクロールに合わせて追加読み込み)
+    const seq = ++libraryState.seq;
+    const url = `/api/videos?${libraryParams(0).toString()}`;
+    libraryState.loading = true;
+    try {
+        const data = await fetchPage(url, fresh => {
+            // 再検証で内容が変わっていたら、まだ先頭ページしか読んでいない場合に限り差し替える
+            if (seq === libraryState.seq && currentLib.length <= fresh.videos.length) {
+                renderLibrary(fresh, true);
+                libraryState.etag = pageEtag(url);
+            }
+        });
+        if (seq !== libraryState.seq) return;
+        renderLibrary(data);
+        libraryState.etag = pageEtag(url);
+    } finally {
+        // 取得に失敗しても以降の読み込みが止まらないようにする
+        if (seq === libraryState.seq) libraryState.loading = false;
+    }
+    loadFacets();
+    prefetchLikelyPages();
+}
+
+async function loadMoreLibrary() {
+    if (libraryState.loading || currentLib.length >= currentViewState.total) return;
+    const seq = libraryState.seq;
+    libraryState.loading = true;
+    document.getElementById('pagination').innerText = '読み込み中...';
+    try {
+        const url = `/api/videos?${libraryParams(currentLib.length).toString()}`;
+        // 別の世代のページをつなげると offset がずれて重複や抜けが出るので、キャッシュは同じ世代のものだけ使う
+        const entry = await cachedPage(url);
+        const data = entry && entry.etag === libraryState.etag ? entry.data : await networkPage(url);
+        if (seq !== libraryState.seq) return;
+        if (pageEtag(url) !== libraryState.etag) {
+            // 読み込んだ範囲の途中でライブラリが変わった。ここまでの範囲を 1 回で取り直して差し替える
+            const params = libraryParams(0);
+            params.set('limit', currentLib.length + data.videos.length);
+            const rangeUrl = `/api/videos?${params.toString()}`;
+            const fresh = await networkPage(rangeUrl);
+            if (seq !== libraryState.seq) return;
+            renderLibrary(fresh, true);
+            libraryState.etag = pageEtag(rangeUrl);
+            return;
+        }
+        currentLib = currentLib.concat(data.videos);
+        currentViewState.total = data.total;
+    } finally {
+        if (seq === libraryState.seq) {
+            libraryState.loading = false;
+            updateLibraryFooter();
+            renderVisibleCards();
+            prefetchLikelyPages();
+        }
+    }
+}
+
+// 拡張子・サイズ帯自身の選択は外して集計する (選択中でも他の候補と件数が見えるように)
+function facetFilter() {
+    const params = currentFilter();
+    delete params.ext;
+    delete params.size_bucket;
+    return params;
+}
+
+async function loadFacets() {
+    const params = new URLSearchParams(facetFilter());
+    const key = params.toString();
+    if (key === lastFacetKey) return;
+    lastFacetKey = key;
+    try {
+        const res = await fetch(`/api/facets?${key}`);
+        renderFacets(await res.json());
+    } catch (e) {
+        console.error('Facets load error:', e);
+    }
+}
+
+function renderFacets(data) {
+    document.getElementById('facetSection').style.display = data.total ? 'block' : 'none';
+    document.getElementById('extFacets').innerHTML = data.ext.map(f => {
+        const active = currentViewState.exts.includes(f.value) ? ' active' : '';
+        return `<span class="tag-filter-btn${active}" onclick="toggleExtFacet('${f.value}')">.${f.value} (${f.count})</span>`;
+    }).join('');
+    document.getElementById('sizeFacets').innerHTML = data.size_bucket.map(f => {
+        const active = currentViewState.sizeBucket === f.value ? ' active' : '';
+        return `<span class="tag-filter-btn${active}" onclick="toggleSizeFacet('${f.value}')">${f.label} (${f.count})</span>`;
+    }).join('');
 }
 
-function handleSort() {
-    currentViewState.sort = document.getElementById('sortSelect').value;
+function toggleExtFacet(ext) {
+    const exts = currentViewState.exts;
+    currentViewState.exts = exts.includes(ext) ? exts.filter(e => e !== ext) : exts.concat(ext);
     currentViewState.page = 1;
     loadLibrary();
 }
 
-async function loadFolders() {
-    const res = await fetch('/api/folders');
-    const data = await res.json();
-    const list = document.getElementById('folderList');
-    list.innerHTML = '';
-    
-    const allBtn = document.createElement('div');
-    allBtn.className = 'folder-item';
-    allBtn.innerHTML = '<span>📂 すべての動画</span><span class="folder-count">ALL</span>';
-    allBtn.onclick = () => {
-        currentViewState.folder = null;
-        currentViewState.title = 'すべての動画';
-        currentViewState.page = 1;
-        document.querySelectorAll('.folder-item').forEach(e => e.classList.remove('active'));
-        allBtn.classList.add('active');
-        loadLibrary();
-    };
-    list.appendChild(allBtn);
-
-    data.folders.forEach(f => {
-        const d = document.createElement('div');
-        d.className = 'folder-item';
-        d.title = f.path;
-        d.innerHTML = `<span>📁 ${f.name}</span><span class="folder-count">${f.count}</span>`;
-        d.onclick = () => {
-            currentViewState.folder = f.path;
-            currentViewState.title = f.name;
-            currentViewState.page = 1;
-            document.querySelectorAll('.folder-item').forEach(e => e.classList.remove('active'));
-            d.classList.add('active');
-            loadLibrary();
-        };
-        list.appendChild(d);
-    });
+function toggleSizeFacet(bucket) {
+    currentViewState.sizeBucket = currentViewState.sizeBucket === bucket ? '' : bucket;
+    currentViewState.page = 1;
+    loadLibrary();
 }
 
-async function loadLibrary() {
-    const offset = (currentViewState.page - 1) * currentViewState.perPage;
-    const params = new URLSearchParams({
-        limit: currentViewState.perPage,
-        offset: offset,
-        favorites_only: currentViewState.favoritesOnly,
-        search: currentViewState.search,
-        sort: currentViewState.sort,
-        tag: currentViewState.tagFilter
-    });
-    
-    if (currentViewState.folder) {
-        params.append('folder', currentViewState.folder);
-    }
-    
-    const url = `/api/videos?${params.toString()}`;
-    const res = await fetch(url);
-    const data = await res.json();
+function renderLibrary(data, keepScroll = false) {
     currentLib = data.videos;
     currentViewState.total = data.total;
+    libraryState.loading = false;
 
     let displayTitle = currentViewState.title;
     if (currentViewState.favoritesOnly) displayTitle += ' (お気に入り)';
@@ -2003,7 +4891,7 @@ async function loadLibrary() {
     document.getElementById('libStats').innerText = `${data.total}件の動画`;
 
     const grid = document.getElementById('videoGrid');
-    grid.innerHTML = '';
+    if (!keepScroll) grid.scrollTop = 0;
 
     if (currentLib.length === 0) {
         const msg = document.createElement('div');
@@ -2025,95 +4913,159 @@ async function loadLibrary() {
                 msg.appendChild(btn);
             }
         }
-        grid.appendChild(msg);
-        renderPagination();
+        grid.style.paddingTop = grid.style.paddingBottom = '';
+        grid.replaceChildren(msg);
+        updateLibraryFooter();
         return;
     }
 
-    currentLib.forEach((v, idx) => {
-        const c = document.createElement('div');
-        c.className = 'card';
-        c.dataset.videoId = v.id;
-        
-        const tags = v.tags.filter(t => t).slice(0, 2).map(t => `<span style="background:#333;padding:2px 6px;border-radius:4px;font-size:10px;">#${t}</span>`).join(' ');
-        
-        c.innerHTML = `
-            <div class="card-meta">
-                <div class="meta-btn" onclick="toggleFavorite(event, ${v.id})" title="お気に入り">${v.favorite ? '★' : '☆'}</div>
-                <div class="meta-btn" onclick="openTagModal(${v.id}, ${JSON.stringify(v.tags).replace(/"/g, '&quot;')})" title="タグ編集">🏷️</div>
-            </div>
-            <div class="card-thumb">
-                <div style="font-size:48px;">🎬</div>
-            </div>
-            <div class="card-info">
-                <div class="card-filename" title="${v.filename}">${v.filename}</div>
-                <div class="card-meta-row">
-                    <span>▶️ ${v.play_count}</span>
-                    <span>📦 ${v.size_str}</span>
-                    ${tags}
-                </div>
+    if (grid.querySelector('.empty-msg')) grid.replaceChildren(...cardPool);
+    cardPool.forEach(node => { node._video = null; });
+    renderVisibleCards();
+    updateLibraryFooter();
+}
+
+// --- 仮想化グリッド ---
+// 表示範囲 (+前後 GRID_OVERSCAN_ROWS 行) の分だけカード DOM を用意し、スクロールに合わせて使い回す。
+// 画面外の行はグリッドの上下 padding で高さだけ確保する
+const GRID_OVERSCAN_ROWS = 2;
+let cardPool = [];
+let gridFrame = null;
+
+function gridLayout(grid) {
+    const style = getComputedStyle(grid);
+    const cols = Math.max(1, style.gridTemplateColumns.split(' ').length);
+    const gap = parseFloat(style.rowGap) || 0;
+    const pad = parseFloat(style.paddingLeft) || 0;
+    const colWidth = (grid.clientWidth - pad * 2 - gap * (cols - 1)) / cols;
+    const sample = cardPool.find(n => n.isConnected && n.style.display !== 'none');
+    // カードは aspect-ratio 16/9 なので、未描画でも列幅から行の高さを見積もれる
+    const cardHeight = sample ? sample.offsetHeight : colWidth * 9 / 16;
+    return { cols, gap, pad, rowHeight: cardHeight + gap };
+}
+
+function createCard() {
+    const c = document.createElement('div');
+    c.className = 'card';
+    return c;
+}
+
+function bindCard(c, v, idx) {
+    c._video = v;
+    c.dataset.videoId = v.id;
+    c.dataset.index = idx;
+    c.classList.toggle('selected', selectedVideos.has(v.id));
+
+    const tags = v.tags.filter(t => t).slice(0, 2).map(t => `<span style="background:#333;padding:2px 6px;border-radius:4px;font-size:10px;">#${t}</span>`).join(' ');
+    
+    c.innerHTML = `
+        <div class="card-meta">
+            <div class="meta-btn" onclick="toggleFavorite(event, ${v.id})" title="お気に入り">${v.favorite ? '★' : '☆'}</div>
+            <div class="meta-btn" onclick="event.stopPropagation(); openTagModal(${v.id}, ${JSON.stringify(v.tags).replace(/"/g, '&quot;')})" title="タグ編集">🏷️</div>
+        </div>
+        <div class="card-thumb"${v.has_preview ? ` style="background:url(/preview/${v.id}.jpg) 0 0 / 1000% auto no-repeat;"` : ''}>
+            ${v.has_preview ? '' : '<div style="font-size:48px;">🎬</div>'}
+        </div>
+        <div class="card-info">
+            <div class="card-filename" title="${v.filename}">${v.filename}</div>
+            <div class="card-meta-row">
+                <span>▶️ ${v.play_count}</span>
+                <span>📦 ${v.size_str}</span>
+                ${v.duration ? `<span>⏱️ ${formatTime(v.duration)}</span>` : ''}
+                ${v.height ? `<span>${v.height}p</span>` : ''}
+                ${tags}
             </div>
-        `;
-        
-        c.onclick = (e) => { 
-            if (e.target.closest('.meta-btn')) return;
-            
-            if (e.ctrlKey || e.metaKey) {
-                if (selectedVideos.has(v.id)) {
-                    selectedVideos.delete(v.id);
-                    c.classList.remove('selected');
-                } else {
-                    selectedVideos.add(v.id);
-                    c.classList.add('selected');
-                }
-            } else {
-                selectedVideos.clear();
-                document.querySelectorAll('.card.selected').forEach(card => card.classList.remove('selected'));
-                openPlayer(idx);
-            }
-        };
-        grid.appendChild(c);
+        </div>
+    `;
+}
+
+function renderVisibleCards() {
+    const grid = document.getElementById('videoGrid');
+    if (!currentLib.length || grid.offsetParent === null) return;
+    const { cols, gap, pad, rowHeight } = gridLayout(grid);
+    const totalRows = Math.ceil(currentLib.length / cols);
+    const viewRows = Math.ceil(grid.clientHeight / rowHeight) + 1;
+    const firstRow = Math.max(0, Math.min(totalRows - 1, Math.floor((grid.scrollTop - pad) / rowHeight) - GRID_OVERSCAN_ROWS));
+    const lastRow = Math.min(totalRows, firstRow + viewRows + GRID_OVERSCAN_ROWS * 2);
+    const start = firstRow * cols;
+    const end = Math.min(currentLib.length, lastRow * cols);
+
+    // プールは画面サイズから決まる固定数。列数が変わったときだけ作り直す
+    const poolSize = (viewRows + GRID_OVERSCAN_ROWS * 2) * cols;
+    if (cardPool.length !== poolSize) {
+        cardPool.forEach(n => n.remove());
+        cardPool = Array.from({ length: poolSize }, createCard);
+        cardPool.forEach(n => grid.appendChild(n));
+    }
+
+    // index % poolSize で割り当てるので、スクロールで入れ替わるのは出入りした行のカードだけ
+    let cursor = grid.firstElementChild;
+    for (let i = start; i < end; i++) {
+        const node = cardPool[i % poolSize];
+        if (node._video !== currentLib[i]) bindCard(node, currentLib[i], i);
+        node.style.display = '';
+        if (node === cursor) cursor = cursor.nextElementSibling;
+        else grid.insertBefore(node, cursor);
+    }
+    for (let i = end - start; i < poolSize; i++) {
+        cardPool[(start + i) % poolSize].style.display = 'none';
+    }
+
+    grid.style.paddingTop = `${pad + firstRow * rowHeight}px`;
+    grid.style.paddingBottom = `${pad + Math.max(0, totalRows - lastRow) * rowHeight}px`;
+
+    // 末尾が近づいたら次のページを読み込む
+    if (lastRow >= totalRows - GRID_OVERSCAN_ROWS && currentLib.length < currentViewState.total) {
+        loadMoreLibrary();
+    }
+}
+
+function scheduleGridRender() {
+    if (gridFrame) return;
+    gridFrame = requestAnimationFrame(() => {
+        gridFrame = null;
+        renderVisibleCards();
     });
-    
-    renderPagination();
 }
 
-function renderPagination() {
-    const container = document.getElementById('pagination');
-    container.innerHTML = '';
-    const totalPages = Math.ceil(currentViewState.total / currentViewState.perPage);
-    if (totalPages <= 1) return;
-    
-    const prevBtn = document.createElement('button');
-    prevBtn.className = 'page-btn' + (currentViewState.page === 1 ? ' disabled' : '');
-    prevBtn.innerText = '← 前へ';
-    prevBtn.onclick = () => {
-        if (currentViewState.page > 1) {
-            currentViewState.page--;
-            loadLibrary();
-            document.getElementById('videoGrid').scrollTop = 0;
-        }
-    };
-    container.appendChild(prevBtn);
-    
-    const pageInfo = document.createElement('span');
-    pageInfo.style.color = '#999';
-    pageInfo.innerText = `${currentViewState.page} / ${totalPages}`;
-    container.appendChild(pageInfo);
-    
-    const nextBtn = document.createElement('button');
-    nextBtn.className = 'page-btn' + (currentViewState.page === totalPages ? ' disabled' : '');
-    nextBtn.innerText = '次へ →';
-    nextBtn.onclick = () => {
-        if (currentViewState.page < totalPages) {
-            currentViewState.page++;
-            loadLibrary();
-            document.getElementById('videoGrid').scrollTop = 0;
-        }
-    };
-    container.appendChild(nextBtn);
+// 単一カードだけ更新する (お気に入り/タグ変更時に全体を描き直さない)
+function patchCard(videoId) {
+    const node = cardPool.find(n => n._video && n._video.id === videoId);
+    if (node && node.style.display !== 'none') bindCard(node, node._video, Number(node.dataset.index));
+}
+
+function updateLibraryFooter() {
+    const footer = document.getElementById('pagination');
+    const remaining = currentViewState.total - currentLib.length;
+    footer.innerText = remaining > 0 ? `${currentLib.length} / ${currentViewState.total}件を表示中` : '';
+    footer.style.display = remaining > 0 ? 'flex' : 'none';
 }
 
+videoGrid.addEventListener('scroll', scheduleGridRender, { passive: true });
+window.addEventListener('resize', scheduleGridRender);
+
+videoGrid.addEventListener('click', (e) => {
+    const c = e.target.closest('.card');
+    if (!c || e.target.closest('.meta-btn')) return;
+    const idx = Number(c.dataset.index);
+    const v = currentLib[idx];
+    if (!v) return;
+
+    if (e.ctrlKey || e.metaKey) {
+        if (selectedVideos.has(v.id)) {
+            selectedVideos.delete(v.id);
+            c.classList.remove('selected');
+        } else {
+            selectedVideos.add(v.id);
+            c.classList.add('selected');
+        }
+    } else {
+        selectedVideos.clear();
+        document.querySelectorAll('.card.selected').forEach(card => card.classList.remove('selected'));
+        openPlayer(idx);
+    }
+});
+
 const pModal = document.getElementById('playerModal');
 const pVideo = document.getElementById('playerVideo');
 let currentPlayingVideoId = null;
@@ -2121,6 +5073,79 @@ let swipeStartX = 0;
 let swipeEndX = 0;
 const SWIPE_THRESHOLD = 80; // スワイプと認識するピクセル数
 
+// 画質: auto はサーバーがクライアントヒント (Save-Data/Downlink) から選ぶ
+const QUALITY_LEVELS = ['auto', '720', '480', 'orig'];
+const QUALITY_LABELS = { auto: 'AUTO', '720': '720p', '480': '480p', orig: '原画' };
+let videoQuality = localStorage.getItem('videoQuality') || 'auto';
+document.getElementById('qualityBtn').innerText = QUALITY_LABELS[videoQuality];
+
+function videoSrc(id, preload = false) {
+    // preload: 先読み用の低優先度ストリーム (再生中のストリームに帯域を譲る)
+    const params = new URLSearchParams();
+    if (videoQuality !== 'auto') params.append('q', videoQuality);
+    if (preload) params.append('prio', 'low');
+    const qs = params.toString();
+    return qs ? `/video/${id}?${qs}` : `/video/${id}`;
+}
+
+// --- 再生テレメトリ ---
+// play / position / skip をバッファにため、重複をまとめてから /api/events へ一括送信する
+const TELEMETRY_FLUSH_MS = 5000;
+const TELEMETRY_MAX_BUFFER = 50;
+const PLAY_DEDUPE_MS = 10 * 60 * 1000;  // 同じ動画の再生はこの間隔内なら 1 回と数える
+const POSITION_REPORT_MS = 10000;
+const SHORTS_SKIP_SECONDS = 3;
+let telemetryBuffer = [];
+let telemetryTimer = null;
+const lastPlayReported = new Map();
+
+function trackEvent(type, videoId, extra = {}) {
+    const now = Date.now();
+    if (type === 'play') {
+        if (now - (lastPlayReported.get(videoId) || 0) < PLAY_DEDUPE_MS) return;
+        lastPlayReported.set(videoId, now);
+    } else {
+        // position は最新値だけ、skip は未送信分に同じ動画があれば 1 件にまとめる
+        const i = telemetryBuffer.findIndex(e => e.type === type && e.video_id === videoId);
+        if (i >= 0) {
+            if (type === 'position') telemetryBuffer.splice(i, 1);
+            else return;
+        }
+    }
+    telemetryBuffer.push(Object.assign({ type, video_id: videoId, ts: Math.floor(now / 1000) }, extra));
+    if (telemetryBuffer.length >= TELEMETRY_MAX_BUFFER) flushTelemetry();
+    else if (!telemetryTimer) telemetryTimer = setTimeout(flushTelemetry, TELEMETRY_FLUSH_MS);
+}
+
+function flushTelemetry() {
+    clearTimeout(telemetryTimer);
+    telemetryTimer = null;
+    if (!telemetryBuffer.length) return;
+    const payload = JSON.stringify({ events: telemetryBuffer });
+    telemetryBuffer = [];
+    if (navigator.sendBeacon && navigator.sendBeacon('/api/events', new Blob([payload], { type: 'application/json' }))) return;
+    fetch('/api/events', { method: 'POST', headers: {'Content-Type': 'application/json'}, body: payload, keepalive: true }).catch(() => {});
+}
+
+// タブが隠れる/閉じるときは待たずに送る
+document.addEventListener('visibilitychange', () => { if (document.visibilityState === 'hidden') flushTelemetry(); });
+window.addEventListener('pagehide', flushTelemetry);
+
+function cycleQuality() {
+    videoQuality = QUALITY_LEVELS[(QUALITY_LEVELS.indexOf(videoQuality) + 1) % QUALITY_LEVELS.length];
+    localStorage.setItem('videoQuality', videoQuality);
+    document.getElementById('qualityBtn').innerText = QUALITY_LABELS[videoQuality];
+    if (currentPlayingVideoId) {
+        const t = pVideo.currentTime;
+        const wasPaused = pVideo.paused;
+        pVideo.src = videoSrc(currentPlayingVideoId);
+        pVideo.addEventListener('loadedmetadata', () => {
+            pVideo.currentTime = t;
+            if (!wasPaused) pVideo.play().catch(()=>{});
+        }, { once: true });
+    }
+}
+
 function openPlayer(idx) {
     currentIndex = idx;
     const v = currentLib[idx];
@@ -2128,10 +5153,11 @@ function openPlayer(idx) {
     
     currentPlayingVideoId = v.id;
     pModal.style.display = 'flex';
-    pVideo.src = `/video/${v.id}`;
+    pVideo.src = videoSrc(v.id);
     document.getElementById('playerTitle').innerText = v.filename;
     updatePlayerFavoriteButton(v.favorite);
     updatePlayerTagButton(v.tags);
+    loadSeekPreview(v);
     
     try {
         const pathParts = v.path.split('/');
@@ -2148,7 +5174,8 @@ function openPlayer(idx) {
 
     history.pushState({modal: 'player'}, '', '#player');
 
-    fetch('/api/meta', {method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify({video_id: v.id, action:'play'})});
+    trackEvent('play', v.id);
+    resumePosition(v);
     pVideo.play().catch(()=>{});
     
     // プレイヤーコントロールの初期化
@@ -2206,6 +5233,30 @@ pModal.addEventListener('click', (e) => {
 // CSSはHTML_TEMPLATEの先頭付近にあるため、ここではJSのみ修正
 
 
+// 再生位置は一定間隔で記録し、次に開いたときに続きから再生する
+let lastPositionReport = 0;
+
+function reportPosition(force = false) {
+    if (!currentPlayingVideoId || !pVideo.duration) return;
+    const now = Date.now();
+    if (!force && now - lastPositionReport < POSITION_REPORT_MS) return;
+    lastPositionReport = now;
+    // 最後まで見たものは先頭に戻す
+    const position = pVideo.currentTime > pVideo.duration - 5 ? 0 : pVideo.currentTime;
+    trackEvent('position', currentPlayingVideoId, { position });
+    const v = currentLib.find(x => x.id === currentPlayingVideoId);
+    if (v) v.last_position = position;
+}
+
+function resumePosition(v) {
+    if (!v.last_position || v.last_position < 5) return;
+    pVideo.addEventListener('loadedmetadata', () => {
+        if (v.last_position < pVideo.duration - 5) pVideo.currentTime = v.last_position;
+    }, { once: true });
+}
+
+pVideo.addEventListener('timeupdate', () => reportPosition());
+
 // 再生/一時停止時にもタイマーをリセット
 pVideo.addEventListener('play', () => {
     resetPlayerUITimer();
@@ -2217,7 +5268,8 @@ pVideo.addEventListener('pause', () => {
 
 // シークバー操作中は非表示にしない
 document.getElementById('playerSeek').addEventListener('touchstart', () => clearTimeout(uiTimer));
-document.getElementById('playerSeek').addEventListener('touchend', () => resetPlayerUITimer());
+document.getElementById('playerSeek').addEventListener('touchend', () => { hideSeekPreview(); resetPlayerUITimer(); });
+document.getElementById('playerSeek').addEventListener('mouseup', hideSeekPreview);
 
 document.getElementById('playerSeek').addEventListener('change', (e) => {
     if (pVideo.duration > 0) {
@@ -2240,7 +5292,56 @@ function updatePlayerTime() {
 
 function seekVideo(value) {
     // シークバーをドラッグしている間はcurrentTimeを更新しないようにする
-    // oninputイベントで呼ばれるため、ここでは何もしない
+    // oninputイベントで呼ばれるため、ここではプレビュー表示のみ行う
+    showSeekPreview(value);
+}
+
+// シークプレビュー (WebVTT サムネイルトラック)
+let seekPreviewCues = [];
+const seekPreviewEl = document.getElementById('seekPreview');
+
+async function loadSeekPreview(v) {
+    seekPreviewCues = [];
+    hideSeekPreview();
+    if (!v.has_preview) return;
+    const videoId = v.id;
+    try {
+        const res = await fetch(`/preview/${videoId}.vtt`);
+        if (!res.ok || currentPlayingVideoId !== videoId) return;
+        seekPreviewCues = parseThumbnailVtt(await res.text());
+    } catch (e) {
+        seekPreviewCues = [];
+    }
+}
+
+function parseThumbnailVtt(text) {
+    const toSec = t => t.split(':').reduce((acc, p) => acc * 60 + parseFloat(p), 0);
+    const cues = [];
+    const lines = text.split('\n');
+    for (let i = 0; i < lines.length; i++) {
+        const m = lines[i].match(/^([\d:.]+)\s*-->\s*([\d:.]+)/);
+        if (!m || !lines[i + 1]) continue;
+        const [url, hash] = lines[i + 1].trim().split('#xywh=');
+        const [x, y, w, h] = (hash || '0,0,0,0').split(',').map(Number);
+        cues.push({ start: toSec(m[1]), end: toSec(m[2]), url, x, y, w, h });
+    }
+    return cues;
+}
+
+function showSeekPreview(value) {
+    if (!seekPreviewCues.length || !(pVideo.duration > 0)) return;
+    const time = (value / 100) * pVideo.duration;
+    const cue = seekPreviewCues.find(c => time >= c.start && time < c.end) || seekPreviewCues[seekPreviewCues.length - 1];
+    const seek = document.getElementById('playerSeek');
+    seekPreviewEl.style.backgroundImage = `url(${cue.url})`;
+    seekPreviewEl.style.backgroundPosition = `-${cue.x}px -${cue.y}px`;
+    seekPreviewEl.style.left = `${seek.offsetLeft + seek.offsetWidth * value / 100}px`;
+    document.getElementById('seekPreviewTime').innerText = formatTime(time);
+    seekPreviewEl.style.display = 'block';
+}
+
+function hideSeekPreview() {
+    seekPreviewEl.style.display = 'none';
 }
 
 document.getElementById('playerSeek').addEventListener('change', (e) => {
@@ -2320,16 +5421,13 @@ async function togglePlayerFavorite() {
     if (currentVideo) {
         currentVideo.favorite = !currentVideo.favorite;
         updatePlayerFavoriteButton(currentVideo.favorite);
-        const card = document.querySelector(`.card[data-video-id="${currentPlayingVideoId}"]`);
-        if (card) {
-            const metaBtn = card.querySelector('.meta-btn');
-            if (metaBtn) metaBtn.innerText = currentVideo.favorite ? '★' : '☆';
-        }
+        patchCard(currentVideo.id);
     }
     loadStats();
 }
 
 function closePlayer(goBack = true) {
+    reportPosition(true);
     pModal.style.display = 'none';
     pVideo.pause();
     pVideo.src = '';
@@ -2361,15 +5459,18 @@ function togglePlayPause() {
 }
 
 function playNext() {
+    if (currentIndex >= currentLib.length - 3) loadMoreLibrary();
     if (currentIndex < currentLib.length - 1) {
+        reportPosition(true);
         currentIndex++;
         const v = currentLib[currentIndex];
         
         currentPlayingVideoId = v.id;
-        pVideo.src = `/video/${v.id}`;
+        pVideo.src = videoSrc(v.id);
         document.getElementById('playerTitle').innerText = v.filename;
         updatePlayerFavoriteButton(v.favorite);
         updatePlayerTagButton(v.tags);
+        loadSeekPreview(v);
         
         try {
             const pathParts = v.path.split('/');
@@ -2380,21 +5481,25 @@ function playNext() {
             document.getElementById('playerFolderBtn').title = `${folderName} を開く`;
         } catch(e){}
 
-        fetch('/api/meta', {method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify({video_id: v.id, action:'play'})});
+        trackEvent('play', v.id);
+        resumePosition(v);
         pVideo.play().catch(()=>{});
     }
 }
 
 function playPrev() {
     if (currentIndex > 0) {
+        reportPosition(true);
         currentIndex--;
         const v = currentLib[currentIndex];
         currentPlayingVideoId = v.id;
-        pVideo.src = `/video/${v.id}`;
+        pVideo.src = videoSrc(v.id);
         document.getElementById('playerTitle').innerText = v.filename;
         updatePlayerFavoriteButton(v.favorite);
         updatePlayerTagButton(v.tags);
-        fetch('/api/meta', {method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify({video_id: v.id, action:'play'})});
+        loadSeekPreview(v);
+        trackEvent('play', v.id);
+        resumePosition(v);
         pVideo.play().catch(()=>{});
     }
 }
@@ -2432,12 +5537,15 @@ async function toggleFavorite(e, video_id) {
     e.stopPropagation();
     await fetch('/api/meta', {method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify({video_id, action:'toggle_favorite'})});
     loadStats();
-    loadLibrary();
+    const v = currentLib.find(x => x.id === video_id);
+    if (!v || currentViewState.favoritesOnly) { loadLibrary(); return; }
+    v.favorite = !v.favorite;
+    patchCard(video_id);
 }
 
 function updatePlayerTagButton(tags) {
     const btn = document.getElementById('playerTagBtn');
-    const tagArray = tags ? tags.split(',').map(t => t.trim()).filter(t => t) : [];
+    const tagArray = (Array.isArray(tags) ? tags : (tags ? tags.split(',') : [])).map(t => t.trim()).filter(t => t);
     if (tagArray.length > 0) {
         btn.style.background = '#00aaff';
         btn.title = `タグ: ${tagArray.join(', ')}`;
@@ -2458,8 +5566,7 @@ async function openPlayerTagModal() {
     // currentLibのタグ情報を更新
     currentVideo.tags = meta.tags;
     
-    const tags = currentVideo.tags ? currentVideo.tags.split(',').map(t => t.trim()).filter(t => t) : [];
-    openTagModal(currentVideo.id, tags);
+    openTagModal(currentVideo.id, currentVideo.tags.map(t => t.trim()).filter(t => t));
 }
 
 function openTagModal(video_id, tags) {
@@ -2497,15 +5604,16 @@ async function saveTags() {
     const tags = tagModalState.tags.join(',');
     await fetch('/api/meta', {method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify({video_id: tagModalState.video_id, action:'set_tags', tags})});
     
-    // プレイヤーで開いている動画のタグを更新
+    // ライブラリ上の該当カードとプレイヤーのタグ表示だけ更新する
     const currentVideo = currentLib.find(v => v.id === tagModalState.video_id);
     if (currentVideo) {
-        currentVideo.tags = tags;
+        currentVideo.tags = tagModalState.tags.slice();
         updatePlayerTagButton(tags);
+        patchCard(currentVideo.id);
     }
     
     closeTagModal();
-    loadLibrary();
+    if (!currentVideo || currentViewState.tagFilter) loadLibrary();
     loadStats();
 }
 
@@ -2519,15 +5627,60 @@ async function loadShorts() {
     }
     
     container.innerHTML = '<div style="padding:40px;text-align:center;color:#666;">🔥 動画を探しています...</div>';
-    const res = await fetch('/api/shorts');
-    const data = await res.json();
-    shortsData = data.shorts;
+    shortsData = [];
+    shortsItems = [];
+    shortsPlayed = new Set();
+    shortsActive = -1;
+    shortsTrimmed = 0;
+    shortsSession = null;
+    const items = await fetchShortsPage();
     container.innerHTML = '';
-    shortsData.forEach(v => {
+    appendShortItems(items);
+    
+    reinitializeShortsObserver();
+    
+    container.addEventListener('wheel', e => {
+        if (Math.abs(e.deltaY) > 40) {
+            e.preventDefault();
+            if (e.deltaY > 0) container.scrollBy({top: window.innerHeight, behavior: 'smooth'});
+            else container.scrollBy({top: -window.innerHeight, behavior: 'smooth'});
+        }
+    }, { passive: false });
+}
+
+// 無限フィード: サーバー側の既読セット (session) で重複を避けながらページ単位で取得
+async function fetchShortsPage() {
+    const params = new URLSearchParams({ limit: SHORTS_PAGE_SIZE });
+    if (shortsSession) params.append('session', shortsSession);
+    const res = await fetch(`/api/shorts?${params.toString()}`);
+    const data = await res.json();
+    shortsSession = data.session;
+    return data.shorts;
+}
+
+async function loadMoreShorts() {
+    if (shortsLoadingMore) return;
+    shortsLoadingMore = true;
+    try {
+        const items = await fetchShortsPage();
+        const added = appendShortItems(items);
+        if (shortObserver) added.forEach(el => shortObserver.observe(el));
+    } finally {
+        shortsLoadingMore = false;
+    }
+}
+
+function appendShortItems(items) {
+    const container = document.getElementById('shorts-view');
+    const added = [];
+    items.forEach(v => {
         const item = document.createElement('div');
         item.className = 'short-item';
+        item.dataset.index = shortsData.length;
+        shortsData.push(v);
+        shortsItems.push(item);
+        // <video> は持たせず、表示中の前後だけリングの要素を差し込む
         item.innerHTML = `
-            <video class="short-video" data-src="/video/${v.id}" preload="none" muted playsinline loop></video>
             <div class="short-overlay">
                 <div class="short-info">
                     <div class="short-folder-name">📂 ${v.folder_name}</div>
@@ -2535,22 +5688,133 @@ async function loadShorts() {
                 </div>
                 <div class="short-actions">
                     <div class="action-btn" onclick="jumpToFolder('${v.folder_path.replace(/\\/g, "\\\\")}', '${v.folder_name.replace(/'/g, "\\'")}')">📂</div>
-                    <div class="action-btn" onclick="toggleMute(this)">🔊</div>
+                    <div class="action-btn mute-btn" onclick="toggleMute()">${shortsMuted ? '🔇' : '🔊'}</div>
                 </div>
             </div>
         `;
         container.appendChild(item);
+        added.push(item);
     });
-    
-    reinitializeShortsObserver();
-    
-    container.addEventListener('wheel', e => {
-        if (Math.abs(e.deltaY) > 40) {
-            e.preventDefault();
-            if (e.deltaY > 0) container.scrollBy({top: window.innerHeight, behavior: 'smooth'});
-            else container.scrollBy({top: -window.innerHeight, behavior: 'smooth'});
+    return added;
+}
+
+// --- ショートの <video> リング ---
+// SHORTS_RING_SIZE 個の <video> を使い回す。index i の項目には ring[i % SHORTS_RING_SIZE] を割り当て、
+// 表示中の 1 つ前から先読み分までだけがデコーダーとバッファを持つ
+function shortsVideo(i) {
+    if (!shortsRing.length) {
+        for (let n = 0; n < SHORTS_RING_SIZE; n++) {
+            const el = document.createElement('video');
+            el.className = 'short-video';
+            el.playsInline = true;
+            el.loop = true;
+            el.preload = 'auto';
+            el.addEventListener('error', () => retryShortVideo(el));
+            shortsRing.push(el);
         }
-    }, { passive: false });
+    }
+    return shortsRing[i % SHORTS_RING_SIZE];
+}
+
+function releaseShortVideo(el) {
+    el.pause();
+    el.removeAttribute('src');
+    el.load();
+    el.dataset.index = '';
+    el.dataset.preload = '';
+    el.dataset.retried = '';
+    el.remove();
+}
+
+// 表示中の動画は必ず再生優先度のストリームで読む
+function playShortVideo(el, v) {
+    el.dataset.preload = '';
+    el.src = videoSrc(v.id, false);
+}
+
+function retryShortVideo(el) {
+    // 先読みが 503 などで失敗しても、表示されたときに playShortVideo で読み直される。
+    // 表示中のものは再生優先度で 1 回だけ読み直す
+    const i = parseInt(el.dataset.index);
+    if (i !== shortsActive || el.dataset.retried || !shortsData[i]) return;
+    el.dataset.retried = '1';
+    setTimeout(() => {
+        if (el.dataset.index !== String(i)) return;
+        playShortVideo(el, shortsData[i]);
+        if (i === shortsActive) el.play().catch(()=>{});
+    }, 1000);
+}
+
+function assignShortVideo(i, preload) {
+    const v = shortsData[i];
+    const item = shortsItems[i];
+    if (!v || !item) return null;
+    const el = shortsVideo(i);
+    if (el.dataset.index !== String(i)) {
+        if (el.dataset.index) releaseShortVideo(el);
+        // 先読みは低優先度で開始する
+        el.src = videoSrc(v.id, preload);
+        el.dataset.index = i;
+        el.dataset.preload = preload ? '1' : '';
+        el.dataset.retried = '';
+        el.muted = shortsMuted;
+        item.insertBefore(el, item.firstChild);
+    } else if (!preload && el.dataset.preload) {
+        // 先読みのまま再生すると以降の Range 要求も低優先度扱いになり、絞られたり先に打ち切られたりする。
+        // 表示された時点で再生優先度の URL に差し替える
+        playShortVideo(el, v);
+        el.dataset.retried = '';
+    }
+    return el;
+}
+
+function activateShort(i) {
+    if (i === shortsActive) return;
+    // 数秒で次へ送られたものはスキップとして記録する
+    const prev = shortsActive >= 0 ? shortsVideo(shortsActive) : null;
+    if (prev && prev.dataset.index === String(shortsActive) && prev.currentTime < SHORTS_SKIP_SECONDS) {
+        trackEvent('skip', shortsData[shortsActive].id);
+    }
+    shortsActive = i;
+    const active = assignShortVideo(i, false);
+    for (let n = 1; n <= SHORTS_RING_SIZE - 2; n++) assignShortVideo(i + n, true);
+    // 1 つ前はリングに残っていればそのまま (戻るスワイプ用)。範囲外の要素は解放する
+    shortsRing.forEach(el => {
+        const idx = el.dataset.index === '' || el.dataset.index === undefined ? null : parseInt(el.dataset.index);
+        if (idx === null) return;
+        if (idx < i - 1 || idx > i + SHORTS_RING_SIZE - 2) releaseShortVideo(el);
+        else if (idx !== i) el.pause();
+    });
+    if (!active) return;
+    active.play().catch(()=>{});
+    if (!shortsPlayed.has(i)) {
+        shortsPlayed.add(i);
+        trackEvent('play', shortsData[i].id);
+    }
+    trimShortItems(i);
+    if (i >= shortsData.length - 3) loadMoreShorts();
+}
+
+function trimShortItems(i) {
+    // 長くスワイプし続けても項目が増え続けないよう、十分前に流れたものをページ単位でまとめて捨てる。
+    // index は振り直さず、配列の該当位置を null にする
+    const cut = i - SHORTS_KEEP_BEHIND;
+    if (cut - shortsTrimmed < SHORTS_PAGE_SIZE) return;
+    const container = document.getElementById('shorts-view');
+    let removedHeight = 0;
+    for (let n = shortsTrimmed; n < cut; n++) {
+        const item = shortsItems[n];
+        if (!item) continue;
+        if (shortObserver) shortObserver.unobserve(item);
+        removedHeight += item.offsetHeight;
+        item.remove();
+        shortsItems[n] = null;
+        shortsData[n] = null;
+        shortsPlayed.delete(n);
+    }
+    shortsTrimmed = cut;
+    // 上にあった要素を消した分だけスクロール位置を戻し、表示中の項目が動かないようにする
+    container.scrollTop -= removedHeight;
 }
 
 function stopShorts() {
@@ -2558,9 +5822,8 @@ function stopShorts() {
         shortObserver.disconnect();
         shortObserver = null;
     }
-    document.querySelectorAll('.short-video').forEach(v => {
-        try { v.pause(); v.removeAttribute('src'); } catch(e) {}
-    });
+    shortsRing.forEach(el => { try { releaseShortVideo(el); } catch(e) {} });
+    shortsActive = -1;
 }
 
 function reinitializeShortsObserver() {
@@ -2568,30 +5831,24 @@ function reinitializeShortsObserver() {
     
     const observer = new IntersectionObserver((entries) => {
         entries.forEach(entry => {
-            const vid = entry.target.querySelector('video');
-            if (!vid) return;
+            const idx = parseInt(entry.target.dataset.index);
             if (entry.isIntersecting && entry.intersectionRatio >= 0.85) {
-                if (!vid.src) {
-                    vid.src = vid.dataset.src;
-                    const id = vid.dataset.src.split('/').pop();
-                    fetch('/api/meta', {method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify({video_id: parseInt(id), action:'play'})});
-                }
-                vid.play().catch(()=>{});
-            } else {
-                vid.pause();
-                try { vid.currentTime = 0; } catch(e) {}
+                activateShort(idx);
+            } else if (idx === shortsActive) {
+                const el = shortsVideo(idx);
+                if (el.dataset.index === String(idx)) el.pause();
             }
         });
     }, { threshold: 0.85 });
     
-    document.querySelectorAll('.short-item').forEach(el => observer.observe(el));
+    shortsItems.forEach(el => { if (el) observer.observe(el); });
     shortObserver = observer;
 }
 
-function toggleMute(btn) {
-    const video = btn.closest('.short-item').querySelector('video');
-    video.muted = !video.muted;
-    btn.innerText = video.muted ? '🔇' : '🔊';
+function toggleMute() {
+    shortsMuted = !shortsMuted;
+    shortsRing.forEach(el => { el.muted = shortsMuted; });
+    document.querySelectorAll('.mute-btn').forEach(b => { b.innerText = shortsMuted ? '🔇' : '🔊'; });
 }
 
 function jumpToFolder(path, name) {
@@ -2697,21 +5954,90 @@ function playVideoById(videoId) {
     }, 500);
 }
 
+async function startPreviews() {
+    const res = await fetch('/api/previews', {method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify({})});
+    const msg = document.getElementById('previewMsg');
+    if (!res.ok) {
+        const err = await res.json();
+        msg.innerText = err.error === 'ffmpeg not found' ? '⚠️ ffmpeg が見つかりません' : '⚠️ 既に実行中です';
+        return;
+    }
+    msg.innerText = 'プレビュー生成開始...';
+    const timer = setInterval(async () => {
+        const d = await (await fetch('/api/previews/status')).json();
+        msg.innerText = `🖼️ ${d.processed}/${d.total} 処理中... (失敗 ${d.failed})`;
+        if (!d.is_running) {
+            clearInterval(timer);
+            msg.innerText = `✅ 完了 (${d.processed - d.failed}件生成, 失敗 ${d.failed})`;
+            loadLibrary();
+        }
+    }, 1000);
+}
+
+async function importData() {
+    const file = document.getElementById('importFile').files[0];
+    const msg = document.getElementById('importMsg');
+    if (!file) { alert('インポートするファイルを選択してください'); return; }
+    const form = new FormData();
+    form.append('file', file);
+    msg.innerText = 'アップロード中...';
+    const res = await fetch('/api/import', { method: 'POST', body: form });
+    if (!res.ok) {
+        const err = await res.json();
+        msg.innerText = err.error === 'already running' ? '⚠️ 既に実行中です' : `⚠️ ${err.error}`;
+        return;
+    }
+    const timer = setInterval(async () => {
+        const d = await (await fetch('/api/import/status')).json();
+        const pct = d.total_bytes ? Math.round(d.read_bytes / d.total_bytes * 100) : 0;
+        msg.innerText = `📥 ${d.processed}件処理 (一致 ${d.matched}件) ${pct}%`;
+        if (!d.is_running) {
+            clearInterval(timer);
+            msg.innerText = d.error
+                ? `⚠️ エラー: ${d.error}`
+                : `✅ 完了 (${d.processed}件中 ${d.matched}件を復元, スキップ ${d.skipped}件)`;
+            loadStats();
+            loadLibrary();
+        }
+    }, 1000);
+}
+
 async function exportData() {
-    window.location.href = '/api/export';
-    alert('データをエクスポートしました!');
+    const params = new URLSearchParams(document.getElementById('exportFiltered').checked ? currentFilter() : {});
+    params.set('format', document.getElementById('exportFormat').value);
+    if (document.getElementById('exportGzip').checked) params.set('gzip', '1');
+    // 応答はストリーミングなので、ダウンロードは即座に始まる
+    window.location.href = `/api/export?${params.toString()}`;
 }
 
-async function bulkAddTags() {
-    if (selectedVideos.size === 0) { alert('タグを追加する動画を選択してください'); return; }
+// ライブラリの現在の絞り込み条件 (ページングと並び順を除く)
+function currentFilter() {
+    const params = Object.fromEntries(libraryParams());
+    delete params.limit;
+    delete params.offset;
+    delete params.sort;
+    return params;
+}
+
+async function bulkTags(action, useFilter) {
+    const adding = action === 'add_tags';
+    if (!useFilter && selectedVideos.size === 0) { alert(adding ? 'タグを追加する動画を選択してください' : 'タグを削除する動画を選択してください'); return; }
     const tags = document.getElementById('bulkTagInput').value.trim();
-    if (!tags) { alert('追加するタグを入力してください'); return; }
-    await fetch('/api/bulk_action', {
+    if (!tags) { alert(adding ? '追加するタグを入力してください' : '削除するタグを入力してください'); return; }
+    if (useFilter && !confirm(adding
+        ? `現在の絞り込み結果 ${currentViewState.total}件すべてにタグを追加しますか?`
+        : `現在の絞り込み結果 ${currentViewState.total}件すべてからタグを削除しますか?`)) return;
+    const body = { action: action, tags: tags };
+    if (useFilter) body.filter = currentFilter();
+    else body.video_ids = Array.from(selectedVideos);
+    const res = await fetch('/api/bulk_action', {
         method: 'POST',
         headers: {'Content-Type': 'application/json'},
-        body: JSON.stringify({ action: 'add_tags', video_ids: Array.from(selectedVideos), tags: tags })
+        body: JSON.stringify(body)
     });
-    alert(`${selectedVideos.size}件の動画にタグを追加しました!`);
+    const data = await res.json();
+    if (!res.ok) { alert(data.error || '一括編集に失敗しました'); return; }
+    alert(adding ? `${data.affected}件の動画にタグを追加しました!` : `${data.affected}件の動画からタグを削除しました!`);
     selectedVideos.clear();
     document.querySelectorAll('.card.selected').forEach(c => c.classList.remove('selected'));
     document.getElementById('bulkTagInput').value = '';
@@ -2732,11 +6058,126 @@ async function bulkAddFavorites() {
     loadStats();
     loadLibrary();
 }
-</script>
-</body>
-</html>
 """
 
+# --- Service Worker (シェル・初回描画用 API・サムネイルのキャッシュ) ---
+SW_JS = r"""
+const CONFIG = __SW_CONFIG__;
+const SHELL_CACHE = `vm-shell-${CONFIG.version}`;
+const API_CACHE = `vm-api-${CONFIG.version}`;
+const THUMB_CACHE = 'vm-thumbs';
+const KEEP = [SHELL_CACHE, API_CACHE, THUMB_CACHE];
+
+self.addEventListener('install', (event) => {
+    event.waitUntil(caches.open(SHELL_CACHE).then(cache => cache.addAll(CONFIG.shell)).then(() => self.skipWaiting()));
+});
+
+// バージョンが変わったら古いシェル/API キャッシュを捨てる
+self.addEventListener('activate', (event) => {
+    event.waitUntil(
+        caches.keys()
+            .then(keys => Promise.all(keys.filter(k => k.startsWith('vm-') && !KEEP.includes(k)).map(k => caches.delete(k))))
+            .then(() => self.clients.claim())
+    );
+});
+
+async function trimCache(name, maxEntries) {
+    const cache = await caches.open(name);
+    const keys = await cache.keys();
+    // keys() は追加順なので先頭から古いものを削除する
+    for (let i = 0; i < keys.length - maxEntries; i++) await cache.delete(keys[i]);
+}
+
+async function putWithTimestamp(cacheName, key, response) {
+    const length = Number(response.headers.get('Content-Length') || 0);
+    if (length > CONFIG.maxEntryBytes) return;
+    const body = await response.blob();
+    if (body.size > CONFIG.maxEntryBytes) return;
+    const headers = new Headers(response.headers);
+    // 本文は展開済みなので圧縮関連のヘッダーは外す
+    headers.delete('Content-Encoding');
+    headers.delete('Content-Length');
+    headers.set('X-SW-Cached-At', String(Date.now()));
+    const cache = await caches.open(cacheName);
+    await cache.delete(key);
+    await cache.put(key, new Response(body, { status: response.status, statusText: response.statusText, headers }));
+}
+
+// シェルと静的アセット: キャッシュを即返し、シェルだけは裏で更新する
+async function shellResponse(event, request) {
+    const cache = await caches.open(SHELL_CACHE);
+    const key = request.mode === 'navigate' ? '/' : request;
+    const cached = await cache.match(key);
+    const update = fetch(request).then(res => {
+        if (res.ok) cache.put(key, res.clone());
+        return res;
+    });
+    if (cached) {
+        if (key === '/') event.waitUntil(update.catch(() => {}));
+        return cached;
+    }
+    return update;
+}
+
+// 初回描画用 API: 通常はネットワーク優先で、成功した応答を保存しておく。
+// X-SW-Cache-Only 付きのリクエストには保存済みの応答だけを返す (サーバーの応答を待たずに描画するため)
+async function apiResponse(event, request) {
+    const body = request.method === 'POST' ? await request.clone().text() : '';
+    const key = new Request(`${request.url}${request.url.includes('?') ? '&' : '?'}__body=${encodeURIComponent(body)}`);
+    const cache = await caches.open(API_CACHE);
+    if (request.headers.get('X-SW-Cache-Only')) {
+        return (await cache.match(key)) || new Response(null, { status: 504 });
+    }
+    try {
+        const res = await fetch(request);
+        if (res.ok) {
+            event.waitUntil(putWithTimestamp(API_CACHE, key, res.clone()).then(() => trimCache(API_CACHE, CONFIG.maxApiEntries)));
+        }
+        return res;
+    } catch (e) {
+        const cached = await cache.match(key);
+        if (cached) return cached;
+        throw e;
+    }
+}
+
+// サムネイル: キャッシュ優先。一定時間を過ぎたものは裏で取り直す
+async function thumbResponse(event, request) {
+    const cache = await caches.open(THUMB_CACHE);
+    const cached = await cache.match(request);
+    const refresh = () => fetch(request).then(async res => {
+        if (res.ok) {
+            await putWithTimestamp(THUMB_CACHE, request, res.clone());
+            await trimCache(THUMB_CACHE, CONFIG.maxThumbEntries);
+        }
+        return res;
+    });
+    if (cached) {
+        const age = Date.now() - Number(cached.headers.get('X-SW-Cached-At') || 0);
+        if (age > CONFIG.thumbMaxAgeMs) event.waitUntil(refresh().catch(() => {}));
+        return cached;
+    }
+    return refresh();
+}
+
+self.addEventListener('fetch', (event) => {
+    const request = event.request;
+    const url = new URL(request.url);
+    if (url.origin !== self.location.origin) return;
+
+    if (request.method === 'GET' && ((request.mode === 'navigate' && url.pathname === '/') || url.pathname.startsWith('/assets/'))) {
+        event.respondWith(shellResponse(event, request));
+    } else if (CONFIG.api.includes(url.pathname) && (request.method === 'GET' || url.pathname === '/api/batch')) {
+        event.respondWith(apiResponse(event, request));
+    } else if (request.method === 'GET' && url.pathname.startsWith('/preview/') && url.pathname.endsWith('.jpg')) {
+        event.respondWith(thumbResponse(event, request));
+    }
+});
+"""
+
+compile_ui()
+
+
 def open_browser():
     try:
         webbrowser.open(f'http://{LOCAL_IP}:5000')
@@ -2757,7 +6198,24 @@ def get_local_ip():
 LOCAL_IP = get_local_ip()
 
 if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[1] == '--import':
+        # python TikTok.py --import export.ndjson.gz
+        # 実行中のサーバーには DB の shared_generation 経由で反映を知らせる。進捗は stderr に出す
+        library_state['publish'] = True
+
+        def print_progress(status):
+            done = f" ({status['read_bytes'] * 100 // status['total_bytes']}%)" if status['total_bytes'] else ''
+            print(f"processed {status['processed']:,} matched {status['matched']:,} skipped {status['skipped']:,}{done}",
+                  file=sys.stderr, flush=True)
+
+        result = import_worker(sys.argv[2], progress=print_progress)
+        print(json.dumps(result, ensure_ascii=False))
+        sys.exit(1 if result['error'] else 0)
+
     Thread(target=open_browser, daemon=True).start()
+    if PROXY_ENABLED and FFMPEG_BIN:
+        Thread(target=proxy_scheduler, daemon=True).start()
+    Thread(target=current_suggest_index, daemon=True).start()
 
     app.run(
         host="0.0.0.0",
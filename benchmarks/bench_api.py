@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+API ベンチマーク (合成ライブラリ)
+
+  python benchmarks/bench_api.py --rows 100000 --save baseline.json
+  python benchmarks/bench_api.py --rows 100000 --compare baseline.json
+
+/api/videos (全ソート × 各フィルター)、/api/folders、/api/stats、/api/shorts を
+Flask のテストクライアントで叩き、p50/p95/p99 レイテンシとピークメモリを出す。
+"""
+
+import gc
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import sqlite3
+import tracemalloc
+from datetime import datetime
+from urllib.parse import urlencode
+
+from synthetic import LIBRARY_DEFAULTS, library_params, open_library, percentile
+
+
+def build_scenarios(tk, info, rows):
+    # (名前, URL) の一覧。/api/videos はソートとフィルターのすべての組み合わせ
+    filters = {
+        'all': {},
+        'folder': {'folder': info['top_folder']},
+        'favorites': {'favorites_only': 'true'},
+        'search': {'search': info['common_word']},
+        'tag': {'tag': info['top_tag']},
+        'duration': {'min_duration': 60, 'max_duration': 1200},
+        'min_height': {'min_height': 1080},
+        'playable': {'playable': 'true'},
+        'ext': {'ext': 'mkv,webm'},
+        'size_bucket': {'size_bucket': 'large'},
+        'deep_page': {'offset': rows // 2},
+    }
+    scenarios = []
+    for sort in tk.VIDEO_ORDER_MAP:
+        for fname, params in filters.items():
+            query = dict(params, sort=sort, limit=50)
+            scenarios.append((f"videos/{sort}/{fname}", f"/api/videos?{urlencode(query)}"))
+    scenarios += [
+        ('folders', '/api/folders'),
+        ('stats', '/api/stats'),
+        ('shorts', '/api/shorts?limit=15'),
+    ]
+    return scenarios
+
+
+def run_scenario(tk, client, url, repeat, warmup, cold):
+    # cold: 毎回世代番号を進め、書き込み直後と同じくクエリキャッシュを外した状態で測る
+    headers = {'Accept-Encoding': 'gzip'}
+    timings, errors, size = [], 0, 0
+    for i in range(warmup + repeat):
+        if cold:
+            tk.bump_generation()
+        t0 = time.perf_counter()
+        resp = client.get(url, headers=headers)
+        body = resp.get_data()
+        elapsed = time.perf_counter() - t0
+        if resp.status_code != 200:
+            errors += 1
+        if i >= warmup:
+            timings.append(elapsed * 1000)
+            size = len(body)
+
+    # メモリはトレースのオーバーヘッドが時間に乗らないよう別の 1 回で測る
+    if cold:
+        tk.bump_generation()
+    gc.collect()
+    tracemalloc.start()
+    client.get(url, headers=headers).get_data()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings.sort()
+    return {
+        'p50': percentile(timings, 50),
+        'p95': percentile(timings, 95),
+        'p99': percentile(timings, 99),
+        'mean': sum(timings) / len(timings),
+        'peak_kb': peak // 1024,
+        'bytes': size,
+        'errors': errors,
+    }
+
+
+def compare(results, baseline, threshold):
+    # p50/p95 が閾値の倍率を超えて悪化したものを回帰として返す
+    regressions = []
+    print(f"\n{'scenario':<48} {'p50 ms':>16} {'p95 ms':>16} {'peak KB':>16}")
+    for name, r in results.items():
+        b = baseline['results'].get(name)
+        if not b:
+            continue
+        cells = []
+        for key in ('p50', 'p95', 'peak_kb'):
+            ratio = r[key] / b[key] if b[key] else 1.0
+            cells.append(f"{b[key]:.1f}→{r[key]:.1f} {ratio:4.2f}x")
+            if key != 'peak_kb' and ratio > threshold:
+                regressions.append((name, key, ratio))
+        print(f"{name:<48} " + ' '.join(f"{c:>16}" for c in cells))
+    missing = sorted(set(baseline['results']) - set(results))
+    if missing:
+        print(f"\n{len(missing)} scenarios in the baseline were not run")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the video manager API against a synthetic library.')
+    parser.add_argument('--rows', type=int, default=LIBRARY_DEFAULTS['rows'], help='number of videos (10k-5M)')
+    parser.add_argument('--videos-per-folder', type=int, help='folder fan-out (videos per folder)')
+    parser.add_argument('--depth', type=int, help='folder nesting depth')
+    parser.add_argument('--tag-vocab', type=int, help='number of distinct tags')
+    parser.add_argument('--tag-skew', type=float, help='Zipf exponent of tag frequency')
+    parser.add_argument('--tagged-ratio', type=float)
+    parser.add_argument('--favorite-ratio', type=float)
+    parser.add_argument('--history-per-video', type=float, help='watch_history rows per video')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--root', help='directory for generated libraries (reused across runs)')
+    parser.add_argument('--regenerate', action='store_true')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--warm', action='store_true', help='keep the query cache between requests')
+    parser.add_argument('--only', help='run scenarios whose name contains this string')
+    parser.add_argument('--save', help='write results as a baseline JSON file')
+    parser.add_argument('--compare', help='compare against a baseline JSON file')
+    parser.add_argument('--threshold', type=float, default=1.25, help='regression ratio for --compare')
+    args = parser.parse_args()
+
+    params = library_params(
+        rows=args.rows, videos_per_folder=args.videos_per_folder, depth=args.depth, tag_vocab=args.tag_vocab,
+        tag_skew=args.tag_skew, tagged_ratio=args.tagged_ratio, favorite_ratio=args.favorite_ratio,
+        history_per_video=args.history_per_video, seed=args.seed,
+    )
+    tk, info = open_library(params, args.root, args.regenerate)
+    client = tk.app.test_client()
+
+    scenarios = [s for s in build_scenarios(tk, info, params['rows']) if not args.only or args.only in s[0]]
+    results = {}
+    started = time.time()
+    print(f"\n{'scenario':<48} {'p50':>8} {'p95':>8} {'p99':>8} {'peak KB':>9} {'bytes':>9}")
+    for name, url in scenarios:
+        r = run_scenario(tk, client, url, args.repeat, args.warmup, cold=not args.warm)
+        results[name] = r
+        flag = f"  {r['errors']} errors" if r['errors'] else ''
+        print(f"{name:<48} {r['p50']:8.2f} {r['p95']:8.2f} {r['p99']:8.2f} {r['peak_kb']:9,} {r['bytes']:9,}{flag}")
+
+    # ru_maxrss は Linux では KB、macOS ではバイト
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    max_rss_kb = max_rss // 1024 if sys.platform == 'darwin' else max_rss
+    print(f"\n{len(scenarios)} scenarios in {time.time() - started:.1f}s, peak RSS {max_rss_kb / 1024:.1f} MB")
+
+    report = {
+        'meta': {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'params': params,
+            'repeat': args.repeat,
+            'cache': 'warm' if args.warm else 'cold',
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'peak_rss_kb': max_rss_kb,
+        },
+        'results': results,
+    }
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"saved baseline to {args.save}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline['meta']['params'] != params or baseline['meta']['cache'] != report['meta']['cache']:
+            print("warning: baseline was recorded with different library parameters or cache mode")
+        regressions = compare(results, baseline, args.threshold)
+        for name, key, ratio in regressions:
+            print(f"REGRESSION {name} {key} {ratio:.2f}x")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+スキャナのベンチマーク (合成ディレクトリツリー)
+
+  python benchmarks/bench_scan.py --files 20000
+  python benchmarks/bench_scan.py --files 20000 --tmpfs --shapes mixed --save scan.json
+
+deep / wide / mixed の木を作り、scan_worker をフルスキャン・変更なしの再スキャン・
+一部変更後の再スキャンで実行して、フェーズ別時間、files/s、1 ファイルあたりの
+システムコール数、DB 書き込み量を出す。
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+from pathlib import Path
+
+from synthetic import load_app
+
+SHAPES = ('deep', 'wide', 'mixed')
+VIDEO_EXTS = ['.mp4', '.mkv', '.webm', '.mov', '.avi', '.ts']
+OTHER_EXTS = ['.jpg', '.nfo', '.txt', '.srt']
+# 数えるのは Python から呼ばれる分だけ (sqlite の I/O は /proc/self/io の値で見る)
+COUNTED_CALLS = ('stat', 'lstat', 'scandir', 'listdir', 'readlink', 'open', 'access')
+
+
+class SyscallCounter:
+    # os のファイル系関数を数えるラッパーに差し替える。pathlib / os.walk / realpath は呼び出し時に os.* を引くので拾える
+    def __init__(self):
+        self.counts = dict.fromkeys(COUNTED_CALLS, 0)
+        self.saved = {}
+
+    def __enter__(self):
+        for name in COUNTED_CALLS:
+            original = getattr(os, name)
+            self.saved[name] = original
+            setattr(os, name, self._wrap(name, original))
+        return self
+
+    def __exit__(self, *exc):
+        for name, original in self.saved.items():
+            setattr(os, name, original)
+
+    def _wrap(self, name, original):
+        counts = self.counts
+
+        def counted(*args, **kwargs):
+            counts[name] += 1
+            return original(*args, **kwargs)
+        return counted
+
+
+def proc_io():
+    # Linux のみ。syscr/syscw は read/write 系システムコール数、wchar は書き込んだバイト数
+    try:
+        with open('/proc/self/io') as f:
+            return {k: int(v) for k, v in (line.split(':') for line in f)}
+    except OSError:
+        return {}
+
+
+def touch(path, rng):
+    path.touch()
+    # mtime をばらけさせておく (再スキャンでの変更検出を現実に近づける)
+    t = time.time() - rng.randint(0, 365 * 86400)
+    os.utime(path, (t, t))
+
+
+def build_tree(root, shape, files, rng):
+    # 戻り値は作った動画ファイルのパス一覧
+    root.mkdir(parents=True)
+    videos = []
+    if shape == 'wide':
+        # 1 階層に多数のフォルダ。フォルダあたりの件数は sqrt(files)
+        per_dir = max(1, int(files ** 0.5))
+        for d in range((files + per_dir - 1) // per_dir):
+            folder = root / f"w{d:05d}"
+            folder.mkdir()
+            for i in range(min(per_dir, files - len(videos))):
+                videos.append(folder / f"clip_{i}{rng.choice(VIDEO_EXTS)}")
+    elif shape == 'deep':
+        # 深さ 32 の鎖を繰り返す。各階層に 2 件
+        depth, per_level = 32, 2
+        chain = 0
+        while len(videos) < files:
+            folder = root / f"chain{chain}"
+            for level in range(depth):
+                folder = folder / f"l{level}"
+                folder.mkdir(parents=True)
+                for i in range(per_level):
+                    videos.append(folder / f"v{i}{rng.choice(VIDEO_EXTS)}")
+                if len(videos) >= files:
+                    break
+            chain += 1
+    else:
+        # ランダムな木。動画以外のファイル、ファイル/ディレクトリへのシンボリックリンク、リンク切れ、
+        # ループするリンク、権限のないディレクトリを混ぜる
+        dirs = [root]
+        while len(videos) < files:
+            parent = rng.choice(dirs[-50:])
+            if len(parent.relative_to(root).parts) >= 8:
+                parent = root
+            folder = parent / f"m{len(dirs)}"
+            folder.mkdir()
+            dirs.append(folder)
+            for i in range(rng.randint(0, 20)):
+                if rng.random() < 0.3:
+                    (folder / f"extra_{i}{rng.choice(OTHER_EXTS)}").touch()
+                else:
+                    videos.append(folder / f"clip_{i}{rng.choice(VIDEO_EXTS)}")
+    for path in videos:
+        touch(path, rng)
+
+    if shape == 'mixed':
+        for i, folder in enumerate(rng.sample(dirs[1:], min(len(dirs) - 1, max(1, len(dirs) // 20)))):
+            target = rng.choice(videos)
+            (folder / f"link_{i}.mp4").symlink_to(target)
+            (folder / f"broken_{i}.mkv").symlink_to(folder / 'missing.mkv')
+            (folder / f"dirlink_{i}").symlink_to(rng.choice(dirs), target_is_directory=True)
+        (root / 'loop').symlink_to(root, target_is_directory=True)
+        denied = root / 'denied'
+        denied.mkdir()
+        for i in range(10):
+            (denied / f"hidden_{i}.mp4").touch()
+        denied.chmod(0)
+    return videos
+
+
+def mutate_tree(videos, ratio, rng):
+    # 再スキャン用に一部を追加・削除・更新する
+    n = max(1, int(len(videos) * ratio))
+    for path in rng.sample(videos, n):
+        path.unlink()
+        videos.remove(path)
+    for path in rng.sample(videos, n):
+        os.utime(path, None)
+    for i in range(n):
+        path = rng.choice(videos).with_name(f"added_{i}{rng.choice(VIDEO_EXTS)}")
+        if not path.exists():
+            path.touch()
+            videos.append(path)
+    return n
+
+
+def db_bytes(tk):
+    return sum(p.stat().st_size for p in tk.DB_DIR.glob('videos.db*'))
+
+
+def reset_library(tk):
+    conn = tk.get_db()
+    for table in ('videos', 'video_meta', 'media_info', 'folders', 'change_log'):
+        conn.execute(f"DELETE FROM {table}")
+    conn.commit()
+    conn.execute("VACUUM")
+    conn.close()
+
+
+def run_scan(tk, root):
+    io_before = proc_io()
+    size_before = db_bytes(tk)
+    with SyscallCounter() as counter:
+        t0 = time.perf_counter()
+        tk.scan_worker(str(root))
+        elapsed = time.perf_counter() - t0
+    io_after = proc_io()
+    status = dict(tk.scan_status)
+    files = status['processed'] or 1
+    calls = sum(counter.counts.values())
+    result = {
+        'files': status['processed'],
+        'elapsed': elapsed,
+        'files_per_s': status['processed'] / elapsed if elapsed else 0,
+        'phases': status['phases'],
+        'os_calls': counter.counts,
+        'os_calls_per_file': calls / files,
+        'db_bytes': db_bytes(tk),
+        'db_growth': db_bytes(tk) - size_before,
+    }
+    if io_before:
+        result['io'] = {k: io_after[k] - io_before[k] for k in ('syscr', 'syscw', 'wchar', 'write_bytes')}
+        result['io_syscalls_per_file'] = (result['io']['syscr'] + result['io']['syscw']) / files
+    return result
+
+
+def print_result(shape, mode, r):
+    ph = r['phases']
+    io = r.get('io', {})
+    print(f"{shape:<6} {mode:<12} {r['files']:>8,} {r['elapsed']:8.2f}s {r['files_per_s']:>9,.0f}/s "
+          f"walk {ph['walk']:6.2f} stat {ph['stat']:6.2f} insert {ph['insert']:6.2f} prune {ph['prune']:6.2f} vacuum {ph['vacuum']:6.2f}  "
+          f"os {r['os_calls_per_file']:5.1f}/file  rw-sys {r.get('io_syscalls_per_file', 0):5.1f}/file  "
+          f"written {io.get('wchar', 0) / 1024 ** 2:7.1f} MB  db {r['db_bytes'] / 1024 ** 2:6.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark scan_worker against synthetic directory trees.')
+    parser.add_argument('--files', type=int, default=10000, help='video files per tree')
+    parser.add_argument('--shapes', default=','.join(SHAPES), help='comma separated: ' + ', '.join(SHAPES))
+    parser.add_argument('--root', help='where to build trees (default: system temp dir)')
+    parser.add_argument('--tmpfs', action='store_true', help='build trees under /dev/shm')
+    parser.add_argument('--mutate', type=float, default=0.05, help='share of files added/removed/touched before the last rescan')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--keep', action='store_true', help='keep the generated trees')
+    parser.add_argument('--save', help='write results as JSON')
+    parser.add_argument('--compare', help='compare files/s against a saved JSON file')
+    parser.add_argument('--threshold', type=float, default=1.25, help='slowdown ratio reported as a regression')
+    args = parser.parse_args()
+
+    if args.tmpfs and not Path('/dev/shm').is_dir():
+        parser.error('/dev/shm is not available')
+    if args.root and not args.tmpfs:
+        Path(args.root).mkdir(parents=True, exist_ok=True)
+    base = Path(tempfile.mkdtemp(prefix='scan_bench_', dir='/dev/shm' if args.tmpfs else args.root))
+    if hasattr(os, 'geteuid') and os.geteuid() == 0:
+        print("note: running as root, so the permission-denied directory is still readable")
+
+    # DB はツリーと別の場所に置く (tmpfs 指定時もディスク上の DB への書き込み量を見る)
+    tk = load_app(Path(tempfile.mkdtemp(prefix='scan_bench_home_')))
+    # スキャン後のプローブ/リマックスは測定対象外
+    tk.FFPROBE_BIN = tk.FFMPEG_BIN = None
+
+    results = {}
+    try:
+        for shape in [s for s in args.shapes.split(',') if s]:
+            if shape not in SHAPES:
+                parser.error(f'unknown shape: {shape}')
+            rng = random.Random(args.seed)
+            root = base / shape
+            t0 = time.perf_counter()
+            videos = build_tree(root, shape, args.files, rng)
+            print(f"built {shape} tree: {len(videos):,} videos in {time.perf_counter() - t0:.1f}s")
+
+            reset_library(tk)
+            runs = {'full': run_scan(tk, root), 'rescan': run_scan(tk, root)}
+            changed = mutate_tree(videos, args.mutate, rng)
+            runs[f'rescan+{changed}'] = run_scan(tk, root)
+            for mode, r in runs.items():
+                print_result(shape, mode, r)
+            results[shape] = {('rescan_changed' if mode.startswith('rescan+') else mode): r for mode, r in runs.items()}
+    finally:
+        if not args.keep:
+            for denied in base.glob('*/denied'):
+                denied.chmod(0o755)
+            shutil.rmtree(base, ignore_errors=True)
+        shutil.rmtree(tk.DB_DIR, ignore_errors=True)
+
+    report = {'files': args.files, 'tmpfs': args.tmpfs, 'mutate': args.mutate, 'results': results}
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"saved results to {args.save}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        slow = []
+        for shape, runs in results.items():
+            for mode, r in runs.items():
+                b = baseline['results'].get(shape, {}).get(mode)
+                if not b or not r['files_per_s']:
+                    continue
+                ratio = b['files_per_s'] / r['files_per_s']
+                print(f"{shape:<6} {mode:<14} {b['files_per_s']:>9,.0f}/s → {r['files_per_s']:>9,.0f}/s  {ratio:4.2f}x slower")
+                if ratio > args.threshold:
+                    slow.append((shape, mode))
+        return 1 if slow else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
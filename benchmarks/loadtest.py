@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+同時接続の負荷テスト (ショート視聴 / ライブラリ閲覧 / 一括タグ付け + バックグラウンドスキャン)
+
+  python benchmarks/loadtest.py --rows 20000 --shorts 8 --library 4 --bulk 1 --duration 60
+  python benchmarks/loadtest.py --url http://192.168.0.10:5000 --scan-dir /videos --duration 60
+
+既定では合成ライブラリ (スパースファイル付き) を作ってアプリをこのプロセス内で起動する。
+エンドポイントごとのスループット、エラー率、テールレイテンシと `database is locked` の発生数を出す。
+"""
+
+import sys
+import json
+import time
+import random
+import secrets
+import logging
+import argparse
+import threading
+import http.client
+from urllib.parse import urlencode, urlsplit
+
+from synthetic import LIBRARY_DEFAULTS, library_params, open_library, percentile
+
+RANGE_CHUNK = 256 * 1024      # 1 回の Range 要求で読むバイト数
+SHORTS_PAGE = 15
+LIBRARY_PAGE = 50
+BULK_IDS = 50
+LOCKED_MESSAGE = 'database is locked'
+
+
+class Recorder:
+    # クライアントごとに持ち、最後にまとめる (計測中はロック不要)
+    def __init__(self):
+        self.latency = {}
+        self.errors = {}
+        self.throttled = {}
+        self.bytes = {}
+        self.locked = 0
+
+    def add(self, endpoint, ms, status, size, body=b''):
+        self.latency.setdefault(endpoint, []).append(ms)
+        self.bytes[endpoint] = self.bytes.get(endpoint, 0) + size
+        if status == 503:
+            self.throttled[endpoint] = self.throttled.get(endpoint, 0) + 1
+        elif status is None or status >= 500:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+            if LOCKED_MESSAGE.encode() in body:
+                self.locked += 1
+
+    def merge(self, other):
+        for name in ('latency', 'errors', 'throttled', 'bytes'):
+            mine = getattr(self, name)
+            for k, v in getattr(other, name).items():
+                mine[k] = mine.get(k, [] if name == 'latency' else 0) + v
+        self.locked += other.locked
+
+
+class LockedLogCounter(logging.Handler):
+    # サーバー側で記録された例外のうち database is locked を数える (アプリを同じプロセスで動かすときのみ)
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.count = 0
+
+    def emit(self, record):
+        text = record.getMessage()
+        if record.exc_info and record.exc_info[1] is not None:
+            text += str(record.exc_info[1])
+        if LOCKED_MESSAGE in text:
+            self.count += 1
+
+
+class VirtualClient(threading.Thread):
+    def __init__(self, kind, index, target, deadline, think, seed, source_ip, sorts):
+        super().__init__(daemon=True, name=f"{kind}-{index}")
+        self.kind = kind
+        self.sorts = sorts
+        self.target = target
+        self.deadline = deadline
+        self.think = think
+        self.rng = random.Random(seed)
+        self.source_ip = source_ip
+        self.recorder = Recorder()
+        self.conn = None
+
+    def connect(self):
+        host, port = self.target
+        source = (self.source_ip, 0) if self.source_ip else None
+        self.conn = http.client.HTTPConnection(host, port, timeout=30, source_address=source)
+
+    def request(self, endpoint, method, path, body=None, headers=None):
+        # endpoint は集計用の名前 (/video/123 → /video)
+        headers = dict(headers or {})
+        if body is not None:
+            body = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        t0 = time.perf_counter()
+        try:
+            if self.conn is None:
+                self.connect()
+            self.conn.request(method, path, body=body, headers=headers)
+            resp = self.conn.getresponse()
+            data = resp.read()
+            status = resp.status
+        except (OSError, http.client.HTTPException):
+            # 接続を張り直して続ける
+            if self.conn:
+                self.conn.close()
+            self.conn = None
+            data, status = b'', None
+        self.recorder.add(endpoint, (time.perf_counter() - t0) * 1000, status, len(data), data)
+        return status, data
+
+    def get_json(self, endpoint, path):
+        status, data = self.request(endpoint, 'GET', path)
+        if status != 200:
+            return None
+        try:
+            return json.loads(data)
+        except ValueError:
+            return None
+
+    def pause(self, lo, hi):
+        if self.think:
+            time.sleep(self.rng.uniform(lo, hi) * self.think)
+
+    def run(self):
+        try:
+            while time.time() < self.deadline:
+                getattr(self, f"run_{self.kind}")()
+        finally:
+            if self.conn:
+                self.conn.close()
+
+    def run_shorts(self):
+        # ショートフィードを 1 ページ分スワイプする: 表示中を再生し、次を低優先度で先読み
+        session = secrets.token_hex(8)
+        data = self.get_json('/api/shorts', f"/api/shorts?{urlencode({'limit': SHORTS_PAGE, 'session': session})}")
+        shorts = (data or {}).get('shorts') or []
+        if not shorts:
+            self.pause(0.5, 1.0)
+            return
+        for i, short in enumerate(shorts):
+            if time.time() >= self.deadline:
+                return
+            vid = short['id']
+            self.request('/video', 'GET', f"/video/{vid}", headers={'Range': f"bytes=0-{RANGE_CHUNK - 1}"})
+            if i + 1 < len(shorts):
+                self.request('/video (preload)', 'GET', f"/video/{shorts[i + 1]['id']}",
+                             headers={'Range': f"bytes=0-{RANGE_CHUNK // 4 - 1}", 'X-Stream-Priority': 'low'})
+            watched = self.rng.uniform(0.5, 20)
+            if watched > 5:
+                # しばらく見たら続きを読む
+                start = RANGE_CHUNK * self.rng.randint(1, 8)
+                self.request('/video', 'GET', f"/video/{vid}", headers={'Range': f"bytes={start}-{start + RANGE_CHUNK - 1}"})
+            now = int(time.time())
+            events = [{'type': 'play', 'video_id': vid, 'ts': now}, {'type': 'position', 'video_id': vid, 'position': watched, 'ts': now}]
+            if watched < 3:
+                events.append({'type': 'skip', 'video_id': vid, 'ts': now})
+            self.request('/api/events', 'POST', '/api/events', body={'events': events})
+            self.pause(0.3, 1.5)
+
+    def run_library(self):
+        # ランダムなソート/フィルターで数ページ読み進める
+        query = {'sort': self.rng.choice(self.sorts), 'limit': LIBRARY_PAGE}
+        roll = self.rng.random()
+        if roll < 0.2:
+            query['favorites_only'] = 'true'
+        elif roll < 0.4:
+            query['ext'] = self.rng.choice(['mp4', 'mkv', 'webm'])
+        elif roll < 0.5:
+            query['playable'] = 'true'
+        if self.rng.random() < 0.3:
+            self.request('/api/stats', 'GET', '/api/stats')
+            self.request('/api/folders', 'GET', '/api/folders')
+        for page in range(self.rng.randint(1, 6)):
+            if time.time() >= self.deadline:
+                return
+            query['offset'] = page * LIBRARY_PAGE
+            data = self.get_json('/api/videos', f"/api/videos?{urlencode(query)}")
+            if page == 0:
+                facets = {k: v for k, v in query.items() if k not in ('sort', 'limit', 'offset', 'ext')}
+                self.request('/api/facets', 'GET', f"/api/facets?{urlencode(facets)}")
+            if not data or len(data['videos']) < LIBRARY_PAGE:
+                break
+            self.pause(0.5, 2.0)
+        self.pause(1.0, 3.0)
+
+    def run_bulk(self):
+        # 表示中のページから選んでタグを付け、しばらくして外す
+        data = self.get_json('/api/videos', f"/api/videos?{urlencode({'sort': 'modified_desc', 'limit': 200, 'offset': self.rng.randint(0, 20) * 200})}")
+        ids = [v['id'] for v in (data or {}).get('videos', [])]
+        if not ids:
+            self.pause(1.0, 2.0)
+            return
+        picked = self.rng.sample(ids, min(BULK_IDS, len(ids)))
+        tag = f"load_{self.rng.randint(0, 9)}"
+        self.request('/api/bulk_action', 'POST', '/api/bulk_action', body={'action': 'add_tags', 'video_ids': picked, 'tags': tag})
+        self.pause(1.0, 3.0)
+        self.request('/api/bulk_action', 'POST', '/api/bulk_action', body={'action': 'remove_tags', 'video_ids': picked, 'tags': tag})
+        self.pause(2.0, 5.0)
+
+
+def scan_loop(target, scan_dir, deadline, results):
+    # 締め切りまでスキャンを繰り返す。1 回ごとの所要時間とフェーズを記録する
+    conn = http.client.HTTPConnection(*target, timeout=30)
+    try:
+        while time.time() < deadline:
+            t0 = time.time()
+            conn.request('POST', '/api/scan', body=json.dumps({'directory': scan_dir}), headers={'Content-Type': 'application/json'})
+            conn.getresponse().read()
+            status = {'is_scanning': True}
+            while status.get('is_scanning'):
+                time.sleep(0.5)
+                conn.request('GET', '/api/scan/status')
+                status = json.loads(conn.getresponse().read())
+            results.append({'elapsed': time.time() - t0, 'files': status.get('processed'), 'phases': status.get('phases')})
+    except (OSError, http.client.HTTPException, ValueError) as e:
+        results.append({'error': str(e)})
+    finally:
+        conn.close()
+
+
+def start_server(tk):
+    # 本番と同じくスレッドごとに 1 リクエストを処理する werkzeug サーバーを空きポートで起動する
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, tk.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def report(total, duration, lock_log, scans):
+    print(f"\n{'endpoint':<20} {'reqs':>7} {'req/s':>7} {'err%':>6} {'503':>5} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8} {'MB':>7}")
+    rows = {}
+    for endpoint in sorted(total.latency):
+        lat = sorted(total.latency[endpoint])
+        n = len(lat)
+        errors = total.errors.get(endpoint, 0)
+        row = {
+            'requests': n,
+            'rps': n / duration,
+            'error_rate': errors / n,
+            'throttled': total.throttled.get(endpoint, 0),
+            'p50': percentile(lat, 50),
+            'p95': percentile(lat, 95),
+            'p99': percentile(lat, 99),
+            'max': lat[-1],
+            'bytes': total.bytes.get(endpoint, 0),
+        }
+        rows[endpoint] = row
+        print(f"{endpoint:<20} {n:>7,} {row['rps']:7.1f} {row['error_rate'] * 100:6.2f} {row['throttled']:>5} "
+              f"{row['p50']:8.1f} {row['p95']:8.1f} {row['p99']:8.1f} {row['max']:8.1f} {row['bytes'] / 1024 ** 2:7.1f}")
+
+    requests = sum(r['requests'] for r in rows.values())
+    errors = sum(total.errors.values())
+    locked = total.locked + (lock_log.count if lock_log else 0)
+    print(f"\n{requests:,} requests in {duration:.1f}s ({requests / duration:.1f} req/s), "
+          f"{errors:,} errors, {LOCKED_MESSAGE}: {locked}{'' if lock_log else ' (client-visible only)'}")
+    done = [s for s in scans if 'elapsed' in s]
+    if done:
+        print(f"{len(done)} background scans, mean {sum(s['elapsed'] for s in done) / len(done):.1f}s")
+    for s in scans:
+        if 'error' in s:
+            print(f"scan loop stopped: {s['error']}")
+    return {'duration': duration, 'requests': requests, 'errors': errors, 'locked': locked, 'endpoints': rows, 'scans': scans}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent load test for the video manager.')
+    parser.add_argument('--url', help='target a running server instead of starting one in-process')
+    parser.add_argument('--rows', type=int, default=LIBRARY_DEFAULTS['rows'], help='synthetic library size (in-process only)')
+    parser.add_argument('--root', help='directory for generated libraries')
+    parser.add_argument('--shorts', type=int, default=8, help='virtual clients swiping shorts')
+    parser.add_argument('--library', type=int, default=4, help='virtual clients paging the library')
+    parser.add_argument('--bulk', type=int, default=1, help='virtual clients bulk-tagging')
+    parser.add_argument('--duration', type=float, default=30, help='seconds')
+    parser.add_argument('--think', type=float, default=1.0, help='think-time multiplier (0 = no pauses)')
+    parser.add_argument('--no-scan', action='store_true', help='do not run scans in the background')
+    parser.add_argument('--scan-dir', help='directory to scan (defaults to the synthetic media directory)')
+    parser.add_argument('--same-ip', action='store_true', help='send every client from 127.0.0.1 instead of 127.0.0.N')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save', help='write the report as JSON')
+    args = parser.parse_args()
+
+    server = lock_log = None
+    scan_dir = args.scan_dir
+    if args.url:
+        parts = urlsplit(args.url)
+        target = (parts.hostname, parts.port or 80)
+        sorts = ['modified_desc', 'name_asc', 'size_desc', 'play_count_desc']
+        if not args.no_scan and not scan_dir:
+            parser.error('--scan-dir is required with --url unless --no-scan is given')
+    else:
+        tk, info = open_library(library_params(rows=args.rows, materialize=True), args.root)
+        # スキャン後のプローブ/リマックスは対象外 (ffmpeg の有無で結果が変わらないように)
+        tk.FFPROBE_BIN = tk.FFMPEG_BIN = None
+        lock_log = LockedLogCounter()
+        logging.getLogger('').addHandler(lock_log)
+        server = start_server(tk)
+        target = ('127.0.0.1', server.server_port)
+        sorts = list(tk.VIDEO_ORDER_MAP)
+        scan_dir = scan_dir or info['media_root']
+    # ストリーム数の制限はクライアント IP ごとなので、ループバックの別アドレスから接続して端末を分ける
+    local = target[0] in ('127.0.0.1', 'localhost') and not args.same_ip and sys.platform.startswith('linux')
+
+    deadline = time.time() + args.duration
+    clients = []
+    for kind, count in (('shorts', args.shorts), ('library', args.library), ('bulk', args.bulk)):
+        for i in range(count):
+            source_ip = f"127.0.0.{len(clients) + 2}" if local else None
+            clients.append(VirtualClient(kind, i, target, deadline, args.think, args.seed * 1000 + len(clients), source_ip, sorts))
+
+    scans = []
+    scanner = None
+    if not args.no_scan:
+        scanner = threading.Thread(target=scan_loop, args=(target, scan_dir, deadline, scans), daemon=True)
+        scanner.start()
+    print(f"running {len(clients)} clients against {target[0]}:{target[1]} for {args.duration:.0f}s"
+          f"{'' if args.no_scan else f' while scanning {scan_dir}'}")
+    started = time.time()
+    for c in clients:
+        c.start()
+    for c in clients:
+        c.join()
+    if scanner:
+        scanner.join(timeout=60)
+    duration = time.time() - started
+
+    total = Recorder()
+    for c in clients:
+        total.merge(c.recorder)
+    result = report(total, duration, lock_log, scans)
+    if server:
+        server.shutdown()
+    if args.save:
+        result['clients'] = {'shorts': args.shorts, 'library': args.library, 'bulk': args.bulk, 'think': args.think}
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+        print(f"saved report to {args.save}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ベンチマーク共通: 合成ライブラリ (videos.db) の生成と TikTok モジュールの読み込み
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import hashlib
+import logging
+import itertools
+import tempfile
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+BENCH_ROOT = Path(tempfile.gettempdir()) / 'video_manager_bench'
+
+# 合成ライブラリの既定値 (行数以外は 10k〜5M 行で同じ分布になるよう比率で持つ)
+LIBRARY_DEFAULTS = {
+    'rows': 10000,
+    'videos_per_folder': 200,  # フォルダ数 = rows / これ
+    'depth': 3,                # フォルダ階層の深さ
+    'folder_skew': 2.0,        # 大きいほど一部のフォルダに動画が集中する
+    'tag_vocab': 300,
+    'tag_skew': 1.1,           # タグ出現頻度の Zipf 指数
+    'tagged_ratio': 0.3,
+    'favorite_ratio': 0.05,
+    'played_ratio': 0.4,
+    'history_per_video': 1.0,  # watch_history の行数 = rows * これ
+    'media_ratio': 0.9,        # media_info (プローブ済み) の割合
+    'materialize': False,      # True なら各動画を実際の (スパース) ファイルとして作る
+    'seed': 1,
+}
+
+EXT_WEIGHTS = [('mp4', 60), ('mkv', 15), ('webm', 8), ('mov', 6), ('avi', 5), ('ts', 4), ('wmv', 2)]
+RESOLUTIONS = [((1920, 1080), 45), ((1280, 720), 30), ((3840, 2160), 10), ((854, 480), 10), ((640, 360), 5)]
+CODECS = {'mp4': 'h264', 'mkv': 'hevc', 'webm': 'vp9', 'mov': 'h264', 'avi': 'mpeg4', 'ts': 'h264', 'wmv': 'wmv3'}
+SYLLABLES = ['ka', 'ki', 'ku', 'ke', 'ko', 'sa', 'shi', 'su', 'ta', 'chi', 'na', 'ni', 'ha', 'hi', 'ma', 'mi', 'ra', 'ri', 'yo', 'n']
+INSERT_BATCH = 20000
+MATERIALIZE_MAX_BYTES = 64 * 1024 * 1024  # スパースファイルの上限サイズ
+
+
+def library_params(**overrides):
+    params = dict(LIBRARY_DEFAULTS)
+    params.update({k: v for k, v in overrides.items() if v is not None})
+    return params
+
+
+def library_home(params, root=None):
+    # 同じパラメータなら同じ場所を使い、生成済みの DB を使い回す
+    digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:12]
+    return Path(root or BENCH_ROOT) / f"lib_{params['rows']}_{digest}"
+
+
+def load_app(home):
+    # DB_DIR は import 時に決まるので、環境変数を先に設定してから読み込む
+    os.environ['VIDEO_MANAGER_HOME'] = str(home)
+    Path(home).mkdir(parents=True, exist_ok=True)
+    if str(REPO_ROOT) not in sys.path:
+        sys.path.insert(0, str(REPO_ROOT))
+    import TikTok
+    logging.getLogger('').setLevel(logging.WARNING)
+    return TikTok
+
+
+def percentile(sorted_values, q):
+    # 最近接順位法。sorted_values は昇順
+    if not sorted_values:
+        return None
+    k = max(0, min(len(sorted_values) - 1, math.ceil(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+def weighted(rng, pairs):
+    values, weights = zip(*pairs)
+    cum = list(itertools.accumulate(weights))
+    return lambda: rng.choices(values, cum_weights=cum)[0]
+
+
+def generate_library(tk, params, log=print, path_root='/bench'):
+    # tk は load_app() で読み込んだ TikTok モジュール。init_db() 済みの空の DB に書き込む
+    rng = random.Random(params['seed'])
+    rows = params['rows']
+    n_folders = max(1, rows // params['videos_per_folder'])
+    now = int(time.time())
+    started = time.time()
+
+    words = [''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(2000)]
+    tags = [f"tag_{w}" for w in rng.sample(words, min(params['tag_vocab'], len(words)))]
+    tag_cum = list(itertools.accumulate(1 / (k + 1) ** params['tag_skew'] for k in range(len(tags))))
+    pick_ext = weighted(rng, EXT_WEIGHTS)
+    pick_res = weighted(rng, RESOLUTIONS)
+
+    folders = []
+    for i in range(n_folders):
+        parents = [words[(i * 7919 + j * 104729) % len(words)] for j in range(params['depth'] - 1)]
+        folders.append(f"{path_root}/" + '/'.join(parents + [f"{words[i % len(words)]}_{i}"]))
+
+    conn = tk.get_db()
+    conn.execute("PRAGMA synchronous=OFF")
+    # 変更フィードのトリガーは大量投入では不要なので外し、最後に作り直す
+    for r in conn.execute("SELECT name FROM sqlite_master WHERE type='trigger' AND name LIKE 'trg_%_log'").fetchall():
+        conn.execute(f"DROP TRIGGER {r['name']}")
+
+    def video_rows():
+        for vid in range(1, rows + 1):
+            folder = folders[int(n_folders * rng.random() ** params['folder_skew'])]
+            ext = pick_ext()
+            name = f"{rng.choice(words)}_{rng.choice(words)}_{vid}.{ext}"
+            size = int(rng.lognormvariate(19.5, 1.2))
+            yield (vid, f"{folder}/{name}", size, now - rng.randint(0, 5 * 365 * 86400), folder, name, ext)
+
+    def meta_rows():
+        for vid in range(1, rows + 1):
+            tagged = rng.random() < params['tagged_ratio']
+            favorite = rng.random() < params['favorite_ratio']
+            played = rng.random() < params['played_ratio']
+            if not (tagged or favorite or played):
+                continue
+            vtags = ','.join(sorted(set(rng.choices(tags, cum_weights=tag_cum, k=rng.randint(1, 3))))) if tagged else ''
+            plays = int(rng.expovariate(0.3)) + 1 if played else 0
+            yield (vid, plays, int(favorite), vtags, now - rng.randint(0, 365 * 86400) if played else None)
+
+    def media_rows():
+        for vid in range(1, rows + 1):
+            if rng.random() >= params['media_ratio']:
+                continue
+            (w, h), ext = pick_res(), pick_ext()
+            vcodec = CODECS[ext]
+            playable = int(ext in ('mp4', 'webm') and vcodec in ('h264', 'vp9'))
+            yield (vid, round(rng.lognormvariate(6.0, 1.0), 2), w, h, ext, vcodec, 'aac', int(rng.lognormvariate(15.5, 0.6)), playable, now)
+
+    def history_rows():
+        n = int(rows * params['history_per_video'])
+        for _ in range(n):
+            # よく見る動画に偏らせる
+            yield (int(rows * rng.random() ** 3) + 1, now - rng.randint(0, 365 * 86400))
+
+    inserts = [
+        ('videos', "INSERT INTO videos (id, path, size, modified, folder, filename, ext) VALUES (?, ?, ?, ?, ?, ?, ?)", video_rows()),
+        ('video_meta', "INSERT INTO video_meta (video_id, play_count, favorite, tags, last_played) VALUES (?, ?, ?, ?, ?)", meta_rows()),
+        ('media_info', "INSERT INTO media_info (video_id, duration, width, height, container, vcodec, acodec, bitrate, playable, probed_mtime) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", media_rows()),
+        ('watch_history', "INSERT INTO watch_history (video_id, watched_at) VALUES (?, ?)", history_rows()),
+    ]
+    for table, sql, source in inserts:
+        count = 0
+        while True:
+            batch = list(itertools.islice(source, INSERT_BATCH))
+            if not batch:
+                break
+            conn.executemany(sql, batch)
+            count += len(batch)
+        conn.commit()
+        log(f"  {table}: {count:,} rows ({time.time() - started:.1f}s)")
+    # 再スキャンでヘッダー解析がやり直しにならないよう、プローブ時の mtime を揃える
+    conn.execute("UPDATE media_info SET probed_mtime = (SELECT modified FROM videos WHERE id = media_info.video_id)")
+
+    if params['materialize']:
+        materialize_files(conn)
+        log(f"  materialized files under {path_root} ({time.time() - started:.1f}s)")
+
+    tk.rebuild_folders(conn)
+    tk.init_change_log(conn)
+    conn.execute("DELETE FROM change_log")
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+    tk.bump_generation()
+    log(f"  generated {rows:,} videos in {n_folders:,} folders ({time.time() - started:.1f}s)")
+    return {'folders': folders, 'tags': tags, 'words': words}
+
+
+def materialize_files(conn):
+    # /video で実際に配信できるよう、DB の各行をスパースファイルとして作る (ディスクはほぼ消費しない)
+    made = set()
+    for r in conn.execute("SELECT path, size, modified FROM videos"):
+        folder = os.path.dirname(r['path'])
+        if folder not in made:
+            os.makedirs(folder, exist_ok=True)
+            made.add(folder)
+        with open(r['path'], 'wb') as f:
+            f.truncate(min(r['size'], MATERIALIZE_MAX_BYTES))
+        os.utime(r['path'], (r['modified'], r['modified']))
+    conn.execute("UPDATE videos SET size = MIN(size, ?)", (MATERIALIZE_MAX_BYTES,))
+
+
+def open_library(params, root=None, regenerate=False, log=print):
+    # 生成済みなら使い回す。戻り値は (TikTok モジュール, 生成情報)
+    home = library_home(params, root)
+    marker = home / 'library.json'
+    # 生成途中で止まった DB (library.json がない) は作り直す
+    if regenerate or not marker.exists():
+        for name in ('videos.db', 'videos.db-wal', 'videos.db-shm', 'library.json'):
+            (home / name).unlink(missing_ok=True)
+        shutil.rmtree(home / 'media', ignore_errors=True)
+    tk = load_app(home)
+    if marker.exists():
+        info = json.loads(marker.read_text())
+        log(f"reusing synthetic library at {home}")
+    else:
+        log(f"generating synthetic library at {home}")
+        info = generate_library(tk, params, log, str(home / 'media') if params['materialize'] else '/bench')
+        info = {'params': params, 'top_folder': info['folders'][0], 'top_tag': info['tags'][0], 'common_word': info['words'][0],
+                'media_root': str(home / 'media') if params['materialize'] else None}
+        marker.write_text(json.dumps(info, ensure_ascii=False))
+    return tk, info